@@ -1,54 +1,130 @@
-import random
-from typing import Tuple
+from typing import Dict, List, Optional, Tuple
+from llm import gen_usage
+from population import Lexicon
 from prompts import nl_prompt, schema_prompt
 from schema_enforce import parse_schema, extract_nl_name
 
+REMIND = "Follow EXACTLY one line: @say {name: Ck}"
+
+
+def decode_mode(condition: str, constrained: bool, stop_newline: bool) -> str:
+    parts = []
+    if constrained and condition == "schema":
+        parts.append("grammar")
+    if stop_newline:
+        parts.append("stop")
+    return "+".join(parts) if parts else "free"
+
+
+def call_info(calls: list, kept) -> Dict:
+    # Telemetry summed over the first attempt and any retry; tokens of the kept text come from usage when known
+    info = {"retry": len(calls) > 1}
+    for k in ("prompt_tokens", "completion_tokens", "prompt_ms", "decode_ms"):
+        vals = [gen_usage(c)[k] for c in calls]
+        info[k] = None if any(v is None for v in vals) else sum(vals)
+    info["kept_tokens"] = gen_usage(kept)["completion_tokens"]
+    return info
+
+
+def _tokens(llm, raw, info: Dict) -> int:
+    n = info.pop("kept_tokens")
+    return int(n) if n is not None else llm.tokenize_count(raw)
+
+
+def gen_kwargs(condition: str, lexicon: Lexicon, constrained: bool, stop_newline: bool) -> Dict:
+    # Optional decoding constraints; only passed to the backend when set
+    kw = {}
+    if constrained and condition == "schema":
+        kw["grammar"] = lexicon.grammar
+    if stop_newline:
+        kw["stop"] = ["\n"]
+    return kw
+
 
 class Agent:
-    def __init__(self, agent_id: int, llm, condition: str, lexicon: list, payload_limit: int, seed: int):
+    # Per-agent state lives in population.PopulationState; an Agent only builds and decodes requests.
+    # Agents of a run share the lexicon tables and decoding kwargs
+    __slots__ = ("agent_id", "llm", "condition", "lexicon", "payload_limit", "gen_kwargs")
+
+    def __init__(self, agent_id: int, llm, condition: str, lexicon, payload_limit: int, constrained: bool = False, stop_newline: bool = False, kwargs: Optional[Dict] = None):
         self.agent_id = agent_id
         self.llm = llm
         self.condition = condition
-        self.lexicon = list(lexicon)
+        self.lexicon = lexicon if isinstance(lexicon, Lexicon) else Lexicon(lexicon)
         self.payload_limit = payload_limit
-        self.rng = random.Random(seed ^ (agent_id * 1315423911))
+        self.gen_kwargs = kwargs if kwargs is not None else gen_kwargs(condition, self.lexicon, constrained, stop_newline)
 
-    def _fallback(self) -> str:
-        return self.rng.choice(self.lexicon)
+    @property
+    def decode_mode(self) -> str:
+        return decode_mode(self.condition, "grammar" in self.gen_kwargs, "stop" in self.gen_kwargs)
 
-    def propose(self, round_id: int, proposed_name: str, max_new_tokens: int, temperature: float, top_p: float, repeat_penalty: float, base_seed: int) -> Tuple[str, str, int, bool]:
-        prompt = None
-        raw = None
-        name = None
-        compliant = None
+    def first_request(self, round_id: int, proposed_name: str, base_seed: int) -> Tuple[str, int]:
         if self.condition == "schema":
             prompt = schema_prompt(self.agent_id, round_id, proposed_name, self.payload_limit)
-            valid = set(x.upper() for x in self.lexicon)
-            raw = self.llm.generate(prompt, max_new_tokens, temperature, top_p, repeat_penalty, seed=base_seed ^ (self.agent_id * 1013904223) ^ (round_id * 1664525))
-            n1, ok1 = parse_schema(raw)
-            if n1 and n1.upper() in valid:
-                name = n1.upper()
-                compliant = ok1
-            else:
-                # Single reminder retry
-                remind = "Follow EXACTLY one line: @say {name: Ck}"
-                raw2 = self.llm.generate(prompt + "\n" + remind, max_new_tokens, temperature, top_p, repeat_penalty, seed=(base_seed + 997) ^ (self.agent_id * 1013904223) ^ (round_id * 1664525))
-                n2, ok2 = parse_schema(raw2)
-                if n2 and n2.upper() in valid:
-                    raw = raw2
-                    name = n2.upper()
-                    compliant = ok2
-                else:
-                    # Try to salvage a valid name from free text if present; otherwise undecodable (None)
-                    salv = extract_nl_name(raw2, valid) or extract_nl_name(raw, valid)
-                    name = salv if salv else None
-                    compliant = False
         else:
             prompt = nl_prompt(self.agent_id, round_id, proposed_name)
-            raw = self.llm.generate(prompt, max_new_tokens, temperature, top_p, repeat_penalty, seed=base_seed ^ (self.agent_id * 1013904223) ^ (round_id * 1664525))
-            valid = set([x.upper() for x in self.lexicon])
-            picked = extract_nl_name(raw, valid)
-            name = picked if picked else None
-            compliant = True
-        tokens = self.llm.tokenize_count(raw)
-        return name, raw, tokens, compliant
+        return prompt, base_seed ^ (self.agent_id * 1013904223) ^ (round_id * 1664525)
+
+    def retry_request(self, prompt: str, round_id: int, base_seed: int) -> Tuple[str, int]:
+        return prompt + "\n" + REMIND, (base_seed + 997) ^ (self.agent_id * 1013904223) ^ (round_id * 1664525)
+
+    def decode_first(self, raw: str) -> Tuple[Optional[str], bool, bool]:
+        # Returns (name, compliant, needs_retry)
+        valid = self.lexicon.valid
+        if self.condition == "schema":
+            n1, ok1 = parse_schema(raw)
+            if n1 and n1.upper() in valid:
+                return n1.upper(), ok1, False
+            return None, False, True
+        picked = extract_nl_name(raw, valid)
+        return (picked if picked else None), True, False
+
+    def decode_retry(self, raw: str, raw2: str) -> Tuple[str, Optional[str], bool]:
+        # Returns (raw, name, compliant) after the single reminder retry
+        valid = self.lexicon.valid
+        n2, ok2 = parse_schema(raw2)
+        if n2 and n2.upper() in valid:
+            return raw2, n2.upper(), ok2
+        # Try to salvage a valid name from free text if present; otherwise undecodable (None)
+        salv = extract_nl_name(raw2, valid) or extract_nl_name(raw, valid)
+        return raw, (salv if salv else None), False
+
+    def propose(self, round_id: int, proposed_name: str, max_new_tokens: int, temperature: float, top_p: float, repeat_penalty: float, base_seed: int) -> Tuple[str, str, int, bool, Dict]:
+        prompt, seed = self.first_request(round_id, proposed_name, base_seed)
+        raw = self.llm.generate(prompt, max_new_tokens, temperature, top_p, repeat_penalty, seed=seed, **self.gen_kwargs)
+        calls = [raw]
+        name, compliant, retry = self.decode_first(raw)
+        if retry:
+            # Single reminder retry
+            prompt2, seed2 = self.retry_request(prompt, round_id, base_seed)
+            raw2 = self.llm.generate(prompt2, max_new_tokens, temperature, top_p, repeat_penalty, seed=seed2, **self.gen_kwargs)
+            calls.append(raw2)
+            raw, name, compliant = self.decode_retry(raw, raw2)
+        info = call_info(calls, raw)
+        return name, str(raw), _tokens(self.llm, raw, info), compliant, info
+
+
+def propose_batch(llm, requests: List[tuple], max_new_tokens: int, temperature: float, top_p: float, repeat_penalty: float) -> List[Tuple[str, str, int, bool, Dict]]:
+    # requests: (agent, round_id, proposed_name, base_seed); same results as calling Agent.propose on each in order
+    if not requests:
+        return []
+    # Agents of one run share their decoding constraints
+    kw = requests[0][0].gen_kwargs
+    firsts = [a.first_request(r, z, b) for a, r, z, b in requests]
+    raws = llm.generate_batch([p for p, _ in firsts], max_new_tokens, temperature, top_p, repeat_penalty, seeds=[s for _, s in firsts], **kw)
+    decoded = [a.decode_first(raw) for (a, _, _, _), raw in zip(requests, raws)]
+    retry_idx = [k for k, d in enumerate(decoded) if d[2]]
+    results = [[d[0], raw, d[1]] for d, raw in zip(decoded, raws)]
+    calls = [[raw] for raw in raws]
+    if retry_idx:
+        seconds = [requests[k][0].retry_request(firsts[k][0], requests[k][1], requests[k][3]) for k in retry_idx]
+        raws2 = llm.generate_batch([p for p, _ in seconds], max_new_tokens, temperature, top_p, repeat_penalty, seeds=[s for _, s in seconds], **kw)
+        for k, raw2 in zip(retry_idx, raws2):
+            raw, name, compliant = requests[k][0].decode_retry(raws[k], raw2)
+            results[k] = [name, raw, compliant]
+            calls[k].append(raw2)
+    out = []
+    for (name, raw, compliant), c in zip(results, calls):
+        info = call_info(c, raw)
+        out.append((name, str(raw), _tokens(llm, raw, info), compliant, info))
+    return out
@@ -0,0 +1,194 @@
+import argparse
+import json
+import os
+import platform
+import socket
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Sequence
+
+from utils import ensure_dir
+
+# Tunes LLMWrapper's thread count, batch size and context length for one model on one host by timing
+# real game rounds (propose_batch on nl and schema prompts), and stores the fastest settings where
+# LLMWrapper picks them up. Coordinate descent: threads, then n_batch, then n_ctx, each searched with
+# the best values found so far for the others.
+
+
+def host_id() -> str:
+    # A re-imaged box keeps its name but may not keep its CPU
+    return f"{socket.gethostname()}/{platform.machine()}/{os.cpu_count() or 1}cpu"
+
+
+def config_path() -> str:
+    return os.environ.get("SIGN_NAMING_AUTOTUNE") or os.path.join(os.path.expanduser("~"), ".cache", "sign-naming", "autotune.json")
+
+
+def _load(path: str) -> Dict:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        data = {}
+    data.setdefault("fingerprints", {})
+    data.setdefault("settings", {})
+    return data
+
+
+def _save(path: str, data: Dict) -> None:
+    ensure_dir(os.path.dirname(os.path.abspath(path)))
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
+
+
+def model_hash(model_path: str, data: Dict, compute: bool = True) -> Optional[str]:
+    # sha256 of the model, memoized in the config per (path, size, mtime) so loading a model never hashes it
+    st = os.stat(model_path)
+    key = os.path.abspath(model_path)
+    memo = data["fingerprints"].get(key)
+    if memo and memo[0] == int(st.st_size) and memo[1] == int(st.st_mtime_ns):
+        return memo[2]
+    if not compute:
+        return None
+    from gen_cache import file_fingerprint
+    digest = file_fingerprint(model_path)
+    data["fingerprints"][key] = [int(st.st_size), int(st.st_mtime_ns), digest]
+    return digest
+
+
+def tuned_settings(model_path: str, path: Optional[str] = None) -> Optional[Dict]:
+    # Stored settings for this model on this host, or None when it was never tuned here
+    data = _load(path or config_path())
+    try:
+        digest = model_hash(model_path, data, compute=False)
+    except OSError:
+        return None
+    entry = data["settings"].get(f"{digest}@{host_id()}") if digest else None
+    return dict(entry["best"]) if entry else None
+
+
+def save_settings(model_path: str, result: Dict, path: Optional[str] = None) -> str:
+    path = path or config_path()
+    data = _load(path)
+    digest = model_hash(model_path, data)
+    data["settings"][f"{digest}@{host_id()}"] = {"model_path": os.path.abspath(model_path), "host": host_id(), "tuned_at": datetime.now().isoformat(timespec="seconds"),
+                                                 "best": result["best"], "tokens_per_sec": result["tokens_per_sec"], "trials": result["trials"]}
+    _save(path, data)
+    return path
+
+
+def _build_wrapper(model_path: str, **settings):
+    from llm import LLMWrapper
+    return LLMWrapper(model_path=model_path, tuned=False, **settings)
+
+
+def bench_settings(llm, conditions: Sequence[str] = ("nl", "schema"), population: int = 24, rounds: int = 3, warmup: int = 1, max_new_tokens: int = 32,
+                   temperature: float = 0.7, top_p: float = 0.9, repeat_penalty: float = 1.1, base_seed: int = 42) -> Dict:
+    # Game rounds as env runs them with batch_generate: every agent proposes, retries included
+    from agents import Agent, gen_kwargs, propose_batch
+    from population import Lexicon
+    lex = Lexicon.numbered(12)
+    wall = 0.0
+    gen_tokens = 0
+    prompt_tokens = 0
+    for r in range(warmup + rounds):
+        for condition in conditions:
+            kw = gen_kwargs(condition, lex, False, False)
+            reqs = [(Agent(i, llm, condition, lex, 20, kwargs=kw), r, lex.names[(i * 7 + r) % len(lex)], base_seed) for i in range(population)]
+            t0 = time.perf_counter()
+            out = propose_batch(llm, reqs, max_new_tokens, temperature, top_p, repeat_penalty)
+            dt = time.perf_counter() - t0
+            if r < warmup:
+                continue
+            wall += dt
+            for _, _, n_tok, _, info in out:
+                # completion_tokens covers retries too; backends without usage only report the kept text
+                gen_tokens += info["completion_tokens"] if info["completion_tokens"] is not None else n_tok
+                prompt_tokens += info["prompt_tokens"] or 0
+    return {"tokens_per_sec": gen_tokens / wall if wall > 0 else 0.0, "prompt_tokens_per_sec": prompt_tokens / wall if wall > 0 else 0.0,
+            "round_ms": 1000.0 * wall / max(1, rounds * len(conditions)), "gen_tokens": gen_tokens}
+
+
+def _thread_candidates(cpu: int) -> List[int]:
+    return sorted({t for t in (1, 2, 4, 8, 12, 16, 24, 32, 48, 64) if t <= cpu} | {cpu, max(1, cpu // 2)})
+
+
+def autotune(model_path: str, threads: Optional[Sequence[int]] = None, batches: Sequence[int] = (64, 128, 256, 512), contexts: Sequence[int] = (256, 512, 1024, 2048),
+             build: Optional[Callable] = None, log: Optional[Callable] = print, **bench_kw) -> Dict:
+    # build(model_path, **settings) -> backend with close(); defaults to an untuned LLMWrapper. A setting that fails
+    # (e.g. a context too short for the prompts) is recorded with its error and skipped
+    build = build or _build_wrapper
+    cpu = os.cpu_count() or 1
+    threads = list(threads) if threads else _thread_candidates(cpu)
+    best = {"n_threads": cpu, "n_batch": 512, "n_ctx": 2048, "seq_ctx": 512}
+    trials = []
+    seen = {}
+    for name, values in (("n_threads", threads), ("n_batch", batches), ("n_ctx", contexts)):
+        scored = []
+        for v in values:
+            settings = dict(best, **{name: int(v)})
+            if name == "n_ctx":
+                # The batch path decodes with seq_ctx per sequence, so both follow the tuned length
+                settings["seq_ctx"] = int(v)
+            key = tuple(sorted(settings.items()))
+            if key not in seen:
+                trial = {"settings": settings}
+                try:
+                    llm = build(model_path, **settings)
+                except RuntimeError as e:
+                    llm = None
+                    trial["error"] = str(e)
+                if llm is not None:
+                    try:
+                        trial.update(bench_settings(llm, **bench_kw))
+                    except (RuntimeError, ValueError) as e:
+                        trial["error"] = str(e)
+                    finally:
+                        # Frees the model and its batch context before the next setting is loaded
+                        llm.close()
+                seen[key] = trial
+                trials.append(trial)
+                if log:
+                    s = " ".join(f"{k}={settings[k]}" for k in ("n_threads", "n_batch", "n_ctx"))
+                    log(f"{s} error={trial['error']}" if "error" in trial else
+                        f"{s} tok/s={trial['tokens_per_sec']:.1f} prompt_tok/s={trial['prompt_tokens_per_sec']:.1f} round_ms={trial['round_ms']:.0f}")
+            if "error" not in seen[key]:
+                scored.append(seen[key])
+        if scored:
+            best = dict(max(scored, key=lambda t: t["tokens_per_sec"])["settings"])
+    ok = [t for t in trials if "error" not in t]
+    if not ok:
+        raise RuntimeError("autotune: every setting failed")
+    rate = next(t["tokens_per_sec"] for t in ok if t["settings"] == best)
+    return {"best": best, "tokens_per_sec": rate, "trials": trials}
+
+
+def main():
+    p = argparse.ArgumentParser(description="Find the fastest LLMWrapper threads/n_batch/n_ctx for a model on this host and store them for LLMWrapper")
+    p.add_argument('--model-path', required=True)
+    p.add_argument('--threads', type=str, help='Comma-separated thread counts (default: powers of two up to the CPU count, plus half of it)')
+    p.add_argument('--batches', type=str, default='64,128,256,512')
+    p.add_argument('--contexts', type=str, default='256,512,1024,2048')
+    p.add_argument('--population', type=int, default=24, help='Agents proposing per benchmark round')
+    p.add_argument('--rounds', type=int, default=3, help='Timed rounds per condition and setting, after one warmup round')
+    p.add_argument('--max-new-tokens', type=int, default=32)
+    p.add_argument('--config', type=str, help=f'Settings file (default {config_path()}, or $SIGN_NAMING_AUTOTUNE)')
+    p.add_argument('--dry-run', action='store_true', help='Report the trials without storing the result')
+    p.add_argument('--show', action='store_true', help='Print the stored settings for this model and host and exit')
+    args = p.parse_args()
+    if args.show:
+        print(json.dumps(tuned_settings(args.model_path, args.config), indent=2))
+        return
+    ints = lambda s: [int(x) for x in s.split(',') if x.strip()]
+    print(f"autotune host={host_id()} model={args.model_path}", flush=True)
+    res = autotune(args.model_path, ints(args.threads) if args.threads else None, ints(args.batches), ints(args.contexts), population=args.population,
+                   rounds=args.rounds, max_new_tokens=args.max_new_tokens, log=lambda s: print(s, flush=True))
+    print("best " + " ".join(f"{k}={v}" for k, v in res["best"].items()) + f" tok/s={res['tokens_per_sec']:.1f}")
+    if not args.dry_run:
+        print(f"saved to {save_settings(args.model_path, res, args.config)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,267 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+from llm import MockLLM
+from utils import ensure_dir
+
+# Each case runs in a fresh spawned process so peak RSS is its own; throughput is the best of `repeat` runs.
+# Every result names its primary throughput metric, which is what baseline comparisons use
+
+
+class CountingLLM(MockLLM):
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+
+    def generate(self, *a, **kw) -> str:
+        self.calls += 1
+        return super().generate(*a, **kw)
+
+
+def _peak_rss_mb() -> Optional[float]:
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1 << 20) if sys.platform == "darwin" else rss / 1024.0
+
+
+def _best(fn, repeat: int) -> tuple:
+    best, out = None, None
+    for _ in range(max(1, repeat)):
+        t0 = time.perf_counter()
+        out = fn()
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    return best, out
+
+
+def bench_game(condition: str, population: int, rounds: int, memory_k: int, seeds: int = 1, repeat: int = 1, batch: bool = True) -> Dict:
+    from env import run_game
+    cfg = dict(population=population, rounds=rounds, seeds=seeds, condition=condition, n_lexicon=12, memory_k=memory_k, payload_limit=20, max_new_tokens=32,
+               temperature=0.7, top_p=0.9, repeat_penalty=1.1, base_seed=42, lose_shift_alpha=0.75, quiet=True, batch_generate=batch)
+    llm = CountingLLM()
+    dt, _ = _best(lambda: run_game(cfg, llm, "game.jsonl"), repeat)
+    calls = llm.calls / max(1, repeat)
+    return {"metric": "rounds_per_sec", "elapsed_sec": dt, "rounds_per_sec": seeds * rounds / dt, "calls_per_sec": calls / dt,
+            "pairs_per_sec": seeds * rounds * (population // 2) / dt}
+
+
+def bench_propose(condition: str, calls: int, repeat: int = 1) -> Dict:
+    from agents import Agent
+    from population import Lexicon
+    lex = Lexicon.numbered(12)
+    agents = [Agent(i, MockLLM(), condition, lex, 20) for i in range(24)]
+
+    def run():
+        for k in range(calls):
+            agents[k % 24].propose(k, lex.names[k % 12], 32, 0.7, 0.9, 1.1, 42)
+    dt, _ = _best(run, repeat)
+    return {"metric": "calls_per_sec", "elapsed_sec": dt, "calls_per_sec": calls / dt}
+
+
+def _texts(n: int, seed: int = 0) -> List[str]:
+    # Schema lines, schema lines with extra text, free text naming one or two names, and junk
+    rng = random.Random(seed)
+    words = ["because", "we", "agree", "name", "is", "clear", "choose", "symbol"]
+    out = []
+    for _ in range(n):
+        c = f"C{rng.randint(1, 12)}"
+        kind = rng.randrange(4)
+        if kind == 0:
+            out.append(f"@say {{name: {c}}} | {' '.join(rng.choices(words, k=6))}")
+        elif kind == 1:
+            out.append(f"Sure! @say {{name: {c}}}\n{' '.join(rng.choices(words, k=10))}")
+        elif kind == 2:
+            out.append(" ".join(rng.choices(words, k=8) + [c] + rng.choices(words, k=8) + ([f"C{rng.randint(1, 12)}"] if rng.random() < 0.3 else [])))
+        else:
+            out.append(" ".join(rng.choices(words, k=16)))
+    return out
+
+
+def bench_parse(fn_name: str, calls: int, repeat: int = 1) -> Dict:
+    from schema_enforce import parse_schema, extract_nl_name
+    texts = _texts(calls)
+    valid = {f"C{i+1}" for i in range(12)}
+    fn = (lambda t: parse_schema(t)) if fn_name == "parse_schema" else (lambda t: extract_nl_name(t, valid))
+    dt, _ = _best(lambda: [fn(t) for t in texts], repeat)
+    return {"metric": "calls_per_sec", "elapsed_sec": dt, "calls_per_sec": calls / dt}
+
+
+def synthetic_log(path: str, rows: int, fmt: str = "jsonl", population: int = 24, seeds: int = 4, n_lexicon: int = 12, seed: int = 0) -> int:
+    # Pair and aggregate records with the columns run_game writes; names drift towards C1 over rounds
+    from log_io import open_sink
+    rng = random.Random(seed)
+    n_pairs = population // 2
+    rounds = max(1, rows // (seeds * (n_pairs + 1)))
+    sink = open_sink(path, fmt)
+    n = 0
+    for s in range(seeds):
+        for r in range(rounds):
+            p_conv = r / rounds
+            names = []
+            for k in range(n_pairs):
+                ni, nj = [("C1" if rng.random() < p_conv else f"C{rng.randint(1, n_lexicon)}") if rng.random() > 0.05 else None for _ in range(2)]
+                names += [x for x in (ni, nj) if x is not None]
+                ti, tj = rng.randint(4, 32), rng.randint(4, 32)
+                sink.pair({"seed": s, "round": r, "pair": [2 * k, 2 * k + 1], "i_id": 2 * k, "j_id": 2 * k + 1, "i_proposed": "C1", "j_proposed": "C2",
+                           "i_name": ni, "j_name": nj, "i_txt": f"@say {{name: {ni}}} | ok", "j_txt": f"@say {{name: {nj}}} | ok", "i_tokens": ti, "j_tokens": tj,
+                           "i_compliant": ni is not None, "j_compliant": nj is not None, "condition": "schema", "decode_mode": "free"})
+            modal = max(names.count(x) for x in set(names)) if names else 0
+            sink.agg({"seed": s, "round": r, "aggregate": True, "pairs": n_pairs, "round_tokens": 0, "pair_success": 0,
+                      "population_agreement": modal / population, "condition": "schema", "decode_mode": "free"})
+            sink.end_round()
+            n += n_pairs + 1
+    sink.close()
+    return n
+
+
+def bench_load_logs(rows: int, fmt: str = "jsonl", repeat: int = 1) -> Dict:
+    from log_io import log_path
+    from metrics import load_logs
+    path = log_path("synthetic", fmt)
+    n = synthetic_log(path, rows, fmt)
+    dt, _ = _best(lambda: load_logs(path), repeat)
+    return {"metric": "rows_per_sec", "elapsed_sec": dt, "rows": n, "rows_per_sec": n / dt}
+
+
+def bench_summarize(rows: int, repeat: int = 1) -> Dict:
+    from metrics import load_logs, summarize
+    n = synthetic_log("synthetic.jsonl", rows)
+    df = load_logs("synthetic.jsonl")
+    dt, _ = _best(lambda: summarize(df, 24), repeat)
+    return {"metric": "rows_per_sec", "elapsed_sec": dt, "rows": n, "rows_per_sec": n / dt}
+
+
+CASES = {
+    "game": bench_game,
+    "propose": bench_propose,
+    "parse": bench_parse,
+    "load_logs": bench_load_logs,
+    "summarize": bench_summarize,
+}
+
+
+def _run_case(kind: str, params: Dict) -> Dict:
+    # Runs in a scratch directory; run_game and the synthetic logs write relative paths
+    with tempfile.TemporaryDirectory() as d:
+        os.chdir(d)
+        out = CASES[kind](**params)
+    out["peak_rss_mb"] = _peak_rss_mb()
+    return out
+
+
+def build_cases(args) -> List[tuple]:
+    # (name, kind, params); names are stable so results can be compared across commits
+    cases = []
+    for cond in args.conditions.split(","):
+        for N in [int(x) for x in args.populations.split(",")]:
+            for R in [int(x) for x in args.rounds.split(",")]:
+                for K in [int(x) for x in args.memory.split(",")]:
+                    cases.append((f"game/{cond}/N{N}/R{R}/K{K}", "game", dict(condition=cond, population=N, rounds=R, memory_k=K)))
+    for cond in ("nl", "schema"):
+        cases.append((f"propose/{cond}", "propose", dict(condition=cond, calls=args.calls)))
+    for fn in ("parse_schema", "extract_nl_name"):
+        cases.append((f"parse/{fn}", "parse", dict(fn_name=fn, calls=args.calls * 10)))
+    for fmt in args.log_formats.split(","):
+        cases.append((f"load_logs/{fmt}/{args.log_rows}", "load_logs", dict(rows=args.log_rows, fmt=fmt)))
+    cases.append((f"summarize/{args.log_rows}", "summarize", dict(rows=args.log_rows)))
+    if args.only:
+        keep = args.only.split(",")
+        cases = [c for c in cases if any(c[0].startswith(k) for k in keep)]
+    return cases
+
+
+def _meta() -> Dict:
+    import numpy
+    import pandas
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {"timestamp": datetime.now().isoformat(timespec="seconds"), "commit": commit, "python": platform.python_version(), "platform": platform.platform(),
+            "cpu_count": multiprocessing.cpu_count(), "numpy": numpy.__version__, "pandas": pandas.__version__}
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float = 0.1) -> Dict:
+    # Ratio of current to baseline primary throughput per shared case; below 1 - tolerance is a regression
+    out = {}
+    for name, cur in results.items():
+        base = baseline.get("results", {}).get(name)
+        if base is None or "error" in cur or "error" in base:
+            continue
+        m = cur["metric"]
+        ratio = cur[m] / base[m] if base.get(m) else None
+        out[name] = {"metric": m, "baseline": base.get(m), "current": cur[m], "ratio": ratio,
+                     "regression": ratio is not None and ratio < 1.0 - tolerance}
+    return out
+
+
+def main():
+    p = argparse.ArgumentParser(description="Time the simulation and analysis paths; writes JSON and optionally compares with a baseline")
+    p.add_argument('--conditions', type=str, default='nl,nl_sw,schema')
+    p.add_argument('--populations', type=str, default='12,24')
+    p.add_argument('--rounds', type=str, default='50')
+    p.add_argument('--memory', type=str, default='5')
+    p.add_argument('--calls', type=int, default=2000, help='Agent.propose calls per propose case (x10 for parser cases)')
+    p.add_argument('--log-rows', type=int, default=100000, help='Rows of the synthetic log for load_logs/summarize')
+    p.add_argument('--log-formats', type=str, default='jsonl', help="Comma-separated; 'parquet' needs pyarrow")
+    p.add_argument('--repeat', type=int, default=3, help='Runs per case; the fastest is reported')
+    p.add_argument('--only', type=str, help='Comma-separated case name prefixes, e.g. game/schema,parse')
+    p.add_argument('--out', type=str, help='Result JSON (default data/bench_<timestamp>.json)')
+    p.add_argument('--baseline', type=str, help='Earlier result JSON to compare against')
+    p.add_argument('--tolerance', type=float, default=0.1, help='Relative slowdown reported as a regression')
+    p.add_argument('--fail-on-regression', action='store_true', help='Exit with status 1 if any case regressed')
+    args = p.parse_args()
+
+    cases = build_cases(args)
+    results = {}
+    ctx = multiprocessing.get_context("spawn")
+    for name, kind, params in cases:
+        with ctx.Pool(1) as pool:
+            try:
+                res = pool.apply(_run_case, (kind, dict(params, repeat=args.repeat)))
+            except Exception as e:
+                res = {"error": repr(e)}
+        results[name] = dict(res, params=params)
+        if "error" in res:
+            print(f"{name}: FAILED {res['error']}")
+        else:
+            print(f"{name}: {res['metric']}={res[res['metric']]:.1f} elapsed_sec={res['elapsed_sec']:.3f} peak_rss_mb={res['peak_rss_mb']:.1f}")
+
+    report = {"meta": _meta(), "repeat": args.repeat, "results": results}
+    regressed = []
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            base = json.load(f)
+        report["baseline"] = {"path": args.baseline, "meta": base.get("meta")}
+        report["comparison"] = compare(results, base, args.tolerance)
+        for name, c in report["comparison"].items():
+            flag = "REGRESSION" if c["regression"] else ""
+            print(f"{name}: {c['metric']} x{c['ratio']:.2f} ({c['baseline']:.1f} -> {c['current']:.1f}) {flag}".rstrip())
+        regressed = [n for n, c in report["comparison"].items() if c["regression"]]
+
+    out = args.out
+    if out is None:
+        ensure_dir('data')
+        out = os.path.join('data', f"bench_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=1)
+    print(out)
+    if regressed and args.fail_on_regression:
+        raise SystemExit(f"{len(regressed)} case(s) regressed beyond {args.tolerance:.0%}: {', '.join(regressed)}")
+
+
+if __name__ == '__main__':
+    main()
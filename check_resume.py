@@ -0,0 +1,144 @@
+import argparse
+import functools
+import json
+import os
+import shutil
+import sys
+import tempfile
+from typing import Dict, List, Optional
+from env import run_game, checkpoint_path, summary_path
+from llm import Generation, MockLLM
+from log_io import iter_jsonl
+
+# Kill-and-resume check of run_game checkpoints on a deterministic mock backend. Every case runs once uninterrupted,
+# then again with the backend dying after a number of generations, is resumed from its checkpoint and
+# must reproduce the uninterrupted log record for record and the same summary. Timing fields differ
+# between any two runs and are left out of the comparison. Exits with status 1 on any mismatch.
+
+VOLATILE = ("_ms", "llm_frac", "decode_tokens_per_sec")
+
+
+class Crash(Exception):
+    pass
+
+
+class EchoLLM(MockLLM):
+    # Mostly answers with the proposed name, sometimes another one or nothing decodable, so populations
+    # converge and memories, retries, streaks and early stops all end up in the checkpointed state
+    def generate(self, prompt: str, max_new_tokens: int, temperature: float, top_p: float, repeat_penalty: float, seed: int, stop: Optional[List[str]] = None, grammar: Optional[str] = None) -> str:
+        import random
+        rng = random.Random(int(seed))
+        name = prompt.split("proposed name is ", 1)[1].split(".", 1)[0]
+        u = rng.random()
+        if u < 0.15:
+            name = f"C{rng.randint(1, 12)}"
+        txt = "no idea" if u > 0.93 else f"@say {{name: {name}}} | agreed"
+        return Generation(txt, self.tokenize_count(prompt), self.tokenize_count(txt), 0.0, 0.0)
+
+
+class CrashingLLM(EchoLLM):
+    # Raises on the (after+1)-th generation, like a process killed mid-round
+    def __init__(self, after: Optional[int] = None):
+        super().__init__()
+        self.left = after
+
+    def generate(self, *a, **kw) -> str:
+        if self.left is not None:
+            self.left -= 1
+            if self.left < 0:
+                raise Crash()
+        return super().generate(*a, **kw)
+
+
+def _records(path: str) -> List[Dict]:
+    return [{k: v for k, v in rec.items() if not k.endswith(VOLATILE)} for rec in iter_jsonl(path)]
+
+
+def _summary(path: str) -> Dict:
+    with open(summary_path(path), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def run_case(name: str, cfg: Dict, crash_after: List[int], work: str, budgets: Optional[List[int]] = None) -> bool:
+    fmt = cfg.get("log_format", "jsonl")
+    workers = int(cfg.get("workers", 1))
+    ref = os.path.join(work, f"{name}_ref.{fmt}")
+    run_game(dict(cfg, checkpoint_every=0), EchoLLM(), ref, llm_factory=EchoLLM)
+    ok = True
+    for n in crash_after:
+        path = os.path.join(work, f"{name}_{n}.{fmt}")
+        dying = functools.partial(CrashingLLM, n)
+        crashed = False
+        # A budgeted case first pauses at every budget but the last, then crashes on the way to the end
+        steps = [dict(cfg, round_budget=b) for b in budgets] if budgets else [cfg]
+        for k, step in enumerate(steps):
+            factory = dying if k == len(steps) - 1 else EchoLLM
+            try:
+                run_game(step, factory() if workers <= 1 else None, path, llm_factory=factory, resume=k > 0)
+            except Exception as e:
+                # Pool workers run this file as __mp_main__, so their Crash is matched by name
+                if type(e).__name__ != "Crash":
+                    raise
+                crashed = True
+        if crashed:
+            if not os.path.exists(checkpoint_path(path)):
+                print(f"{name} crash_after={n}: FAILED no checkpoint left to resume from")
+                ok = False
+                continue
+            run_game(steps[-1], EchoLLM() if workers <= 1 else None, path, llm_factory=EchoLLM, resume=True)
+        same_log = _records(path) == _records(ref)
+        same_summary = _summary(path) == _summary(ref)
+        leftover = os.path.exists(checkpoint_path(path))
+        good = same_log and same_summary and not leftover
+        ok = ok and good
+        print(f"{name} crash_after={n} crashed={crashed}: {'ok' if good else 'FAILED'} same_log={same_log} same_summary={same_summary} checkpoint_left={leftover}")
+    return ok
+
+
+def build_cases(args) -> List[tuple]:
+    base = dict(population=10, rounds=25, seeds=3, condition="schema", n_lexicon=12, memory_k=5, payload_limit=20, max_new_tokens=32,
+                temperature=0.7, top_p=0.9, repeat_penalty=1.1, base_seed=42, lose_shift_alpha=0.75, quiet=True, batch_generate=True,
+                checkpoint_every=7)
+    crashes = [int(x) for x in args.crash_after.split(",")]
+    return [
+        ("serial_jsonl", dict(base), crashes, {}),
+        ("serial_jsonl_gz", dict(base, log_format="jsonl.gz"), crashes, {}),
+        ("serial_nl_sw_no_batch", dict(base, condition="nl_sw", batch_generate=False), crashes, {}),
+        # Checkpoints every round, and crashes at 120 and 360 resume from inside an agreement streak
+        ("serial_early_stop", dict(base, checkpoint_every=1, early_stop_threshold=0.5, early_stop_window=3), crashes + [120, 360], {}),
+        ("pool_jsonl_gz", dict(base, log_format="jsonl.gz", workers=2), crashes, {}),
+        # More workers than seeds: runs in process on a backend run_game builds from the factory
+        ("pool_one_seed", dict(base, seeds=1, workers=2), crashes, {}),
+        ("pool_budget", dict(base, workers=2, checkpoint_every=0), crashes, {"budgets": [10, 25]}),
+        ("pool_budget_early_stop", dict(base, workers=2, checkpoint_every=0, early_stop_threshold=0.5, early_stop_window=2), crashes, {"budgets": [10, 25]}),
+    ]
+
+
+def main():
+    p = argparse.ArgumentParser(description="Crash runs at fixed generation counts, resume them from their checkpoints and compare with uninterrupted runs")
+    p.add_argument('--crash-after', type=str, default='35,300,650', help='Comma-separated generation counts (per process) after which the backend dies')
+    p.add_argument('--only', type=str, help='Comma-separated case name prefixes, e.g. serial,pool_budget')
+    p.add_argument('--keep', action='store_true', help='Keep the logs in the work directory')
+    args = p.parse_args()
+    work = tempfile.mkdtemp(prefix="check_resume_")
+    only = [x for x in args.only.split(",") if x] if args.only else None
+    failed = []
+    try:
+        for name, cfg, crashes, kw in build_cases(args):
+            if only and not any(name.startswith(o) for o in only):
+                continue
+            if not run_case(name, cfg, crashes, work, **kw):
+                failed.append(name)
+    finally:
+        if args.keep:
+            print(work)
+        else:
+            shutil.rmtree(work, ignore_errors=True)
+    if failed:
+        print(f"FAILED: {', '.join(failed)}")
+        sys.exit(1)
+    print("all resumed runs match")
+
+
+if __name__ == '__main__':
+    main()
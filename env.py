@@ -1,11 +1,19 @@
 import json
+import os
+import pickle
+import shutil
 import time
 import math
 import random
+import multiprocessing
 from collections import Counter, defaultdict
-from typing import Dict, List
-from utils import set_seeds, ensure_dir, Memory
-from agents import Agent
+from typing import Dict, List, Optional
+from utils import set_seeds, ensure_dir
+from agents import Agent, propose_batch, decode_mode, gen_kwargs
+from population import Lexicon, PopulationState
+from hooks import Hooks, TimedLLM, PHASES
+from llm import llm_counters, close_llm
+from log_io import open_sink, remove_log, truncate_log, iter_jsonl, RESUMABLE
 
 
 def _pair_indices(n: int, rng: random.Random) -> List[tuple]:
@@ -18,12 +26,164 @@ def _pair_indices(n: int, rng: random.Random) -> List[tuple]:
     return pairs
 
 
-def run_game(cfg: Dict, llm, out_path: str, wandb_run=None) -> str:
-    ensure_dir("data")
-    set_seeds(int(cfg["base_seed"]))
+def _keep_text(s: int, r: int, k: int, frac: float) -> bool:
+    # Deterministic per-pair sample for log_text_frac; leaves the game's rng untouched
+    if frac >= 1.0:
+        return True
+    return (((s * 1000003 + r) * 1000033 + k) * 2654435761 & 0xFFFFFFFF) < frac * 4294967296.0
+
+
+# Round aggregates per wandb upload; a seed also sends what it has at every checkpoint and when it ends
+WANDB_BATCH = 50
+
+
+def _wandb_log(wandb_run, aggs: List[Dict], R: int) -> None:
+    # Rows are staged uncommitted and the last one commits the batch
+    if wandb_run is None or not aggs:
+        return
+    try:
+        for k, agg in enumerate(aggs):
+            step = agg["seed"] * R + agg["round"]
+            wandb_run.log({key: v for key, v in agg.items() if key != "aggregate"}, step=step, commit=k == len(aggs) - 1)
+    except Exception:
+        pass
+
+
+TELEMETRY = ("prompt_tokens", "completion_tokens", "prompt_ms", "decode_ms")
+
+
+class OnlineSummary:
+    # Summary statistics of one seed, updated every round so the run summary needs no log re-read.
+    # Final entropy counts undecodable outputs as their own category, like metrics.summarize
+    def __init__(self, seed: int, target: float = 0.9):
+        self.seed = seed
+        self.target = float(target)
+        self.agreement = []
+        self.tokens_total = 0
+        self.pair_success_total = 0
+        self.rounds_to_target = None
+        self.final_names = {}
+        self.compliant = 0
+        self.proposals = 0
+        self.stop_round = None
+        self.stop_reason = None
+
+    def add_round(self, agg: Dict, names_counter: Counter, n_proposals: int, n_compliant: int) -> None:
+        self.agreement.append(agg["population_agreement"])
+        self.tokens_total += agg["round_tokens"]
+        self.pair_success_total += agg["pair_success"]
+        if self.rounds_to_target is None and agg["population_agreement"] >= self.target:
+            self.rounds_to_target = agg["round"]
+        self.final_names = dict(names_counter)
+        undecodable = n_proposals - sum(names_counter.values())
+        if undecodable:
+            self.final_names["None"] = undecodable
+        self.compliant += n_compliant
+        self.proposals += n_proposals
+        if agg.get("early_stop"):
+            self.stop_round = agg["round"]
+            self.stop_reason = agg["early_stop"]
+
+    def final_entropy(self) -> float:
+        tot = sum(self.final_names.values())
+        return float(-sum(c / tot * math.log2(c / tot) for c in self.final_names.values() if c)) if tot else 0.0
+
+    def result(self, condition: str) -> Dict:
+        return {
+            "seed": self.seed,
+            "rounds": len(self.agreement),
+            "rounds_to_target": self.rounds_to_target,
+            "tokens_total": self.tokens_total,
+            "pair_success_total": self.pair_success_total,
+            "final_agreement": self.agreement[-1] if self.agreement else None,
+            "final_entropy": self.final_entropy(),
+            "final_names": self.final_names,
+            "compliance_rate": self.compliant / self.proposals if condition == "schema" and self.proposals else None,
+            "stop_round": self.stop_round,
+            "stop_reason": self.stop_reason,
+            "agreement": self.agreement,
+        }
+
+
+def summary_path(out_path: str) -> str:
+    return out_path + ".summary.json"
+
+
+def _mean_std(vals: list) -> tuple:
+    vals = [v for v in vals if v is not None]
+    if not vals:
+        return None, None
+    m = sum(vals) / len(vals)
+    return m, math.sqrt(sum((v - m) ** 2 for v in vals) / len(vals))
+
+
+def run_summary(cfg: Dict, seed_summaries: List[Dict]) -> Dict:
+    # Same headline keys as metrics.summarize, plus per-seed curves and final name distributions
+    rtt_m, rtt_s = _mean_std([x["rounds_to_target"] for x in seed_summaries])
+    ent_m, ent_s = _mean_std([x["final_entropy"] for x in seed_summaries])
+    return {
+        "condition": str(cfg["condition"]).lower(),
+        "target": float(cfg.get("target", 0.9)),
+        "rounds_to_target_mean": rtt_m,
+        "rounds_to_target_std": rtt_s,
+        "reached_target": sum(x["rounds_to_target"] is not None for x in seed_summaries) / max(1, len(seed_summaries)),
+        "tokens_total_mean": _mean_std([x["tokens_total"] for x in seed_summaries])[0],
+        "final_agreement_mean": _mean_std([x["final_agreement"] for x in seed_summaries])[0],
+        "final_entropy_mean": ent_m,
+        "final_entropy_std": ent_s,
+        "compliance_rate": _mean_std([x["compliance_rate"] for x in seed_summaries])[0],
+        "rounds_run_mean": _mean_std([x["rounds"] for x in seed_summaries])[0],
+        "stopped_early": sum(x["stop_round"] is not None for x in seed_summaries),
+        "seeds": seed_summaries,
+    }
+
+
+# Settings that may differ between a run and its resumption
+RESUME_EXCLUDE = ("quiet", "workers", "batch_generate", "checkpoint_every", "io_thread", "round_budget")
+
+
+def checkpoint_path(out_path: str) -> str:
+    return out_path + ".ckpt"
+
+
+def save_checkpoint(path: str, ckpt: Dict) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        pickle.dump(ckpt, f, protocol=pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def load_checkpoint(path: str) -> Optional[Dict]:
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def _check_resume_cfg(saved: Dict, cfg: Dict) -> None:
+    a = {k: v for k, v in saved.items() if k not in RESUME_EXCLUDE}
+    b = {k: v for k, v in cfg.items() if k not in RESUME_EXCLUDE}
+    if a != b:
+        diff = sorted(k for k in set(a) | set(b) if a.get(k) != b.get(k))
+        raise ValueError(f"Checkpoint was written with a different config ({', '.join(diff)})")
+
+
+def write_summary(path: str, summary: Dict) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(summary, f)
+    os.replace(tmp, path)
+
+
+def _run_seed(cfg: Dict, s: int, llm, sink, wandb_run=None, state: Optional[Dict] = None, checkpoint=None, hooks: Optional[Hooks] = None) -> Dict:
+    # state: a checkpointed seed state to continue from; checkpoint(state) is called every
+    # cfg['checkpoint_every'] rounds and after the last round, once the round's records are written.
+    # cfg['round_budget'] pauses the seed after that many rounds, always with a checkpoint.
+    # hooks: callbacks around each round's phases (see hooks.Hook)
     N = int(cfg["population"])
     R = int(cfg["rounds"])
-    seeds = int(cfg["seeds"])
     condition = str(cfg["condition"]).lower()
     n_lex = int(cfg["n_lexicon"])
     memory_k = int(cfg["memory_k"])
@@ -35,129 +195,375 @@ def run_game(cfg: Dict, llm, out_path: str, wandb_run=None) -> str:
     base_seed = int(cfg["base_seed"])
     lose_shift_alpha = float(cfg.get("lose_shift_alpha", 0.75))
     quiet = bool(cfg.get("quiet", False))
+    # Proposals within a round only read z from the start of the round, so they can be decoded together
+    batch_generate = bool(cfg.get("batch_generate", True)) and hasattr(llm, "generate_batch")
+    constrained = bool(cfg.get("constrained", False))
+    stop_newline = bool(cfg.get("stop_newline", False))
+    # Fraction of pair records that keep their raw texts (the rest log i_txt/j_txt as null)
+    text_frac = float(cfg.get("log_text_frac", 1.0))
+    mode = decode_mode(condition, constrained, stop_newline)
+    # Backend time, to split each round's proposal time into generate and parse phases
+    llm = TimedLLM(llm)
+
+    lex = Lexicon.numbered(n_lex)
+
+    seed_int = int(base_seed) ^ (s * 2654435761) ^ (N * 97531) ^ (R * 131071)
+    rng = random.Random(seed_int & 0xFFFFFFFF)
+    kw = gen_kwargs(condition, lex, constrained, stop_newline)
+    agents = [Agent(i, llm, condition, lex, payload_limit, kwargs=kw) for i in range(N)]
+    # Initialize preferred names z_i uniformly from lexicon
+    pop = PopulationState(lex, N, memory_k, [rng.choice(range(n_lex)) for _ in range(N)])
+    z = pop.z
+    names = lex.names
+    index = lex.index
+    online = OnlineSummary(s, float(cfg.get("target", 0.9)))
+    every = int(cfg.get("checkpoint_every", 0))
+    budget = cfg.get("round_budget")
+    end = min(R, int(budget)) if budget is not None else R
+    # Opt-in early stopping: end the seed once agreement >= threshold for `window` consecutive rounds
+    stop_thr = cfg.get("early_stop_threshold")
+    stop_window = int(cfg.get("early_stop_window", 20))
+    streak = 0
+    r0 = 0
+    wandb_rows = []
+    if state is not None:
+        pop.setstate(state["population"])
+        z = pop.z
+        rng.setstate(state["rng"])
+        online = state["online"]
+        streak = state.get("streak", 0)
+        r0 = R if state.get("stopped") else state["round"] + 1
+    if hooks is not None:
+        hooks.on_seed_start(s, cfg)
+    log_s = 0.0
+    for r in range(r0, end):
+        if hooks is not None:
+            hooks.on_round_start(s, r)
+        t_round = time.perf_counter()
+        phases = dict.fromkeys(PHASES, 0.0)
+        phases["log"] = log_s
+        llm_s = 0.0
+        totals = {k: 0 for k in TELEMETRY}
+        retries = 0
+        pairs = _pair_indices(N, rng)
+        phases["pairing"] = time.perf_counter() - t_round
+        names_counter = Counter()
+        round_tokens = 0
+        pair_success = 0
+        n_compliant = 0
+        if batch_generate:
+            reqs = []
+            for i, j in pairs:
+                reqs.append((agents[i], r, names[z[i]], base_seed + s * 100000))
+                reqs.append((agents[j], r, names[z[j]], base_seed + s * 100000 + 1))
+            t0, b0 = time.perf_counter(), llm.seconds
+            proposals = propose_batch(llm, reqs, max_new_tokens, temperature, top_p, repeat_penalty)
+            dt = time.perf_counter() - t0
+            llm_s += dt
+            phases["generate"] += llm.seconds - b0
+            phases["parse"] += dt - (llm.seconds - b0)
+            if hooks is not None:
+                hooks.after_generate(s, r, pairs, proposals)
+        for k, (i, j) in enumerate(pairs):
+            # Agents propose their current preferred names z_i and z_j
+            if batch_generate:
+                name_i, raw_i, tok_i, comp_i, info_i = proposals[2 * k]
+                name_j, raw_j, tok_j, comp_j, info_j = proposals[2 * k + 1]
+            else:
+                t0, b0 = time.perf_counter(), llm.seconds
+                p_i = agents[i].propose(r, names[z[i]], max_new_tokens, temperature, top_p, repeat_penalty, base_seed + s * 100000)
+                p_j = agents[j].propose(r, names[z[j]], max_new_tokens, temperature, top_p, repeat_penalty, base_seed + s * 100000 + 1)
+                dt = time.perf_counter() - t0
+                llm_s += dt
+                phases["generate"] += llm.seconds - b0
+                phases["parse"] += dt - (llm.seconds - b0)
+                if hooks is not None:
+                    hooks.after_generate(s, r, [(i, j)], [p_i, p_j])
+                name_i, raw_i, tok_i, comp_i, info_i = p_i
+                name_j, raw_j, tok_j, comp_j, info_j = p_j
+            retries += info_i["retry"] + info_j["retry"]
+            n_compliant += (comp_i is True) + (comp_j is True)
+            for key in TELEMETRY:
+                # A backend without usage leaves the round total unknown
+                if totals[key] is not None:
+                    totals[key] = None if info_i[key] is None or info_j[key] is None else totals[key] + info_i[key] + info_j[key]
+            # Count only valid names for population agreement
+            if name_i is not None:
+                names_counter.update([name_i])
+            if name_j is not None:
+                names_counter.update([name_j])
+            round_tokens += tok_i + tok_j
+            success = (name_i is not None) and (name_j is not None) and (name_i == name_j)
+            if success:
+                pair_success += 1
+            t0 = time.perf_counter()
+            keep_txt = _keep_text(s, r, k, text_frac)
+            rec = {
+                "seed": s,
+                "round": r,
+                "pair": [i, j],
+                "i_id": i,
+                "j_id": j,
+                "i_proposed": names[z[i]],
+                "j_proposed": names[z[j]],
+                "i_name": name_i,
+                "j_name": name_j,
+                "i_txt": raw_i if keep_txt else None,
+                "j_txt": raw_j if keep_txt else None,
+                "i_tokens": tok_i,
+                "j_tokens": tok_j,
+                "i_compliant": comp_i if condition == "schema" else None,
+                "j_compliant": comp_j if condition == "schema" else None,
+                "condition": condition,
+                "decode_mode": mode,
+            }
+            for side, info in (("i", info_i), ("j", info_j)):
+                rec[f"{side}_retry"] = info["retry"]
+                for key in TELEMETRY:
+                    rec[f"{side}_{key}"] = info[key]
+            sink.pair(rec)
+            phases["write"] += time.perf_counter() - t0
+            if hooks is not None:
+                hooks.on_pair(rec)
+            t0 = time.perf_counter()
+            # Update rules per condition
+            # Partner-only memory updates apply to 'nl_sw' and 'schema'; plain 'nl' skips modal update
+            x_i = index[name_i] if name_i is not None else None
+            x_j = index[name_j] if name_j is not None else None
+            if condition in ("nl", "nl_sw", "schema"):
+                # Partner-only memory: each agent stores the partner's decoded name if decodable
+                if x_j is not None:
+                    pop.hear(i, x_j)
+                if x_i is not None:
+                    pop.hear(j, x_i)
+                next_i = pop.modal_or_z(i)
+                next_j = pop.modal_or_z(j)
+            else:
+                # 'nl' condition: no memory-based modal update
+                next_i = z[i]
+                next_j = z[j]
+
+            # Additionally, apply win-stay / lose-shift
+            alpha = lose_shift_alpha
+            if success:
+                next_i = z[i]
+                next_j = z[j]
+            else:
+                if x_j is not None and rng.random() < alpha:
+                    next_i = x_j
+                if x_i is not None and rng.random() < alpha:
+                    next_j = x_i
+            z[i] = next_i
+            z[j] = next_j
+            phases["update"] += time.perf_counter() - t0
+        if names_counter:
+            modal = names_counter.most_common(1)[0][1]
+        else:
+            modal = 0
+        pop_agree = modal / N
+        agg = {
+            "seed": s,
+            "round": r,
+            "aggregate": True,
+            "pairs": len(pairs),
+            "round_tokens": round_tokens,
+            "pair_success": pair_success,
+            "population_agreement": pop_agree,
+            "condition": condition,
+            "decode_mode": mode,
+            "retries": retries,
+        }
+        agg.update(totals)
+        dec_s = (totals["decode_ms"] or 0.0) / 1000.0
+        agg["decode_tokens_per_sec"] = totals["completion_tokens"] / dec_s if totals["completion_tokens"] is not None and dec_s > 0 else None
+        wall = time.perf_counter() - t_round
+        agg["round_wall_ms"] = wall * 1000.0
+        agg["llm_ms"] = llm_s * 1000.0
+        agg["llm_frac"] = llm_s / wall if wall > 0 else None
+        stop = False
+        if stop_thr is not None:
+            streak = streak + 1 if pop_agree >= float(stop_thr) else 0
+            if streak >= stop_window and r < R - 1:
+                stop = True
+                agg["early_stop"] = f"population_agreement>={float(stop_thr)} for {stop_window} rounds"
+                agg["planned_rounds"] = R
+        if hooks is not None:
+            phases["other"] = max(0.0, wall - sum(v for k, v in phases.items() if k != "log"))
+            hooks.on_round_end(agg, phases)
+        t_log = time.perf_counter()
+        sink.agg(agg)
+        sink.end_round()
+        online.add_round(agg, names_counter, 2 * len(pairs), n_compliant)
+        last = r == end - 1 or stop
+        due = checkpoint is not None and ((every > 0 and ((r + 1) % every == 0 or last)) or (budget is not None and last))
+        if wandb_run is not None:
+            wandb_rows.append(agg)
+            # Sent before the checkpoint is written, so a resumed seed neither loses nor resends rows
+            if len(wandb_rows) >= WANDB_BATCH or last or due:
+                sink.defer(_wandb_log, wandb_run, wandb_rows, R)
+                wandb_rows = []
+        if due:
+            checkpoint({
+                "seed": s,
+                "round": r,
+                "population": pop.getstate(),
+                "rng": rng.getstate(),
+                "online": online,
+                "streak": streak,
+                "stopped": stop,
+            })
+        log_s = time.perf_counter() - t_log
+        if stop:
+            break
+        if not quiet and (r + 1) % max(1, R // 10) == 0:
+            pass
+    result = online.result(condition)
+    if hooks is not None:
+        hooks.on_seed_end(s, result)
+    return result
+
+
+# Per-process model for the seed pool; loaded once by the initializer
+_WORKER_LLM = None
+
+
+def _init_worker(llm_factory) -> None:
+    global _WORKER_LLM
+    _WORKER_LLM = llm_factory()
+
+
+def _seed_done(cfg: Dict, summary: Dict) -> bool:
+    return summary["rounds"] >= int(cfg["rounds"]) or summary["stop_round"] is not None
+
 
-    lexicon = [f"C{i+1}" for i in range(n_lex)]
+def _seed_task(task: tuple) -> tuple:
+    return _part_seed(task, _WORKER_LLM)
+
+
+def _part_seed(task: tuple, llm) -> tuple:
+    # One seed of a pool or budgeted run, in its own part file; continues from the part's checkpoint
+    cfg, s, part_path, resume, hooks = task
+    before = llm_counters(llm)
+    ck_path = checkpoint_path(part_path)
+    ckpt = load_checkpoint(ck_path) if resume else None
+    if ckpt is not None:
+        truncate_log(part_path, ckpt["offset"])
+    sink = open_sink(part_path, cfg.get("log_format", "jsonl"), append=ckpt is not None, threaded=bool(cfg.get("io_thread", True)))
+
+    def save(state):
+        save_checkpoint(ck_path, {"offset": sink.flush(), "state": state})
+
+    try:
+        summary = _run_seed(cfg, s, llm, sink, state=ckpt["state"] if ckpt else None, checkpoint=save, hooks=hooks)
+    finally:
+        sink.close()
+    after = llm_counters(llm)
+    return part_path, {k: v - before.get(k, 0) for k, v in after.items()}, summary
+
+
+def run_game(cfg: Dict, llm, out_path: str, wandb_run=None, llm_factory=None, stats: Optional[Dict] = None, resume: bool = False, hooks: Optional[List] = None) -> str:
+    # stats collects cache counters from pool workers; in-process counters stay on llm.
+    # resume continues from <out_path>.ckpt (written when cfg['checkpoint_every'] > 0).
+    # hooks: hooks.Hook instances called from every seed's round loop (pool workers get copies).
+    # cfg['round_budget'] runs every seed only up to that round: seeds keep pool-style part files and
+    # checkpoints, the summary is an interim one with 'paused_at_round', and the log is only written
+    # once a call with resume=True and a budget >= rounds has finished every seed
+    if llm is None and min(int(cfg.get("workers", 1)), int(cfg["seeds"])) <= 1 and llm_factory is not None:
+        # Callers leave llm to the workers when they ask for several, but fewer seeds than workers run in process
+        llm = llm_factory()
+        try:
+            return run_game(cfg, llm, out_path, wandb_run, llm_factory, stats, resume, hooks)
+        finally:
+            if stats is not None:
+                for k, v in llm_counters(llm).items():
+                    stats[k] = stats.get(k, 0) + v
+            close_llm(llm)
+    ensure_dir("data")
+    hooks = Hooks(hooks) if hooks else None
+    set_seeds(int(cfg["base_seed"]))
+    R = int(cfg["rounds"])
+    seeds = int(cfg["seeds"])
+    workers = min(int(cfg.get("workers", 1)), seeds)
+    fmt = cfg.get("log_format", "jsonl")
+    every = int(cfg.get("checkpoint_every", 0))
+    budget = cfg.get("round_budget")
+    if (every > 0 or budget is not None) and fmt not in RESUMABLE:
+        raise ValueError(f"Checkpoints need log_format in {RESUMABLE}; {fmt} logs cannot be reopened for append")
+    mode = "pool" if workers > 1 or budget is not None else "serial"
+    ck_path = checkpoint_path(out_path)
+    ckpt = None
+    if resume:
+        ckpt = load_checkpoint(ck_path)
+        if ckpt is None:
+            raise FileNotFoundError(f"No checkpoint to resume from at {ck_path}")
+        _check_resume_cfg(ckpt["cfg"], cfg)
+        if ckpt["mode"] != mode:
+            raise ValueError(f"Checkpoint was written by a {ckpt['mode']} run; resume with the same --workers setting")
 
     t0 = time.time()
     path = out_path
-    f = open(path, "w", encoding="utf-8")
+    if mode == "pool":
+        # Seeds share nothing but the model: each worker loads it once and runs whole seeds
+        if workers > 1 and llm_factory is None:
+            raise ValueError("workers > 1 requires llm_factory to build the model in each worker")
+        if (every > 0 or budget is not None) and ckpt is None:
+            # Pool checkpoints live next to each seed's part file; this one only records the config
+            save_checkpoint(ck_path, {"cfg": cfg, "mode": mode})
+        tasks = [(cfg, s, f"{path}.seed{s}.part", resume, hooks) for s in range(seeds)]
+        if workers > 1:
+            ctx = multiprocessing.get_context("spawn")
+            with ctx.Pool(workers, initializer=_init_worker, initargs=(llm_factory,)) as pool:
+                results = pool.map(_seed_task, tasks, chunksize=1)
+        else:
+            results = [_part_seed(task, llm) for task in tasks]
+        # In-process counters stay on llm
+        if stats is not None and workers > 1:
+            for _, counters, _ in results:
+                for k, v in counters.items():
+                    stats[k] = stats.get(k, 0) + v
+        if not all(_seed_done(cfg, x[2]) for x in results):
+            write_summary(summary_path(path), dict(run_summary(cfg, [x[2] for x in results]), paused_at_round=int(budget)))
+            return path
+        # Merge in seed order so the log matches the serial path
+        if fmt == "parquet":
+            sink = open_sink(path, fmt)
+            try:
+                for part_path, _, _ in results:
+                    _wandb_log(wandb_run, sink.append_run(part_path), R)
+            finally:
+                sink.close()
+        else:
+            # JSONL parts concatenate byte for byte, compressed ones too (gzip members / zstd frames)
+            with open(path, "wb") as f:
+                for part_path, _, _ in results:
+                    with open(part_path, "rb") as pf:
+                        shutil.copyfileobj(pf, f, 1 << 20)
+                    if wandb_run is not None:
+                        _wandb_log(wandb_run, list(iter_jsonl(part_path, aggregate_only=True)), R)
+        for part_path, _, _ in results:
+            remove_log(part_path)
+            remove_log(checkpoint_path(part_path))
+        write_summary(summary_path(path), run_summary(cfg, [x[2] for x in results]))
+        remove_log(ck_path)
+        return path
+    if ckpt is not None:
+        truncate_log(path, ckpt["offset"])
+    # Records are serialized and written by a background thread unless cfg['io_thread'] is False
+    sink = open_sink(path, fmt, append=ckpt is not None, threaded=bool(cfg.get("io_thread", True)))
+    summaries = list(ckpt["summaries"]) if ckpt else []
+    state = ckpt["state"] if ckpt else None
+    start = state["seed"] if state else len(summaries)
+
+    def save(st):
+        save_checkpoint(ck_path, {"cfg": cfg, "mode": mode, "offset": sink.flush(), "summaries": summaries, "state": st})
+
     try:
-        for s in range(seeds):
-            seed_int = int(base_seed) ^ (s * 2654435761) ^ (N * 97531) ^ (R * 131071)
-            rng = random.Random(seed_int & 0xFFFFFFFF)
-            agents = [Agent(i, llm, condition, lexicon, payload_limit, seed=base_seed + s) for i in range(N)]
-            memories = [Memory(memory_k) for _ in range(N)]
-            # Initialize preferred names z_i uniformly from lexicon
-            z = [rng.choice(lexicon) for _ in range(N)]
-            for r in range(R):
-                pairs = _pair_indices(N, rng)
-                names_counter = Counter()
-                round_tokens = 0
-                pair_success = 0
-                for i, j in pairs:
-                    # Agents propose their current preferred names z_i and z_j
-                    name_i, raw_i, tok_i, comp_i = agents[i].propose(r, z[i], max_new_tokens, temperature, top_p, repeat_penalty, base_seed + s * 100000)
-                    name_j, raw_j, tok_j, comp_j = agents[j].propose(r, z[j], max_new_tokens, temperature, top_p, repeat_penalty, base_seed + s * 100000 + 1)
-                    # Count only valid names for population agreement
-                    if name_i is not None:
-                        names_counter.update([name_i])
-                    if name_j is not None:
-                        names_counter.update([name_j])
-                    round_tokens += tok_i + tok_j
-                    success = (name_i is not None) and (name_j is not None) and (name_i == name_j)
-                    if success:
-                        pair_success += 1
-                    rec = {
-                        "seed": s,
-                        "round": r,
-                        "pair": [i, j],
-                        "i_id": i,
-                        "j_id": j,
-                        "i_name": name_i,
-                        "j_name": name_j,
-                        "i_txt": raw_i,
-                        "j_txt": raw_j,
-                        "i_tokens": tok_i,
-                        "j_tokens": tok_j,
-                        "i_compliant": comp_i if condition == "schema" else None,
-                        "j_compliant": comp_j if condition == "schema" else None,
-                        "condition": condition,
-                    }
-                    f.write(json.dumps(rec, ensure_ascii=False) + "\n")
-                    # Update rules per condition
-                    # Partner-only memory updates apply to 'nl_sw' and 'schema'; plain 'nl' skips modal update
-                    def modal_from_memory(mem: Memory) -> str:
-                        items = [x for x in mem.list() if isinstance(x, str)]
-                        if not items:
-                            return None
-                        counts = Counter(items)
-                        maxc = max(counts.values())
-                        cands = [k for k, v in counts.items() if v == maxc]
-                        def idx(x: str) -> int:
-                            try:
-                                return int(x[1:])
-                            except Exception:
-                                return 10**9
-                        cands.sort(key=lambda x: idx(x))
-                        return cands[0] if cands else None
-
-                    if condition in ("nl", "nl_sw", "schema"):
-                        # Partner-only memory: each agent stores the partner's decoded name if decodable
-                        if name_j is not None:
-                            memories[i].add(name_j)
-                        if name_i is not None:
-                            memories[j].add(name_i)
-                        next_i = modal_from_memory(memories[i]) or z[i]
-                        next_j = modal_from_memory(memories[j]) or z[j]
-                    else:
-                        # 'nl' condition: no memory-based modal update
-                        next_i = z[i]
-                        next_j = z[j]
-
-                    # Additionally, apply win-stay / lose-shift
-                    alpha = lose_shift_alpha
-                    if success:
-                        next_i = z[i]
-                        next_j = z[j]
-                    else:
-                        if name_j is not None and rng.random() < alpha:
-                            next_i = name_j
-                        if name_i is not None and rng.random() < alpha:
-                            next_j = name_i
-                    z[i] = next_i
-                    z[j] = next_j
-                if names_counter:
-                    modal = names_counter.most_common(1)[0][1]
-                else:
-                    modal = 0
-                pop_agree = modal / N
-                agg = {
-                    "seed": s,
-                    "round": r,
-                    "aggregate": True,
-                    "pairs": len(pairs),
-                    "round_tokens": round_tokens,
-                    "pair_success": pair_success,
-                    "population_agreement": pop_agree,
-                    "condition": condition,
-                }
-                f.write(json.dumps(agg, ensure_ascii=False) + "\n")
-                if wandb_run is not None:
-                    try:
-                        step = s * R + r
-                        wandb_run.log({
-                            "seed": s,
-                            "round": r,
-                            "pairs": len(pairs),
-                            "round_tokens": round_tokens,
-                            "pair_success": pair_success,
-                            "population_agreement": pop_agree,
-                            "condition": condition,
-                        }, step=step)
-                    except Exception:
-                        pass
-                if not quiet and (r + 1) % max(1, R // 10) == 0:
-                    pass
+        if every > 0 and ckpt is None:
+            save(None)
+        for s in range(start, seeds):
+            summaries.append(_run_seed(cfg, s, llm, sink, wandb_run, state=state if s == start else None, checkpoint=save, hooks=hooks))
     finally:
-        f.close()
+        sink.close()
+    write_summary(summary_path(path), run_summary(cfg, summaries))
+    remove_log(ck_path)
     return path
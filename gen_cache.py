@@ -0,0 +1,168 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import List, Optional
+from llm import Generation
+
+
+def file_fingerprint(path: str, conn: Optional[sqlite3.Connection] = None) -> str:
+    # sha256 of the model file; memoized per (path, size, mtime) since GGUFs are several GB
+    st = os.stat(path)
+    ident = (os.path.abspath(path), int(st.st_size), int(st.st_mtime_ns))
+    if conn is not None:
+        row = conn.execute("SELECT digest FROM fingerprints WHERE path=? AND size=? AND mtime=?", ident).fetchone()
+        if row:
+            return row[0]
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 24), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+    if conn is not None:
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?, ?)", ident + (digest,))
+    return digest
+
+
+class GenerationCache:
+    # Single-file SQLite store; WAL mode lets several runner processes read and write it at once
+    def __init__(self, path: str, max_bytes: int = 2 << 30, evict_every: int = 256):
+        d = os.path.dirname(os.path.abspath(path))
+        os.makedirs(d, exist_ok=True)
+        self.path = path
+        self.max_bytes = int(max_bytes)
+        self.evict_every = max(1, int(evict_every))
+        self._puts = 0
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=60.0, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA busy_timeout=60000")
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, used REAL NOT NULL)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS entries_used ON entries(used)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS fingerprints (path TEXT, size INTEGER, mtime INTEGER, digest TEXT, PRIMARY KEY (path, size, mtime))")
+
+    @staticmethod
+    def key(*parts) -> str:
+        return hashlib.sha256(json.dumps(parts, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def get_many(self, keys: List[str]) -> dict:
+        if not keys:
+            return {}
+        out = {}
+        with self._lock:
+            for k in range(0, len(keys), 500):
+                chunk = keys[k:k + 500]
+                q = "SELECT key, value FROM entries WHERE key IN (%s)" % ",".join("?" * len(chunk))
+                out.update(dict(self.conn.execute(q, chunk).fetchall()))
+            if out:
+                now = time.time()
+                with self.conn:
+                    self.conn.executemany("UPDATE entries SET used=? WHERE key=?", [(now, k) for k in out])
+        return out
+
+    def put_many(self, items: List[tuple]) -> None:
+        if not items:
+            return
+        now = time.time()
+        rows = [(k, v, len(k) + len(v.encode("utf-8")), now) for k, v in items]
+        with self._lock:
+            with self.conn:
+                self.conn.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)", rows)
+            self._puts += len(rows)
+            if self._puts >= self.evict_every:
+                self._puts = 0
+                self._evict()
+
+    def _evict(self) -> None:
+        # Drop least recently used entries down to 90% of the cap
+        with self.conn:
+            total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            excess = total - int(self.max_bytes * 0.9)
+            drop = []
+            for key, size in self.conn.execute("SELECT key, size FROM entries ORDER BY used"):
+                drop.append((key,))
+                excess -= size
+                if excess <= 0:
+                    break
+            self.conn.executemany("DELETE FROM entries WHERE key=?", drop)
+
+    def close(self) -> None:
+        with self._lock:
+            self.conn.close()
+
+
+class CachedLLM:
+    # Content-addressed front for generate/generate_batch/tokenize_count; other attributes pass through
+    def __init__(self, llm, cache: GenerationCache, model_id: str):
+        self.llm = llm
+        self.cache = cache
+        self.model_id = model_id
+        # Generations only; tokenize_count lookups are cheap and counted apart
+        self.hits = 0
+        self.misses = 0
+        self.tok_hits = 0
+        self.tok_misses = 0
+
+    def __getattr__(self, name):
+        return getattr(self.llm, name)
+
+    def close(self) -> None:
+        if hasattr(self.llm, "close"):
+            self.llm.close()
+        self.cache.close()
+
+    def hit_rate(self) -> float:
+        n = self.hits + self.misses
+        return self.hits / n if n else 0.0
+
+    def tokenize_count(self, text: str) -> int:
+        k = self.cache.key(self.model_id, "tok", text)
+        got = self.cache.get_many([k])
+        if k in got:
+            self.tok_hits += 1
+            return int(got[k])
+        self.tok_misses += 1
+        n = self.llm.tokenize_count(text)
+        self.cache.put_many([(k, str(n))])
+        return n
+
+    def generate(self, prompt: str, max_new_tokens: int, temperature: float, top_p: float, repeat_penalty: float, seed: int, **kw) -> str:
+        return self.generate_batch([prompt], max_new_tokens, temperature, top_p, repeat_penalty, seeds=[seed], **kw)[0]
+
+    def generate_batch(self, prompts: List[str], max_new_tokens: int, temperature: float, top_p: float, repeat_penalty: float, seeds: List[int], **kw) -> List[str]:
+        # Decoding constraints (stop, grammar) change the output, so they are part of the key when set
+        extra = sorted((k, v) for k, v in kw.items() if v is not None)
+        keys = [self.cache.key(self.model_id, "gen", p, int(max_new_tokens), float(temperature), float(top_p), float(repeat_penalty), int(s), *extra) for p, s in zip(prompts, seeds)]
+        # Token usage is stored under a sibling key so a hit reports the same counts as the original call
+        ukeys = [k + ":usage" for k in keys]
+        got = self.cache.get_many(keys + ukeys)
+        miss = [k for k, key in enumerate(keys) if key not in got]
+        fresh = {}
+        self.hits += len(keys) - len(miss)
+        self.misses += len(miss)
+        if miss:
+            if len(miss) == 1 or not hasattr(self.llm, "generate_batch"):
+                fresh = [self.llm.generate(prompts[k], max_new_tokens, temperature, top_p, repeat_penalty, seed=seeds[k], **kw) for k in miss]
+            else:
+                fresh = self.llm.generate_batch([prompts[k] for k in miss], max_new_tokens, temperature, top_p, repeat_penalty, seeds=[seeds[k] for k in miss], **kw)
+            items = [(keys[k], str(txt)) for k, txt in zip(miss, fresh)]
+            items += [(ukeys[k], json.dumps([txt.prompt_tokens, txt.completion_tokens])) for k, txt in zip(miss, fresh) if getattr(txt, "completion_tokens", None) is not None]
+            self.cache.put_many(items)
+            fresh = dict(zip(miss, fresh))
+        out = []
+        for k, key in enumerate(keys):
+            if k in fresh:
+                out.append(fresh[k])
+            elif ukeys[k] in got:
+                pt, ct = json.loads(got[ukeys[k]])
+                out.append(Generation(got[key], pt, ct, 0.0, 0.0))
+            else:
+                out.append(got[key])
+        return out
@@ -0,0 +1,173 @@
+import os
+import time
+from typing import Dict, Iterable, List, Optional
+
+# Phases of a round, as timed by run_game when hooks are attached:
+# pairing, generate (backend calls), parse (decoding and retry bookkeeping around them), write (pair
+# records), update (memories, win-stay/lose-shift), log (aggregate record, checkpoint and wandb of the
+# previous round, which happen after that round's record is built), other (the rest of the round)
+PHASES = ("pairing", "generate", "parse", "write", "update", "log", "other")
+
+
+class Hook:
+    # Callbacks from run_game's seed loop; all no-ops here. on_round_end runs before the aggregate record
+    # is written, so fields added to agg are logged. In pool mode every worker gets its own copy
+    def on_seed_start(self, seed: int, cfg: Dict) -> None:
+        pass
+
+    def on_round_start(self, seed: int, round_id: int) -> None:
+        pass
+
+    def after_generate(self, seed: int, round_id: int, pairs: List[tuple], proposals: List[tuple]) -> None:
+        # proposals: (name, raw, tokens, compliant, info) for i then j of each pair
+        pass
+
+    def on_pair(self, rec: Dict) -> None:
+        # rec may still be queued for the log writer thread: read it, do not modify it
+        pass
+
+    def on_round_end(self, agg: Dict, phases: Dict[str, float]) -> None:
+        # phases: seconds per PHASES entry for this round
+        pass
+
+    def on_seed_end(self, seed: int, summary: Dict) -> None:
+        pass
+
+
+class Hooks(Hook):
+    # Calls each hook in order
+    def __init__(self, hooks: Iterable[Hook]):
+        self.hooks = list(hooks)
+
+    def on_seed_start(self, seed: int, cfg: Dict) -> None:
+        for h in self.hooks:
+            h.on_seed_start(seed, cfg)
+
+    def on_round_start(self, seed: int, round_id: int) -> None:
+        for h in self.hooks:
+            h.on_round_start(seed, round_id)
+
+    def after_generate(self, seed: int, round_id: int, pairs: List[tuple], proposals: List[tuple]) -> None:
+        for h in self.hooks:
+            h.after_generate(seed, round_id, pairs, proposals)
+
+    def on_pair(self, rec: Dict) -> None:
+        for h in self.hooks:
+            h.on_pair(rec)
+
+    def on_round_end(self, agg: Dict, phases: Dict[str, float]) -> None:
+        for h in self.hooks:
+            h.on_round_end(agg, phases)
+
+    def on_seed_end(self, seed: int, summary: Dict) -> None:
+        for h in self.hooks:
+            h.on_seed_end(seed, summary)
+
+
+class TimedLLM:
+    # Accumulates time spent inside backend calls; run_game uses it to split generate from parse
+    def __init__(self, llm):
+        self.llm = llm
+        self.seconds = 0.0
+
+    def __getattr__(self, name):
+        return getattr(self.llm, name)
+
+    def tokenize_count(self, text: str) -> int:
+        t0 = time.perf_counter()
+        try:
+            return self.llm.tokenize_count(text)
+        finally:
+            self.seconds += time.perf_counter() - t0
+
+    def generate(self, *a, **kw) -> str:
+        t0 = time.perf_counter()
+        try:
+            return self.llm.generate(*a, **kw)
+        finally:
+            self.seconds += time.perf_counter() - t0
+
+    def generate_batch(self, *a, **kw) -> List[str]:
+        t0 = time.perf_counter()
+        try:
+            return self.llm.generate_batch(*a, **kw)
+        finally:
+            self.seconds += time.perf_counter() - t0
+
+
+class PhaseTimer(Hook):
+    # Writes phase_<name>_ms for every round into its aggregate record and keeps per-process totals
+    def __init__(self):
+        self.totals = dict.fromkeys(PHASES, 0.0)
+        self.rounds = 0
+
+    def on_round_end(self, agg: Dict, phases: Dict[str, float]) -> None:
+        for k, v in phases.items():
+            agg[f"phase_{k}_ms"] = v * 1000.0
+            self.totals[k] += v
+        self.rounds += 1
+
+    def report(self) -> Dict:
+        tot = sum(self.totals.values())
+        return {k: {"ms": v * 1000.0, "frac": v / tot if tot > 0 else None} for k, v in self.totals.items()}
+
+
+class RoundProfiler(Hook):
+    # cProfile and/or tracemalloc capture of the chosen rounds (all seeds); writes
+    # <out_dir>/seed<s>_round<r>.prof (pstats) and .alloc.txt (top allocation sites by size)
+    def __init__(self, rounds: Iterable[int], out_dir: str, cprofile: bool = True, tracemalloc: bool = False, top: int = 30):
+        self.rounds = set(int(r) for r in rounds)
+        self.out_dir = out_dir
+        self.cprofile = bool(cprofile)
+        self.tracemalloc = bool(tracemalloc)
+        self.top = int(top)
+        self._prof = None
+        self._snap = None
+        self._started = False
+        self._key = None
+
+    def on_round_start(self, seed: int, round_id: int) -> None:
+        if round_id not in self.rounds:
+            return
+        os.makedirs(self.out_dir, exist_ok=True)
+        self._key = os.path.join(self.out_dir, f"seed{seed}_round{round_id}")
+        if self.tracemalloc:
+            import tracemalloc
+            self._started = not tracemalloc.is_tracing()
+            if self._started:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            self._snap = tracemalloc.take_snapshot()
+        if self.cprofile:
+            import cProfile
+            self._prof = cProfile.Profile()
+            self._prof.enable()
+
+    def on_round_end(self, agg: Dict, phases: Dict[str, float]) -> None:
+        if self._key is None:
+            return
+        if self._prof is not None:
+            self._prof.disable()
+            self._prof.dump_stats(self._key + ".prof")
+            self._prof = None
+        if self._snap is not None:
+            import tracemalloc
+            snap = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+            with open(self._key + ".alloc.txt", "w", encoding="utf-8") as f:
+                f.write(f"peak_traced_kb={peak / 1024.0:.1f}\n")
+                for st in snap.compare_to(self._snap, "lineno")[:self.top]:
+                    f.write(f"{st}\n")
+            if self._started:
+                tracemalloc.stop()
+            self._snap = None
+        self._key = None
+
+
+def build_hooks(phase_timer: bool = False, profile_rounds: Optional[Iterable[int]] = None, profile_dir: str = "data/profile", profile_memory: bool = False) -> List[Hook]:
+    hooks = []
+    if phase_timer:
+        hooks.append(PhaseTimer())
+    if profile_rounds:
+        hooks.append(RoundProfiler(profile_rounds, profile_dir, cprofile=True, tracemalloc=profile_memory))
+    return hooks
@@ -1,17 +1,89 @@
 import os
 import math
-from typing import Optional
+import time
+from typing import List, Optional
 
-try:
-    from llama_cpp import Llama
-except Exception:
-    Llama = None
+from schema_enforce import apply_stop, grammar_names
+
+# llama_cpp is imported on first LLMWrapper construction, so mock, surrogate, server and daemon-client
+# runs never pay for loading it
+_PREFIX_CACHE_CLS = None
+
+
+def _llama_cpp():
+    try:
+        import llama_cpp
+    except Exception:
+        raise RuntimeError("llama-cpp-python failed to import. Install a compatible wheel: CPU 'pip install llama-cpp-python[openblas]' or CUDA 'pip install --extra-index-url https://abetlen.github.io/llama-cpp-python/whl/cu121 llama-cpp-python'.")
+    return llama_cpp
+
+
+class Generation(str):
+    # Generated text carrying llama.cpp usage and timings; behaves as a plain str everywhere else
+    def __new__(cls, text: str, prompt_tokens: Optional[int] = None, completion_tokens: Optional[int] = None, prompt_ms: Optional[float] = None, decode_ms: Optional[float] = None):
+        obj = super().__new__(cls, text)
+        obj.prompt_tokens = prompt_tokens
+        obj.completion_tokens = completion_tokens
+        obj.prompt_ms = prompt_ms
+        obj.decode_ms = decode_ms
+        return obj
+
+
+def gen_usage(text) -> dict:
+    # Telemetry of one generate() result; None fields for backends that return plain text
+    return {k: getattr(text, k, None) for k in ("prompt_tokens", "completion_tokens", "prompt_ms", "decode_ms")}
+
+
+def prefix_state_cache(capacity_bytes: int, min_prefix: int = 16, model=None):
+    # The class derives from llama_cpp's LlamaRAMCache, so it is defined once llama_cpp is loaded
+    global _PREFIX_CACHE_CLS
+    if _PREFIX_CACHE_CLS is None:
+        llama_cpp = _llama_cpp()
+
+        class PrefixStateCache(llama_cpp.LlamaRAMCache):
+            # LRU of llama.cpp states keyed by token sequence. Llama only loads a cached state whose prefix is
+            # longer than the one its context already holds, so every other lookup is answered as a miss and
+            # hits/saved_tokens count real loads and the prefill they skip beyond in-context reuse
+            def __init__(self, capacity_bytes: int, min_prefix: int = 16, model=None):
+                super().__init__(capacity_bytes=capacity_bytes)
+                self.min_prefix = int(min_prefix)
+                self.model = model
+                self.hits = 0
+                self.misses = 0
+                self.saved_tokens = 0
+
+            def __getitem__(self, key):
+                key = tuple(key)
+                _key = self._find_longest_prefix_key(key)
+                n = llama_cpp.Llama.longest_token_prefix(_key, key) if _key is not None else 0
+                held = llama_cpp.Llama.longest_token_prefix(self.model._input_ids.tolist(), key) if self.model is not None else 0
+                if n < self.min_prefix or n <= held:
+                    self.misses += 1
+                    raise KeyError("Key not found")
+                self.hits += 1
+                self.saved_tokens += n - held
+                self.cache_state.move_to_end(_key)
+                return self.cache_state[_key]
+
+        _PREFIX_CACHE_CLS = PrefixStateCache
+    return _PREFIX_CACHE_CLS(capacity_bytes, min_prefix, model)
 
 
 class LLMWrapper:
-    def __init__(self, model_path: str, n_ctx: int = 2048, n_threads: Optional[int] = None, n_gpu_layers: int = -1):
-        if Llama is None:
-            raise RuntimeError("llama-cpp-python failed to import. Install a compatible wheel: CPU 'pip install llama-cpp-python[openblas]' or CUDA 'pip install --extra-index-url https://abetlen.github.io/llama-cpp-python/whl/cu121 llama-cpp-python'.")
+    def __init__(self, model_path: str, n_ctx: Optional[int] = None, n_threads: Optional[int] = None, n_gpu_layers: int = -1, n_seq_max: int = 1, seq_ctx: Optional[int] = None, prefix_cache_bytes: int = 0, min_prefix: int = 16, n_batch: Optional[int] = None, tuned: bool = True):
+        llama_cpp = _llama_cpp()
+        # Kept for close(), which may run from __del__ at interpreter exit when imports fail
+        self._lib = llama_cpp
+        # Settings left unset come from autotune.py's results for this model on this host, if any
+        self.tuned = None
+        if tuned:
+            from autotune import tuned_settings
+            self.tuned = tuned_settings(model_path)
+        best = self.tuned or {}
+        n_ctx = n_ctx or best.get("n_ctx", 2048)
+        seq_ctx = seq_ctx or best.get("seq_ctx", 512)
+        n_batch = n_batch or best.get("n_batch", 512)
+        n_threads = n_threads or best.get("n_threads")
         if n_threads is None:
             try:
                 import multiprocessing
@@ -19,15 +91,66 @@ class LLMWrapper:
             except Exception:
                 n_threads = 1
         try:
-            self.model = Llama(model_path=model_path, n_ctx=n_ctx, n_gpu_layers=n_gpu_layers, n_threads=n_threads, logits_all=False, seed=0)
+            self.model = llama_cpp.Llama(model_path=model_path, n_ctx=n_ctx, n_batch=n_batch, n_gpu_layers=n_gpu_layers, n_threads=n_threads, logits_all=False, seed=0, use_mmap=True)
         except Exception as e:
             raise RuntimeError(f"Failed to initialize llama-cpp. {e}")
+        self.n_threads = n_threads
+        self.n_ctx = int(n_ctx)
+        self.n_batch = int(n_batch)
+        self.n_seq_max = max(1, int(n_seq_max))
+        self.seq_ctx = int(seq_ctx)
+        self._batch_ctx = None
+        self._grammars = {}
+        # Prefix reuse: KV slot reuse for generate_batch(); generate() already reuses the prefix its context
+        # holds, and the RAM state cache (opt-in: Llama saves a state after every call) adds older prefixes
+        self.min_prefix = int(min_prefix)
+        self.prefix_cache = None
+        if prefix_cache_bytes > 0:
+            self.prefix_cache = prefix_state_cache(prefix_cache_bytes, self.min_prefix, self.model)
+            self.model.set_cache(self.prefix_cache)
+        self._slot_tokens = [[] for _ in range(self.n_seq_max)]
+        self._slot_used = [0] * self.n_seq_max
+        self._slot_clock = 0
+        self.slot_hits = 0
+        self.slot_misses = 0
+        self.slot_saved_tokens = 0
+        self.context_hits = 0
+        self.context_misses = 0
+        self.context_saved_tokens = 0
 
     def tokenize_count(self, text: str) -> int:
         ids = self.model.tokenize(text.encode("utf-8"))
         return len(ids)
 
-    def generate(self, prompt: str, max_new_tokens: int, temperature: float, top_p: float, repeat_penalty: float, seed: int) -> str:
+    def _grammar(self, grammar: Optional[str]):
+        # Parsed GBNF grammars, one per distinct lexicon
+        if grammar is None:
+            return None
+        if grammar not in self._grammars:
+            self._grammars[grammar] = _llama_cpp().LlamaGrammar.from_string(grammar, verbose=False)
+        return self._grammars[grammar]
+
+    def _count_context_reuse(self, prompt: str) -> None:
+        # Llama.__call__ resumes from the longest prefix its context already holds (e.g. a retry of the
+        # previous prompt) and always re-evaluates the last prompt token
+        held = getattr(self.model, "_input_ids", None)
+        if held is None:
+            return
+        t = self.model.tokenize(prompt.encode("utf-8"))
+        n = min(self.model.longest_token_prefix(held.tolist(), t), len(t) - 1) if len(held) else 0
+        if n > 0:
+            self.context_hits += 1
+            self.context_saved_tokens += n
+        else:
+            self.context_misses += 1
+
+    def generate(self, prompt: str, max_new_tokens: int, temperature: float, top_p: float, repeat_penalty: float, seed: int, stop: Optional[List[str]] = None, grammar: Optional[str] = None) -> str:
+        self._count_context_reuse(prompt)
+        # Llama keeps its context handle private; a release without it only loses the prompt/decode split
+        ctx = getattr(getattr(self.model, "_ctx", None), "ctx", None)
+        if ctx is not None:
+            _perf_reset(ctx)
+        t0 = time.perf_counter()
         out = self.model(
             prompt=prompt,
             max_tokens=max_new_tokens,
@@ -36,10 +159,303 @@ class LLMWrapper:
             repeat_penalty=repeat_penalty,
             seed=int(seed),
             echo=False,
-            stop=None,
+            stop=stop,
+            grammar=self._grammar(grammar),
         )
+        wall = (time.perf_counter() - t0) * 1000.0
         txt = out["choices"][0]["text"]
-        return txt.strip()
+        usage = out.get("usage") or {}
+        perf = _perf_ms(ctx) if ctx is not None else None
+        # Without llama.cpp perf counters the whole call is attributed to decode
+        p_ms, d_ms = perf if perf is not None else (None, wall)
+        return Generation(txt.strip(), usage.get("prompt_tokens"), usage.get("completion_tokens"), p_ms, d_ms)
+
+    def _batch_context(self):
+        # Separate context sized for n_seq_max parallel sequences; shares the loaded weights
+        if self._batch_ctx is None:
+            import llama_cpp
+            params = llama_cpp.llama_context_default_params()
+            params.n_ctx = self.n_seq_max * self.seq_ctx
+            params.n_batch = params.n_ctx
+            # All prompts of a call go into one decode; n_batch sets the micro-batch it is computed in
+            if hasattr(params, "n_ubatch"):
+                params.n_ubatch = min(self.n_batch, params.n_ctx)
+            params.n_seq_max = self.n_seq_max
+            params.n_threads = self.n_threads
+            params.n_threads_batch = self.n_threads
+            ctx = llama_cpp.llama_new_context_with_model(self.model.model, params)
+            if not ctx:
+                raise RuntimeError("Failed to create llama-cpp batch context.")
+            self._batch_ctx = ctx
+        return self._batch_ctx
+
+    def close(self) -> None:
+        # Frees the batch context's KV and the model; the wrapper cannot be used afterwards
+        if self._batch_ctx is not None:
+            self._lib.llama_free(self._batch_ctx)
+            self._batch_ctx = None
+            self._slot_tokens = [[] for _ in range(self.n_seq_max)]
+        if self.model is not None:
+            # Llama.close() is recent; older releases free everything in Llama.__del__
+            if hasattr(self.model, "close"):
+                self.model.close()
+            self.model = None
+
+    def __del__(self):
+        # Partially constructed wrappers have no model attribute yet
+        if getattr(self, "model", None) is not None:
+            self.close()
+
+    def prefix_cache_stats(self) -> dict:
+        # hits/misses/saved_prefill_tokens: RAM state cache and batch slot reuse; context_*: prefixes
+        # generate() resumed from its own context
+        pc = self.prefix_cache
+        return {
+            "hits": (pc.hits if pc else 0) + self.slot_hits,
+            "misses": (pc.misses if pc else 0) + self.slot_misses,
+            "saved_prefill_tokens": (pc.saved_tokens if pc else 0) + self.slot_saved_tokens,
+            "context_hits": self.context_hits,
+            "context_misses": self.context_misses,
+            "context_saved_tokens": self.context_saved_tokens,
+        }
+
+    def _assign_slots(self, toks: List[list]) -> List[tuple]:
+        # Place each prompt on the free sequence slot whose KV shares the longest prefix, else the LRU slot
+        free = set(range(self.n_seq_max))
+        out = []
+        for t in toks:
+            best, best_n = None, 0
+            for s in free:
+                n = self.model.longest_token_prefix(self._slot_tokens[s], t)
+                if n > best_n:
+                    best, best_n = s, n
+            if best is None or best_n < self.min_prefix:
+                best = min(free, key=lambda s: self._slot_used[s])
+                best_n = 0
+                self.slot_misses += 1
+            else:
+                # Keep at least one prompt token to evaluate so the sequence has fresh logits
+                best_n = min(best_n, len(t) - 1)
+                self.slot_hits += 1
+                self.slot_saved_tokens += best_n
+            free.discard(best)
+            self._slot_clock += 1
+            self._slot_used[best] = self._slot_clock
+            out.append((best, best_n))
+        return out
+
+    def _sampler(self, temperature: float, top_p: float, repeat_penalty: float, seed: int, grammar: Optional[str] = None, prompt_tokens: Optional[list] = None):
+        # Mirrors the default sampler chain of Llama.__call__. The penalty window starts with the prompt, but
+        # the grammar must only see generated tokens, so prompt tokens go to the penalties sampler before
+        # it joins the chain rather than through the chain
+        import llama_cpp
+        penalties = llama_cpp.llama_sampler_init_penalties(64, repeat_penalty, 0.0, 0.0)
+        for tok in prompt_tokens or ():
+            llama_cpp.llama_sampler_accept(penalties, tok)
+        chain = llama_cpp.llama_sampler_chain_init(llama_cpp.llama_sampler_chain_default_params())
+        if grammar is not None:
+            vocab = llama_cpp.llama_model_get_vocab(self.model.model) if hasattr(llama_cpp, "llama_model_get_vocab") else self.model.model
+            llama_cpp.llama_sampler_chain_add(chain, llama_cpp.llama_sampler_init_grammar(vocab, grammar.encode("utf-8"), b"root"))
+        llama_cpp.llama_sampler_chain_add(chain, penalties)
+        if temperature <= 0:
+            llama_cpp.llama_sampler_chain_add(chain, llama_cpp.llama_sampler_init_greedy())
+        else:
+            llama_cpp.llama_sampler_chain_add(chain, llama_cpp.llama_sampler_init_top_k(40))
+            llama_cpp.llama_sampler_chain_add(chain, llama_cpp.llama_sampler_init_top_p(top_p, 1))
+            llama_cpp.llama_sampler_chain_add(chain, llama_cpp.llama_sampler_init_min_p(0.05, 1))
+            llama_cpp.llama_sampler_chain_add(chain, llama_cpp.llama_sampler_init_temp(temperature))
+            llama_cpp.llama_sampler_chain_add(chain, llama_cpp.llama_sampler_init_dist(int(seed) & 0xFFFFFFFF))
+        return chain
+
+    def _decode_group(self, prompts: List[str], max_new_tokens: int, temperature: float, top_p: float, repeat_penalty: float, seeds: List[int], stop: Optional[List[str]] = None, grammar: Optional[str] = None) -> List[str]:
+        import llama_cpp
+        ctx = self._batch_context()
+        toks = [self.model.tokenize(p.encode("utf-8")) for p in prompts]
+        for t in toks:
+            if len(t) + max_new_tokens > self.seq_ctx:
+                raise ValueError(f"Prompt of {len(t)} tokens does not fit seq_ctx={self.seq_ctx}")
+        n = len(prompts)
+        slots = self._assign_slots(toks)
+        kv = []
+        for (slot, keep), t in zip(slots, toks):
+            _kv_seq_rm(ctx, slot, keep)
+            kv.append(list(t[:keep]))
+        eos = self.model.token_eos()
+        samplers = [self._sampler(temperature, top_p, repeat_penalty, s, grammar, t) for s, t in zip(seeds, toks)]
+        batch = llama_cpp.llama_batch_init(max(sum(len(t) for t in toks), n), 0, n)
+        try:
+            # Prefill every prompt in one decode; logits only for each sequence's last token
+            entries = []
+            logit_idx = {}
+            for q, t in enumerate(toks):
+                slot, keep = slots[q]
+                for p, tok in enumerate(t):
+                    if p >= keep:
+                        entries.append((tok, p, slot, p == len(t) - 1))
+                        kv[q].append(tok)
+                logit_idx[q] = len(entries) - 1
+            _batch_set(batch, entries)
+            t0 = time.perf_counter()
+            if llama_cpp.llama_decode(ctx, batch) != 0:
+                raise RuntimeError("llama_decode failed during batch prefill")
+            # Shared decodes are attributed per sequence: prefill by evaluated tokens, steps evenly over live sequences
+            prefill_ms = (time.perf_counter() - t0) * 1000.0
+            evaluated = [len(t) - keep for t, (_, keep) in zip(toks, slots)]
+            p_ms = [prefill_ms * e / max(1, sum(evaluated)) for e in evaluated]
+            d_ms = [0.0] * n
+            pos = [len(t) for t in toks]
+            gen = [[] for _ in range(n)]
+            live = list(range(n))
+            for _ in range(max_new_tokens):
+                t0 = time.perf_counter()
+                entries = []
+                nxt = []
+                for q in live:
+                    tok = llama_cpp.llama_sampler_sample(samplers[q], ctx, logit_idx[q])
+                    if tok == eos:
+                        continue
+                    gen[q].append(tok)
+                    if stop and any(s in self.model.detokenize(gen[q]).decode("utf-8", errors="ignore") for s in stop):
+                        continue
+                    if len(gen[q]) < max_new_tokens:
+                        entries.append((tok, pos[q], slots[q][0], True))
+                        kv[q].append(tok)
+                        nxt.append(q)
+                        pos[q] += 1
+                if entries:
+                    _batch_set(batch, entries)
+                    if llama_cpp.llama_decode(ctx, batch) != 0:
+                        raise RuntimeError("llama_decode failed during batch generation")
+                step_ms = (time.perf_counter() - t0) * 1000.0
+                for q in live:
+                    d_ms[q] += step_ms / len(live)
+                if not entries:
+                    break
+                logit_idx = {q: k for k, q in enumerate(nxt)}
+                live = nxt
+        except Exception:
+            # KV contents are unknown after a failed decode
+            for slot, _ in slots:
+                _kv_seq_rm(ctx, slot, 0)
+                self._slot_tokens[slot] = []
+            raise
+        finally:
+            llama_cpp.llama_batch_free(batch)
+            for s in samplers:
+                llama_cpp.llama_sampler_free(s)
+        for (slot, _), t in zip(slots, kv):
+            self._slot_tokens[slot] = t
+        return [Generation(apply_stop(self.model.detokenize(g).decode("utf-8", errors="ignore"), stop).strip(), len(t), len(g), p_ms[q], d_ms[q]) for q, (t, g) in enumerate(zip(toks, gen))]
+
+    def generate_batch(self, prompts: List[str], max_new_tokens: int, temperature: float, top_p: float, repeat_penalty: float, seeds: List[int], stop: Optional[List[str]] = None, grammar: Optional[str] = None) -> List[str]:
+        # Parallel decoding (n_seq_max > 1) is opt-in: its sampler chain approximates Llama.__call__ but has
+        # not been shown token-identical to it, so only the sequential default reproduces generate() exactly
+        if self.n_seq_max <= 1 or len(prompts) <= 1:
+            return [self.generate(p, max_new_tokens, temperature, top_p, repeat_penalty, seed=s, stop=stop, grammar=grammar) for p, s in zip(prompts, seeds)]
+        out = []
+        for k in range(0, len(prompts), self.n_seq_max):
+            out.extend(self._decode_group(prompts[k:k + self.n_seq_max], max_new_tokens, temperature, top_p, repeat_penalty, seeds[k:k + self.n_seq_max], stop=stop, grammar=grammar))
+        return out
+
+
+def build_llm(mock: bool, model_path: Optional[str] = None, n_threads: Optional[int] = None, n_seq_max: int = 1, prefix_cache_bytes: int = 0, gen_cache: Optional[str] = None, gen_cache_mb: int = 2048, surrogate: Optional[str] = None, server: Optional[str] = None, server_concurrency: int = 8, server_timeout: float = 120.0, server_retries: int = 2, daemon: Optional[str] = None):
+    # Module-level so functools.partial(build_llm, ...) can be shipped to worker processes
+    if daemon:
+        from model_daemon import DaemonLLM
+        llm = DaemonLLM(daemon)
+    elif server:
+        from server_llm import AsyncServerLLM
+        llm = AsyncServerLLM(server, concurrency=server_concurrency, timeout=server_timeout, retries=server_retries)
+    elif surrogate:
+        from surrogate import SurrogateLLM
+        llm = SurrogateLLM.load(surrogate)
+    elif mock:
+        llm = MockLLM()
+    else:
+        llm = LLMWrapper(model_path=model_path, n_threads=n_threads, n_seq_max=n_seq_max, prefix_cache_bytes=prefix_cache_bytes)
+    if gen_cache:
+        from gen_cache import GenerationCache, CachedLLM, file_fingerprint
+        cache = GenerationCache(gen_cache, max_bytes=gen_cache_mb << 20)
+        if daemon:
+            # Same model as an in-process run, so both share cache entries
+            model_id = "mock" if llm.info["mock"] else file_fingerprint(llm.info["model_path"], cache.conn)
+        elif server:
+            # The cache cannot see which model the server has loaded; --model-path names it when given
+            model_id = "server:" + (file_fingerprint(model_path, cache.conn) if model_path else server)
+        elif surrogate:
+            model_id = "surrogate:" + GenerationCache.key(llm.tables)
+        else:
+            model_id = "mock" if mock else file_fingerprint(model_path, cache.conn)
+        # Parallel decoding samples with its own chain, so its outputs are not those of sequential generate()
+        seq = llm.info.get("n_seq_max", 1) if daemon else getattr(llm, "n_seq_max", 1)
+        if seq > 1:
+            model_id += f":seq{seq}"
+        llm = CachedLLM(llm, cache, model_id)
+    return llm
+
+
+def llm_counters(llm) -> dict:
+    # Cumulative cache counters of a backend, flattened for summing across workers
+    out = {}
+    if hasattr(llm, "hit_rate"):
+        out["gen_cache_hits"] = llm.hits
+        out["gen_cache_misses"] = llm.misses
+        out["gen_cache_tok_hits"] = llm.tok_hits
+        out["gen_cache_tok_misses"] = llm.tok_misses
+    if hasattr(llm, "prefix_cache_stats"):
+        for k, v in llm.prefix_cache_stats().items():
+            out[f"prefix_cache_{k}"] = v
+    if hasattr(llm, "server_stats"):
+        for k, v in llm.server_stats().items():
+            out[f"server_{k}"] = v
+    return out
+
+
+def close_llm(llm) -> None:
+    # Releases what a backend holds (model and KV memory, sockets, cache files); mock and surrogate hold nothing
+    if hasattr(llm, "close"):
+        llm.close()
+
+
+def _kv_seq_rm(ctx, seq_id: int, p0: int) -> None:
+    import llama_cpp
+    # Renamed across llama-cpp-python releases
+    for fn in ("llama_kv_self_seq_rm", "llama_kv_cache_seq_rm"):
+        if hasattr(llama_cpp, fn):
+            getattr(llama_cpp, fn)(ctx, seq_id, p0, -1)
+            return
+    llama_cpp.llama_memory_seq_rm(llama_cpp.llama_get_memory(ctx), seq_id, p0, -1)
+
+
+def _perf_reset(ctx) -> None:
+    import llama_cpp
+    if hasattr(llama_cpp, "llama_perf_context_reset"):
+        llama_cpp.llama_perf_context_reset(ctx)
+    elif hasattr(llama_cpp, "llama_reset_timings"):
+        llama_cpp.llama_reset_timings(ctx)
+
+
+def _perf_ms(ctx) -> Optional[tuple]:
+    # (prompt-eval ms, decode ms) since the last reset; older releases expose llama_get_timings
+    import llama_cpp
+    if hasattr(llama_cpp, "llama_perf_context"):
+        d = llama_cpp.llama_perf_context(ctx)
+    elif hasattr(llama_cpp, "llama_get_timings"):
+        d = llama_cpp.llama_get_timings(ctx)
+    else:
+        return None
+    return float(d.t_p_eval_ms), float(d.t_eval_ms)
+
+
+def _batch_set(batch, entries: list) -> None:
+    # entries: (token, pos, seq_id, want_logits)
+    batch.n_tokens = len(entries)
+    for k, (tok, pos, seq, logits) in enumerate(entries):
+        batch.token[k] = tok
+        batch.pos[k] = pos
+        batch.n_seq_id[k] = 1
+        batch.seq_id[k][0] = seq
+        batch.logits[k] = bool(logits)
 
 
 class MockLLM:
@@ -49,8 +465,9 @@ class MockLLM:
     def tokenize_count(self, text: str) -> int:
         return int(math.ceil(len(text.strip().split()) * 1.5))
 
-    def generate(self, prompt: str, max_new_tokens: int, temperature: float, top_p: float, repeat_penalty: float, seed: int) -> str:
+    def generate(self, prompt: str, max_new_tokens: int, temperature: float, top_p: float, repeat_penalty: float, seed: int, stop: Optional[List[str]] = None, grammar: Optional[str] = None) -> str:
         import random
+        t0 = time.perf_counter()
         base = int(seed) ^ (max_new_tokens << 8) ^ (int(temperature * 1000) << 16) ^ (int(top_p * 1000) << 24) ^ (int(repeat_penalty * 1000) << 2)
         rng = random.Random(base)
         words = [w for w in prompt.strip().split() if w.isalpha()]
@@ -63,4 +480,14 @@ class MockLLM:
                 seq.append(rng.choice(base))
             else:
                 seq.append(rng.choice(vocab))
-        return " ".join(seq)
+        if grammar is not None:
+            # Honor the schema grammar the way constrained decoding would: fixed frame, lexicon name
+            txt = apply_stop("@say {name: %s} | " % rng.choice(grammar_names(grammar)) + " ".join(seq), stop)
+        else:
+            txt = apply_stop(" ".join(seq), stop)
+        # Token counts use the same whitespace estimate as tokenize_count; all time counts as decode
+        return Generation(txt, self.tokenize_count(prompt), self.tokenize_count(txt), 0.0, (time.perf_counter() - t0) * 1000.0)
+
+    def generate_batch(self, prompts: List[str], max_new_tokens: int, temperature: float, top_p: float, repeat_penalty: float, seeds: List[int], **kw) -> List[str]:
+        # Only forwards the decoding options actually given, so subclasses overriding generate keep working
+        return [self.generate(p, max_new_tokens, temperature, top_p, repeat_penalty, seed=s, **kw) for p, s in zip(prompts, seeds)]
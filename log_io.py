@@ -0,0 +1,420 @@
+import gzip
+import io
+import json
+import os
+import queue
+import shutil
+import threading
+from typing import Dict, List, Optional
+from hooks import PHASES
+
+LOG_FORMATS = ("jsonl", "jsonl.gz", "jsonl.zst", "parquet")
+# Compact JSONL: compressed streams with interned raw texts (see CompactJsonlSink); zstd goes through pyarrow
+COMPRESSION = {"jsonl.gz": "gzip", "jsonl.zst": "zstd"}
+# Formats a checkpointed run can truncate and append to
+RESUMABLE = ("jsonl", "jsonl.gz")
+TEXT_DEF = '{"_text": '
+TEXT_KEYS = {"i_txt_id": "i_txt", "j_txt_id": "j_txt"}
+
+# Arrow column types of the two columnar tables; records are projected onto these so every
+# row group shares one schema even when a column is all-null in early rounds
+PAIR_COLUMNS = [
+    ("seed", "int64"), ("round", "int64"), ("pair", "list<int64>"), ("i_id", "int64"), ("j_id", "int64"),
+    ("i_proposed", "string"), ("j_proposed", "string"), ("i_name", "string"), ("j_name", "string"),
+    ("i_txt", "string"), ("j_txt", "string"), ("i_tokens", "int64"), ("j_tokens", "int64"),
+    ("i_compliant", "bool"), ("j_compliant", "bool"), ("condition", "string"), ("decode_mode", "string"),
+    ("i_retry", "bool"), ("i_prompt_tokens", "int64"), ("i_completion_tokens", "int64"), ("i_prompt_ms", "double"), ("i_decode_ms", "double"),
+    ("j_retry", "bool"), ("j_prompt_tokens", "int64"), ("j_completion_tokens", "int64"), ("j_prompt_ms", "double"), ("j_decode_ms", "double"),
+]
+AGG_COLUMNS = [
+    ("seed", "int64"), ("round", "int64"), ("aggregate", "bool"), ("pairs", "int64"), ("round_tokens", "int64"),
+    ("pair_success", "int64"), ("population_agreement", "double"), ("condition", "string"), ("decode_mode", "string"),
+    ("engine", "string"), ("retries", "int64"), ("prompt_tokens", "int64"), ("completion_tokens", "int64"),
+    ("prompt_ms", "double"), ("decode_ms", "double"), ("decode_tokens_per_sec", "double"),
+    ("round_wall_ms", "double"), ("llm_ms", "double"), ("llm_frac", "double"),
+    ("early_stop", "string"), ("planned_rounds", "int64"),
+] + [(f"phase_{p}_ms", "double") for p in PHASES]
+TABLES = ("pairs", "agg")
+
+
+def _arrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except Exception:
+        raise RuntimeError("Columnar logs need pyarrow: pip install pyarrow")
+    return pa, pq
+
+
+def _schema(columns: List[tuple]):
+    pa, _ = _arrow()
+    types = {"int64": pa.int64(), "double": pa.float64(), "bool": pa.bool_(), "string": pa.string(), "list<int64>": pa.list_(pa.int64())}
+    return pa.schema([(name, types[t]) for name, t in columns])
+
+
+def log_path(stem: str, fmt: str) -> str:
+    # A parquet run is a directory holding pairs.parquet and agg.parquet
+    return f"{stem}.{fmt}"
+
+
+def is_parquet_run(path: str) -> bool:
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, "agg.parquet"))
+
+
+def remove_log(path: str) -> None:
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def log_compression(path: str) -> Optional[str]:
+    for fmt, codec in COMPRESSION.items():
+        if path.endswith("." + fmt):
+            return codec
+    return None
+
+
+def is_jsonl_log(name: str) -> bool:
+    return name.endswith(".jsonl") or log_compression(name) is not None
+
+
+def open_log_text(path: str, codec: Optional[str] = None):
+    # Text-mode reader for plain, gzip or zstd JSONL; concatenated gzip members / zstd frames read as one stream
+    codec = codec or log_compression(path)
+    if codec == "gzip":
+        return gzip.open(path, "rt", encoding="utf-8")
+    if codec == "zstd":
+        pa, _ = _arrow()
+        return io.TextIOWrapper(pa.input_stream(path, compression="zstd"), encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+
+
+def iter_jsonl(path: str, aggregate_only: bool = False, strict: bool = True):
+    # Records of a JSONL log in any of the JSONL formats, with interned texts resolved.
+    # Text ids refer to the latest definition above them, so concatenated part files stay readable
+    texts = {}
+    with open_log_text(path) as f:
+        for line in f:
+            if line.startswith(TEXT_DEF):
+                if not aggregate_only:
+                    d = json.loads(line)
+                    texts[d["_text"]] = d["s"]
+                continue
+            # Pair lines are skipped before parsing when only aggregates are wanted
+            if aggregate_only and '"aggregate": true' not in line:
+                continue
+            try:
+                x = json.loads(line)
+            except Exception:
+                if strict:
+                    raise
+                continue
+            if "i_txt_id" in x or "j_txt_id" in x:
+                x = {TEXT_KEYS.get(k, k): (texts[v] if k in TEXT_KEYS else v) for k, v in x.items()}
+            yield x
+
+
+class JsonlSink:
+    def __init__(self, path: str, append: bool = False):
+        self.f = open(path, "a" if append else "w", encoding="utf-8")
+
+    def pair(self, rec: Dict) -> None:
+        self.f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+
+    def agg(self, rec: Dict) -> None:
+        self.f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+
+    def end_round(self) -> None:
+        pass
+
+    def write_many(self, items: List[tuple]) -> None:
+        # items: (kind, record) in log order; serialized into one write
+        self.f.write("".join(json.dumps(rec, ensure_ascii=False) + "\n" for _, rec in items))
+
+    def defer(self, fn, *args) -> None:
+        fn(*args)
+
+    def flush(self) -> int:
+        # Durable byte offset of everything written so far, for checkpoints
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        return self.f.tell()
+
+    def close(self) -> None:
+        self.f.close()
+
+
+class CompactJsonlSink:
+    # JSONL through gzip or zstd with raw texts interned: each distinct i_txt/j_txt is written once as a
+    # {"_text": id, "s": text} line ahead of the first record using it, and records carry i_txt_id/j_txt_id.
+    # For checkpoints, flush() ends the current gzip member so the file can be truncated at its offset
+    def __init__(self, path: str, codec: str = "gzip", append: bool = False, level: int = 6):
+        self.codec = codec
+        self.level = int(level)
+        self.texts = {}
+        if append:
+            if codec != "gzip":
+                raise ValueError("Only gzip-compressed logs can be appended to; resume needs log_format in %s" % (RESUMABLE,))
+            # Reload the table written up to the checkpoint offset
+            with open_log_text(path, codec) as f:
+                for line in f:
+                    if line.startswith(TEXT_DEF):
+                        d = json.loads(line)
+                        self.texts[d["s"]] = d["_text"]
+        if codec == "gzip":
+            self.raw = open(path, "ab" if append else "wb")
+            self.f = gzip.GzipFile(fileobj=self.raw, mode="wb", compresslevel=self.level)
+        elif codec == "zstd":
+            pa, _ = _arrow()
+            self.raw = None
+            self.f = pa.output_stream(path, compression="zstd")
+        else:
+            raise ValueError(f"Unknown compression {codec!r}")
+
+    def _encode(self, rec: Dict) -> str:
+        defs = []
+        if rec.get("i_txt") is not None or rec.get("j_txt") is not None:
+            out = {}
+            for k, v in rec.items():
+                if k in ("i_txt", "j_txt") and v is not None:
+                    t = self.texts.get(v)
+                    if t is None:
+                        t = self.texts[v] = len(self.texts)
+                        defs.append(json.dumps({"_text": t, "s": v}, ensure_ascii=False) + "\n")
+                    out[k + "_id"] = t
+                else:
+                    out[k] = v
+            rec = out
+        return "".join(defs) + json.dumps(rec, ensure_ascii=False) + "\n"
+
+    def pair(self, rec: Dict) -> None:
+        self.f.write(self._encode(rec).encode("utf-8"))
+
+    def agg(self, rec: Dict) -> None:
+        self.f.write(self._encode(rec).encode("utf-8"))
+
+    def end_round(self) -> None:
+        pass
+
+    def write_many(self, items: List[tuple]) -> None:
+        self.f.write("".join(self._encode(rec) for _, rec in items).encode("utf-8"))
+
+    def defer(self, fn, *args) -> None:
+        fn(*args)
+
+    def flush(self) -> int:
+        if self.raw is None:
+            raise ValueError("zstd logs cannot be checkpointed; use log_format='jsonl.gz'")
+        self.f.close()
+        self.raw.flush()
+        os.fsync(self.raw.fileno())
+        off = self.raw.tell()
+        self.f = gzip.GzipFile(fileobj=self.raw, mode="wb", compresslevel=self.level)
+        return off
+
+    def close(self) -> None:
+        self.f.close()
+        if self.raw is not None:
+            self.raw.close()
+
+
+class ParquetSink:
+    # Buffers one round of pair records and writes it as a row group; aggregates (one row per round)
+    # are written in larger groups
+    def __init__(self, path: str, agg_group: int = 1024):
+        pa, pq = _arrow()
+        remove_log(path)
+        os.makedirs(path)
+        self.path = path
+        self.agg_group = int(agg_group)
+        self._pairs = []
+        self._aggs = []
+        self._schemas = {"pairs": _schema(PAIR_COLUMNS), "agg": _schema(AGG_COLUMNS)}
+        self._writers = {t: pq.ParquetWriter(os.path.join(path, f"{t}.parquet"), self._schemas[t], compression="zstd") for t in TABLES}
+
+    def pair(self, rec: Dict) -> None:
+        self._pairs.append(rec)
+
+    def agg(self, rec: Dict) -> None:
+        self._aggs.append(rec)
+
+    def _flush(self, table: str, rows: List[Dict]) -> None:
+        if rows:
+            pa, _ = _arrow()
+            self._writers[table].write_table(pa.Table.from_pylist(rows, schema=self._schemas[table]))
+            rows.clear()
+
+    def end_round(self) -> None:
+        self._flush("pairs", self._pairs)
+        if len(self._aggs) >= self.agg_group:
+            self._flush("agg", self._aggs)
+
+    def write_many(self, items: List[tuple]) -> None:
+        for kind, rec in items:
+            (self._pairs if kind == "pair" else self._aggs).append(rec)
+
+    def defer(self, fn, *args) -> None:
+        fn(*args)
+
+    def close(self) -> None:
+        self._flush("pairs", self._pairs)
+        self._flush("agg", self._aggs)
+        for w in self._writers.values():
+            w.close()
+
+    def append_run(self, part_path: str) -> List[Dict]:
+        # Copies another run's tables row group by row group; returns its aggregate records
+        _, pq = _arrow()
+        self.end_round()
+        self._flush("agg", self._aggs)
+        aggs = []
+        for t in TABLES:
+            src = pq.ParquetFile(os.path.join(part_path, f"{t}.parquet"))
+            for g in range(src.num_row_groups):
+                tbl = src.read_row_group(g)
+                self._writers[t].write_table(tbl)
+                if t == "agg":
+                    aggs.extend(tbl.to_pylist())
+        return aggs
+
+
+class ThreadedSink:
+    # Moves serialization, file writes and deferred calls (wandb logging) off the generation thread.
+    # A round's records are handed over as one batch through a bounded queue (put blocks when max_rounds
+    # batches are pending) and written in order, so the log is identical to the wrapped sink's. Records
+    # must not be modified once passed. flush() and close() drain the queue first; a writer error is
+    # raised on the next call
+    _END = object()
+
+    def __init__(self, sink, max_rounds: int = 64):
+        self.sink = sink
+        self.q = queue.Queue(maxsize=max(1, int(max_rounds)))
+        self.error = None
+        self._batch = []
+        self._thread = threading.Thread(target=self._work, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def _work(self) -> None:
+        while True:
+            item = self.q.get()
+            try:
+                if item is self._END:
+                    return
+                if self.error is None:
+                    batch, end, calls = item
+                    if batch:
+                        self.sink.write_many(batch)
+                    if end:
+                        self.sink.end_round()
+                    for fn, args in calls:
+                        fn(*args)
+            except BaseException as e:
+                self.error = e
+            finally:
+                self.q.task_done()
+
+    def _put(self, end: bool = False, calls: tuple = ()) -> None:
+        item = (self._batch, end, calls)
+        self._batch = []
+        while True:
+            if self.error is not None:
+                raise RuntimeError("Log writer thread failed") from self.error
+            try:
+                self.q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                if not self._thread.is_alive():
+                    raise RuntimeError("Log writer thread exited")
+
+    def pair(self, rec: Dict) -> None:
+        self._batch.append(("pair", rec))
+
+    def agg(self, rec: Dict) -> None:
+        self._batch.append(("agg", rec))
+
+    def end_round(self) -> None:
+        self._put(end=True)
+
+    def defer(self, fn, *args) -> None:
+        self._put(calls=((fn, args),))
+
+    def _drain(self) -> None:
+        self._put()
+        self.q.join()
+        if self.error is not None:
+            raise RuntimeError("Log writer thread failed") from self.error
+
+    def flush(self) -> int:
+        self._drain()
+        return self.sink.flush()
+
+    def append_run(self, part_path: str) -> List[Dict]:
+        self._drain()
+        return self.sink.append_run(part_path)
+
+    def close(self) -> None:
+        # Writes whatever was queued before the wrapped sink is closed, also when the run failed
+        try:
+            if self._thread.is_alive():
+                self.q.put((self._batch, False, ()))
+                self._batch = []
+                self.q.put(self._END)
+                self._thread.join()
+        finally:
+            self.sink.close()
+        if self.error is not None:
+            raise RuntimeError("Log writer thread failed") from self.error
+
+
+def open_sink(path: str, fmt: str = "jsonl", append: bool = False, threaded: bool = False):
+    if fmt == "parquet":
+        if append:
+            raise ValueError("Parquet logs cannot be appended to; resume needs log_format in %s" % (RESUMABLE,))
+        sink = ParquetSink(path)
+    elif fmt in COMPRESSION:
+        sink = CompactJsonlSink(path, COMPRESSION[fmt], append=append)
+    elif fmt != "jsonl":
+        raise ValueError(f"Unknown log format {fmt!r}; expected one of {LOG_FORMATS}")
+    else:
+        sink = JsonlSink(path, append=append)
+    return ThreadedSink(sink) if threaded else sink
+
+
+def truncate_log(path: str, offset: int) -> None:
+    # Drops records written after the last checkpoint
+    with open(path, "r+b") as f:
+        f.truncate(offset)
+
+
+def iter_parquet_run(path: str, columns: Optional[List[str]] = None, filters: Optional[List[tuple]] = None, batch_rows: Optional[int] = None, aggregate_only: bool = False):
+    # Column projection and predicates are pushed down to the parquet reader (row groups are skipped
+    # on their statistics); yields DataFrames of at most batch_rows rows, or one per table if None
+    import pyarrow.dataset as ds
+    _, pq = _arrow()
+    expr = pq.filters_to_expression(filters) if filters else None
+    for t in (("agg",) if aggregate_only else TABLES):
+        fp = os.path.join(path, f"{t}.parquet")
+        names = pq.read_schema(fp).names
+        cols = None if columns is None else [c for c in names if c in columns or c == "aggregate"]
+        if cols == []:
+            continue
+        dset = ds.dataset(fp, format="parquet")
+        if batch_rows is None:
+            yield dset.to_table(columns=cols, filter=expr).to_pandas()
+            continue
+        for b in dset.to_batches(columns=cols, filter=expr, batch_size=int(batch_rows)):
+            if b.num_rows:
+                yield b.to_pandas()
+
+
+def read_parquet_run(path: str, columns: Optional[List[str]] = None, filters: Optional[List[tuple]] = None):
+    import pandas as pd
+    frames = list(iter_parquet_run(path, columns=columns, filters=filters))
+    if not frames:
+        return pd.DataFrame()
+    df = pd.concat(frames, ignore_index=True)
+    # Same row order as the JSONL log: a round's pair records, then its aggregate
+    if "seed" in df.columns and "round" in df.columns:
+        df = df.sort_values(["seed", "round"], kind="stable", ignore_index=True)
+    return df
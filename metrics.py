@@ -3,32 +3,86 @@ import math
 import os
 import pandas as pd
 import numpy as np
+from log_io import is_parquet_run, iter_parquet_run, is_jsonl_log, iter_jsonl
 
 
-def load_logs(path: str) -> pd.DataFrame:
-    rows = []
-    if os.path.isdir(path):
-        for fn in os.listdir(path):
-            if fn.endswith('.jsonl'):
-                with open(os.path.join(path, fn), 'r', encoding='utf-8') as f:
-                    for line in f:
-                        try:
-                            x = json.loads(line)
-                            x['_file'] = fn
-                            rows.append(x)
-                        except Exception:
-                            continue
+def _keep(x: dict, seeds, rounds, condition) -> bool:
+    if seeds is not None and x.get('seed') not in seeds:
+        return False
+    if rounds is not None and x.get('round') not in rounds:
+        return False
+    if condition is not None and x.get('condition') != condition:
+        return False
+    return True
+
+
+def _project(x: dict, columns) -> dict:
+    if columns is None:
+        return x
+    return {k: v for k, v in x.items() if k in columns or k == 'aggregate'}
+
+
+def iter_logs(path: str, chunk_rows: int = 100000, columns=None, condition=None, seeds=None, rounds=None, aggregate_only: bool = False):
+    # Yields DataFrames of at most chunk_rows records (None: one per file run of JSONL / parquet table).
+    # columns: subset to keep (e.g. without i_txt/j_txt); seeds/rounds: ranges or collections of ids;
+    # condition: keep one condition; aggregate_only: only per-round aggregate records.
+    # Columnar runs push all of it down to the parquet reader; JSONL logs are filtered while parsing
+    if columns is not None:
+        columns = set(columns)
+    seeds = None if seeds is None else (seeds if isinstance(seeds, range) else set(int(s) for s in seeds))
+    rounds = None if rounds is None else (rounds if isinstance(rounds, range) else set(int(r) for r in rounds))
+    filters = []
+    for col, ids in (('seed', seeds), ('round', rounds)):
+        if ids is None:
+            continue
+        if isinstance(ids, range) and ids.step == 1:
+            filters += [(col, '>=', ids.start), (col, '<', ids.stop)]
+        else:
+            filters.append((col, 'in', sorted(ids)))
+    if condition is not None:
+        condition = str(condition).lower()
+        filters.append(('condition', '=', condition))
+    single = not os.path.isdir(path) or is_parquet_run(path)
+    if single:
+        names = [os.path.basename(path)]
+        path = os.path.dirname(path)
     else:
-        with open(path, 'r', encoding='utf-8') as f:
-            for line in f:
-                x = json.loads(line)
-                x['_file'] = os.path.basename(path)
-                rows.append(x)
-    return pd.DataFrame(rows)
+        names = os.listdir(path)
+    rows = []
+    for fn in names:
+        fp = os.path.join(path, fn)
+        if is_parquet_run(fp):
+            if rows:
+                yield pd.DataFrame(rows)
+                rows = []
+            for df in iter_parquet_run(fp, columns=columns, filters=filters, batch_rows=chunk_rows, aggregate_only=aggregate_only):
+                df['_file'] = fn
+                yield df
+        elif single or is_jsonl_log(fn):
+            # Plain or compact (compressed, interned-text) JSONL
+            for x in iter_jsonl(fp, aggregate_only=aggregate_only, strict=single):
+                if _keep(x, seeds, rounds, condition):
+                    x = _project(x, columns)
+                    x['_file'] = fn
+                    rows.append(x)
+                    if chunk_rows is not None and len(rows) >= chunk_rows:
+                        yield pd.DataFrame(rows)
+                        rows = []
+    if rows:
+        yield pd.DataFrame(rows)
+
+
+def load_logs(path: str, columns=None, seeds=None, rounds=None, condition=None, aggregate_only: bool = False) -> pd.DataFrame:
+    frames = list(iter_logs(path, chunk_rows=None, columns=columns, condition=condition, seeds=seeds, rounds=rounds, aggregate_only=aggregate_only))
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
 
 
 def is_agg(df: pd.DataFrame) -> pd.Series:
-    return df.get('aggregate', False).fillna(False) == True
+    if 'aggregate' not in df.columns:
+        return pd.Series(False, index=df.index)
+    return df['aggregate'].fillna(False) == True
 
 
 def _entropy(p):
@@ -40,31 +94,154 @@ def _entropy(p):
     return float(-(p * np.log2(p)).sum())
 
 
-def summarize(df: pd.DataFrame, population: int, target: float = 0.9) -> dict:
-    adf = df[is_agg(df)].copy()
+RUN_KEYS = ['_file', 'seed']
+# Columns the summaries read; pass as columns= when loading to skip raw texts and telemetry
+SUMMARY_COLUMNS = ['seed', 'round', 'aggregate', 'condition', 'round_tokens', 'population_agreement', 'i_name', 'j_name', 'early_stop', 'planned_rounds']
+
+
+def _runs(df: pd.DataFrame) -> pd.DataFrame:
+    # Seed ids restart in every log, so a run is identified by (_file, seed)
+    if '_file' not in df.columns:
+        df = df.assign(_file='')
+    return df
+
+
+def _chunks(src, chunk_rows: int = 100000):
+    # A DataFrame, a log path (streamed with SUMMARY_COLUMNS) or an iterable of DataFrame chunks
+    if isinstance(src, pd.DataFrame):
+        return [src]
+    if isinstance(src, str):
+        return iter_logs(src, chunk_rows=chunk_rows, columns=SUMMARY_COLUMNS)
+    return src
+
+
+class RunAccumulator:
+    # Per-(_file, seed) summary state folded over record chunks in any order; memory is bounded by the
+    # number of runs and the final round's name counts, not by the number of records seen
+    def __init__(self, target: float = 0.9):
+        self.target = float(target)
+        self.runs = None
+        self.names = None
+
+    def update(self, chunk: pd.DataFrame) -> None:
+        if chunk.empty:
+            return
+        chunk = _runs(chunk)
+        agg = is_agg(chunk)
+        adf = chunk[agg]
+        if not adf.empty:
+            g = adf.groupby(RUN_KEYS, sort=False)
+            part = g.agg(condition=('condition', 'first'), tokens_total=('round_tokens', 'sum'), last_round=('round', 'max'))
+            # Positional: chunks read from several files can repeat index labels
+            last = adf.sort_values('round', kind='stable').groupby(RUN_KEYS, sort=False).tail(1)
+            part['final_agreement'] = last.set_index(RUN_KEYS)['population_agreement']
+            hit = adf[adf['population_agreement'] >= self.target].groupby(RUN_KEYS)['round'].min()
+            part['rounds_to_target'] = hit.reindex(part.index).astype(float)
+            # Early-stopped seeds mark their last aggregate; their final state is the carried-forward state
+            stops = adf[adf['early_stop'].notna()].groupby(RUN_KEYS)['round'].max() if 'early_stop' in adf.columns else pd.Series(dtype=float)
+            part['stop_round'] = stops.reindex(part.index).astype(float)
+            if self.runs is not None:
+                part = pd.concat([self.runs, part]).sort_values('last_round', kind='stable')
+                g = part.groupby(level=RUN_KEYS, sort=False)
+                part = g.last().assign(condition=g['condition'].first(), tokens_total=g['tokens_total'].sum(), rounds_to_target=g['rounds_to_target'].min())
+            self.runs = part
+        if 'i_name' in chunk.columns and (~agg).any():
+            # Name counts of each run's latest round seen so far; undecodable outputs count as their own category
+            pdf = chunk.loc[~agg, RUN_KEYS + ['round', 'i_name', 'j_name']]
+            names = pd.concat([pdf[RUN_KEYS + ['round', 'i_name']].rename(columns={'i_name': 'name'}), pdf[RUN_KEYS + ['round', 'j_name']].rename(columns={'j_name': 'name'})], ignore_index=True)
+            names['name'] = names['name'].astype(object).where(names['name'].notna(), 'None').astype(str)
+            counts = names.groupby(RUN_KEYS + ['round', 'name']).size()
+            if self.names is not None:
+                counts = pd.concat([self.names, counts]).groupby(level=RUN_KEYS + ['round', 'name']).sum()
+            rnd = counts.index.get_level_values('round')
+            latest = pd.Series(rnd, index=counts.index).groupby(level=RUN_KEYS).transform('max')
+            self.names = counts[rnd == latest.values]
+
+    def result(self) -> pd.DataFrame:
+        cols = RUN_KEYS + ['condition', 'rounds', 'rounds_to_target', 'tokens_total', 'final_agreement', 'final_entropy', 'stop_round']
+        if self.runs is None:
+            return pd.DataFrame(columns=cols)
+        out = self.runs.sort_index().copy()
+        out['rounds'] = out['last_round'] + 1
+        ent = pd.Series(dtype=float)
+        if self.names is not None:
+            last = out['last_round'].rename('round').reset_index()
+            counts = self.names.rename('n').reset_index().merge(last, on=RUN_KEYS + ['round']).set_index(RUN_KEYS)['n']
+            p = counts / counts.groupby(level=RUN_KEYS).transform('sum')
+            ent = (-(p * np.log2(p))).groupby(level=RUN_KEYS).sum()
+        out['final_entropy'] = ent.reindex(out.index).fillna(0.0)
+        return out.reset_index()[cols]
+
+
+def summarize_runs(src, target: float = 0.9, chunk_rows: int = 100000) -> pd.DataFrame:
+    # One row per (_file, seed); src is a DataFrame, a log path, or an iterable of chunks
+    acc = RunAccumulator(target)
+    for chunk in _chunks(src, chunk_rows):
+        acc.update(chunk)
+    return acc.result()
+
+
+def agreement_curves(src) -> pd.DataFrame:
+    # Long-form (_file, round) -> mean/std/n of population agreement across seeds. Seeds that stopped
+    # early carry their last agreement forward to the file's planned horizon, so means stay comparable
+    if isinstance(src, str):
+        adf = load_logs(src, columns=['seed', 'round', 'aggregate', 'population_agreement', 'planned_rounds'], aggregate_only=True)
+    else:
+        adf = _runs(src)
+        adf = adf[is_agg(adf)]
     if adf.empty:
+        return pd.DataFrame(columns=['_file', 'round', 'mean', 'std', 'n_seeds'])
+    horizon = adf.groupby('_file')['round'].max() + 1
+    if 'planned_rounds' in adf.columns:
+        horizon = np.maximum(horizon, adf.groupby('_file')['planned_rounds'].max().fillna(0))
+    wide = adf.pivot(index=RUN_KEYS, columns='round', values='population_agreement')
+    wide = wide.reindex(columns=range(int(horizon.max()))).ffill(axis=1)
+    adf = wide.stack().rename('population_agreement').reset_index()
+    adf = adf[adf['round'] < adf['_file'].map(horizon)]
+    curves = adf.groupby(['_file', 'round'])['population_agreement'].agg(['mean', 'std', 'count'])
+    return curves.rename(columns={'count': 'n_seeds'}).reset_index()
+
+
+def manifest_configs(manifest_path: str) -> pd.DataFrame:
+    # Sweep manifest (sweep_<hash>.json) -> one row of config columns per log file
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        jobs = json.load(f)
+    return pd.DataFrame([dict(j['cfg'], _file=os.path.basename(j['path']), job_id=j['id']) for j in jobs])
+
+
+def summarize_configs(src, target: float = 0.9, configs: pd.DataFrame = None, chunk_rows: int = 100000) -> pd.DataFrame:
+    # Tidy per-config table (one row per log file); configs, e.g. from manifest_configs, adds the sweep axes
+    runs = summarize_runs(src, target, chunk_rows)
+    g = runs.groupby('_file')
+    out = g.agg(
+        condition=('condition', 'first'),
+        n_seeds=('seed', 'count'),
+        rounds=('rounds', 'max'),
+        rounds_to_target_mean=('rounds_to_target', 'mean'),
+        rounds_to_target_std=('rounds_to_target', lambda x: float(np.nanstd(x)) if x.notna().any() else np.nan),
+        reached_target=('rounds_to_target', lambda x: float(x.notna().mean())),
+        tokens_total_mean=('tokens_total', 'mean'),
+        final_agreement_mean=('final_agreement', 'mean'),
+        final_entropy_mean=('final_entropy', 'mean'),
+        final_entropy_std=('final_entropy', lambda x: float(np.std(x))),
+        rounds_run_mean=('rounds', 'mean'),
+        stopped_early=('stop_round', lambda x: int(x.notna().sum())),
+    ).reset_index()
+    if configs is not None:
+        out = out.merge(configs.drop(columns=[c for c in ('condition',) if c in configs.columns]), on='_file', how='left')
+    return out
+
+
+def summarize(df, population: int, target: float = 0.9, chunk_rows: int = 100000) -> dict:
+    # df may also be a log path or an iterable of chunks, summarized incrementally
+    runs = summarize_runs(df, target, chunk_rows)
+    if runs.empty:
         return {"rounds_to_target_mean": np.nan, "rounds_to_target_std": np.nan, "tokens_total_mean": np.nan, "final_entropy_mean": np.nan, "final_entropy_std": np.nan}
-    grp = adf.groupby(['seed'])
-    rtt = []
-    tokens_total = []
-    final_entropy = []
-    for seed, g in grp:
-        g = g.sort_values('round')
-        hit = g[g['population_agreement'] >= target]
-        if len(hit) == 0:
-            rtt.append(np.nan)
-        else:
-            rtt.append(int(hit['round'].iloc[0]))
-        tokens_total.append(float(g['round_tokens'].sum()))
-        last_round = int(g['round'].max())
-        last_rows = df[(df['seed'] == seed) & (df['round'] == last_round) & (~is_agg(df))]
-        names = list(last_rows['i_name'].astype(str)) + list(last_rows['j_name'].astype(str))
-        counts = pd.Series(names).value_counts()
-        final_entropy.append(_entropy(counts.values))
+    rtt = runs['rounds_to_target'].astype(float).values
     return {
         "rounds_to_target_mean": float(np.nanmean(rtt)),
         "rounds_to_target_std": float(np.nanstd(rtt)),
-        "tokens_total_mean": float(np.mean(tokens_total)),
-        "final_entropy_mean": float(np.mean(final_entropy)),
-        "final_entropy_std": float(np.std(final_entropy)),
+        "tokens_total_mean": float(runs['tokens_total'].mean()),
+        "final_entropy_mean": float(runs['final_entropy'].mean()),
+        "final_entropy_std": float(np.std(runs['final_entropy'].values)),
     }
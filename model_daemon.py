@@ -0,0 +1,231 @@
+import argparse
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+
+from llm import Generation, gen_usage, llm_counters
+
+
+def default_socket_path() -> str:
+    return os.path.join(tempfile.gettempdir(), f"sign-naming-llm-{os.getuid()}.sock")
+
+
+def _encode(gen) -> Dict:
+    return dict(gen_usage(gen), text=str(gen))
+
+
+def _decode(d: Dict) -> Generation:
+    return Generation(d["text"], d["prompt_tokens"], d["completion_tokens"], d["prompt_ms"], d["decode_ms"])
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    # One JSON request per line, answered by {"ok": true, "result": ...} or {"ok": false, "error": ...}
+    def handle(self) -> None:
+        daemon = self.server.model_daemon
+        for line in self.rfile:
+            try:
+                out = {"ok": True, "result": daemon.call(json.loads(line))}
+            except Exception as e:
+                out = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+            self.wfile.write(json.dumps(out).encode("utf-8") + b"\n")
+
+
+class ModelDaemon:
+    # Keeps one backend resident and serves it over a Unix socket. Clients are handled on their own
+    # threads; backend calls are serialized, as the llama.cpp contexts are not thread-safe
+    def __init__(self, llm, socket_path: str, info: Dict):
+        self.llm = llm
+        self.socket_path = socket_path
+        self.info = dict(info)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.started = time.time()
+        self.server = None
+
+    def call(self, req: Dict):
+        op = req.get("op")
+        if op == "info":
+            return dict(self.info, pid=os.getpid(), uptime_sec=time.time() - self.started, requests=self.requests, counters=llm_counters(self.llm))
+        if op == "shutdown":
+            # shutdown() waits for serve_forever, so it cannot run on a handler thread's critical path
+            threading.Thread(target=self.server.shutdown, daemon=True).start()
+            return True
+        with self.lock:
+            self.requests += 1
+            if op == "generate":
+                return _encode(self.llm.generate(req["prompt"], **req["kw"]))
+            if op == "generate_batch":
+                return [_encode(g) for g in self.llm.generate_batch(req["prompts"], **req["kw"])]
+            if op == "tokenize_count":
+                return self.llm.tokenize_count(req["text"])
+        raise ValueError(f"Unknown op {op!r}")
+
+    def serve_forever(self) -> None:
+        if os.path.exists(self.socket_path):
+            if daemon_info(self.socket_path) is not None:
+                raise RuntimeError(f"A model daemon is already serving {self.socket_path}")
+            # Left behind by a daemon that was killed
+            os.remove(self.socket_path)
+        # Owner-only socket: anyone who can connect can run generations
+        umask = os.umask(0o177)
+        try:
+            self.server = socketserver.ThreadingUnixStreamServer(self.socket_path, _Handler)
+        finally:
+            os.umask(umask)
+        self.server.daemon_threads = True
+        self.server.model_daemon = self
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+
+class DaemonLLM:
+    # Client for a ModelDaemon with the generate/generate_batch/tokenize_count interface of LLMWrapper.
+    # One connection per client; a call on a connection the daemon dropped is resent once on a new one
+    thread_safe = True
+
+    def __init__(self, socket_path: Optional[str] = None, timeout: Optional[float] = None):
+        self.socket_path = socket_path or default_socket_path()
+        self.timeout = timeout
+        self.requests = 0
+        self.retried = 0
+        self.connections = 0
+        self._sock = None
+        self._f = None
+        self._lock = threading.Lock()
+        # Fails here when no daemon is up. The probe's connection is dropped and not counted, so the first
+        # backend call opens (and counts) the connection later calls reuse, also in pool workers that
+        # snapshot the counters after construction
+        self.info = self._call({"op": "info"})
+        self._disconnect()
+        self.connections = 0
+
+    def _connect(self) -> None:
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.settimeout(self.timeout)
+        s.connect(self.socket_path)
+        self.connections += 1
+        self._sock = s
+        self._f = s.makefile("rwb")
+
+    def _disconnect(self) -> None:
+        for x in (self._f, self._sock):
+            if x is not None:
+                try:
+                    x.close()
+                except OSError:
+                    pass
+        self._sock = None
+        self._f = None
+
+    def _call(self, req: Dict):
+        line = json.dumps(req).encode("utf-8") + b"\n"
+        with self._lock:
+            while True:
+                reused = self._f is not None
+                try:
+                    if not reused:
+                        self._connect()
+                    self._f.write(line)
+                    self._f.flush()
+                    resp = self._f.readline()
+                    if not resp:
+                        raise ConnectionResetError("Model daemon closed the connection")
+                    break
+                except OSError:
+                    self._disconnect()
+                    if not reused:
+                        raise
+                    self.retried += 1
+        out = json.loads(resp)
+        if not out["ok"]:
+            raise RuntimeError(f"Model daemon: {out['error']}")
+        return out["result"]
+
+    def generate(self, prompt: str, max_new_tokens: int, temperature: float, top_p: float, repeat_penalty: float, seed: int, stop: Optional[List[str]] = None, grammar: Optional[str] = None) -> str:
+        self.requests += 1
+        kw = dict(max_new_tokens=max_new_tokens, temperature=temperature, top_p=top_p, repeat_penalty=repeat_penalty, seed=int(seed), stop=stop, grammar=grammar)
+        return _decode(self._call({"op": "generate", "prompt": prompt, "kw": kw}))
+
+    def generate_batch(self, prompts: List[str], max_new_tokens: int, temperature: float, top_p: float, repeat_penalty: float, seeds: List[int], **kw) -> List[str]:
+        self.requests += 1
+        kw = dict(kw, max_new_tokens=max_new_tokens, temperature=temperature, top_p=top_p, repeat_penalty=repeat_penalty, seeds=[int(s) for s in seeds])
+        return [_decode(d) for d in self._call({"op": "generate_batch", "prompts": list(prompts), "kw": kw})]
+
+    def tokenize_count(self, text: str) -> int:
+        self.requests += 1
+        return self._call({"op": "tokenize_count", "text": text})
+
+    def server_stats(self) -> dict:
+        # Same keys as AsyncServerLLM's, reported by the runner as server_*
+        return {"requests": self.requests, "retries": self.retried, "connections": self.connections}
+
+    def close(self) -> None:
+        with self._lock:
+            self._disconnect()
+
+
+def daemon_info(socket_path: Optional[str] = None) -> Optional[Dict]:
+    # Info of the daemon listening at socket_path, or None when none is up
+    try:
+        llm = DaemonLLM(socket_path, timeout=5.0)
+    except (OSError, ValueError):
+        return None
+    llm.close()
+    return llm.info
+
+
+def main():
+    p = argparse.ArgumentParser(description="Keep a model loaded and serve it to runner.py --daemon over a Unix socket")
+    p.add_argument('--model-path')
+    p.add_argument('--mock', action='store_true', help='Serve MockLLM (for testing clients)')
+    p.add_argument('--socket', type=str, default=default_socket_path())
+    p.add_argument('--n-threads', type=int)
+    p.add_argument('--n-seq-max', type=int, default=1, help='Parallel sequences per llama.cpp batch decode; >1 samples with its own chain, which is not token-identical to sequential generate()')
+    p.add_argument('--prefix-cache-mb', type=int, default=0, help='RAM budget for cached prompt-prefix states (opt-in; costs a state save per generation)')
+    p.add_argument('--status', action='store_true', help='Print the running daemon\'s info and exit')
+    p.add_argument('--stop', action='store_true', help='Stop the running daemon and exit')
+    args = p.parse_args()
+    if args.status or args.stop:
+        info = daemon_info(args.socket)
+        if info is None:
+            raise SystemExit(f'No model daemon at {args.socket}')
+        if args.stop:
+            DaemonLLM(args.socket)._call({"op": "shutdown"})
+            print(f"stopped pid={info['pid']}")
+        else:
+            print(json.dumps(info, indent=2))
+        return
+    if not args.mock and not args.model_path:
+        raise SystemExit('Missing --model-path')
+    if daemon_info(args.socket) is not None:
+        raise SystemExit(f'A model daemon is already serving {args.socket}')
+    from llm import build_llm, close_llm
+    t0 = time.time()
+    llm = build_llm(args.mock, args.model_path, args.n_threads, args.n_seq_max, args.prefix_cache_mb << 20)
+    model_path = "mock" if args.mock else os.path.realpath(args.model_path)
+    info = {"model_path": model_path, "mock": bool(args.mock), "n_seq_max": args.n_seq_max, "load_sec": time.time() - t0}
+    daemon = ModelDaemon(llm, args.socket, info)
+    # SIGTERM unwinds serve_forever so the socket file is removed
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    print(f"model_daemon pid={os.getpid()} socket={args.socket} model={model_path} load_sec={info['load_sec']:.2f}", flush=True)
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        close_llm(llm)
+
+
+if __name__ == '__main__':
+    main()
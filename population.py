@@ -0,0 +1,94 @@
+from array import array
+from typing import Dict, List, Sequence
+from schema_enforce import schema_grammar
+
+
+class Lexicon:
+    # Name tables shared by every agent of a run: names by index, the uppercase valid set used by
+    # the decoders, and name -> index; the schema grammar is built once on first use
+    __slots__ = ("names", "valid", "index", "_grammar")
+
+    def __init__(self, names: Sequence[str]):
+        self.names = tuple(names)
+        self.valid = frozenset(x.upper() for x in self.names)
+        self.index = {x.upper(): k for k, x in enumerate(self.names)}
+        self._grammar = None
+
+    @classmethod
+    def numbered(cls, n: int) -> "Lexicon":
+        return cls([f"C{i+1}" for i in range(int(n))])
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @property
+    def grammar(self) -> str:
+        if self._grammar is None:
+            self._grammar = schema_grammar(self.names)
+        return self._grammar
+
+
+class PopulationState:
+    # Struct-of-arrays state of N agents over a lexicon of L names, as lexicon indices:
+    # preferred names z, partner-only memory as N ring buffers of K slots (-1 = empty), running
+    # per-agent name counts (N x L) and the current modal name (-1 = empty memory).
+    # A modal lookup is O(1); an update is O(1) unless it evicts the modal name, which rescans L counts.
+    # Lowest lexicon index wins ties, which for C1..Cn is the numeric order used so far.
+    # memory_k <= 0 keeps an unbounded memory, so only the counts are stored.
+    __slots__ = ("lex", "n", "k", "z", "mem", "ptr", "counts", "modal")
+
+    def __init__(self, lex: Lexicon, n: int, k: int, z: Sequence[int]):
+        self.lex = lex
+        self.n = int(n)
+        self.k = max(0, int(k))
+        self.z = array("i", z)
+        self.mem = array("i", [-1]) * (self.n * self.k)
+        self.ptr = array("i", [0]) * self.n
+        self.counts = array("i", [0]) * (self.n * len(lex))
+        self.modal = array("i", [-1]) * self.n
+
+    def name(self, i: int) -> str:
+        return self.lex.names[self.z[i]]
+
+    def hear(self, i: int, x: int) -> None:
+        # Agent i stores its partner's decoded name (lexicon index x)
+        L = len(self.lex)
+        counts = self.counts
+        row = i * L
+        old = -1
+        if self.k:
+            slot = i * self.k + self.ptr[i]
+            old = self.mem[slot]
+            self.mem[slot] = x
+            self.ptr[i] = (self.ptr[i] + 1) % self.k
+            if old >= 0:
+                counts[row + old] -= 1
+        counts[row + x] += 1
+        cur = self.modal[i]
+        if old >= 0 and old == cur and old != x:
+            # Evicting the modal name can demote it
+            seg = counts[row:row + L]
+            self.modal[i] = seg.index(max(seg))
+        elif cur < 0 or counts[row + x] > counts[row + cur] or (counts[row + x] == counts[row + cur] and x < cur):
+            self.modal[i] = x
+
+    def modal_or_z(self, i: int) -> int:
+        m = self.modal[i]
+        return m if m >= 0 else self.z[i]
+
+    def memory(self, i: int) -> List[int]:
+        # Agent i's memory, oldest first
+        if not self.k:
+            return []
+        buf = self.mem[i * self.k:(i + 1) * self.k].tolist()
+        p = self.ptr[i]
+        return [x for x in buf[p:] + buf[:p] if x >= 0]
+
+    def getstate(self) -> Dict:
+        return {"z": self.z.tobytes(), "mem": self.mem.tobytes(), "ptr": self.ptr.tobytes(), "counts": self.counts.tobytes(), "modal": self.modal.tobytes()}
+
+    def setstate(self, st: Dict) -> None:
+        for key in self.__slots__[3:]:
+            arr = array("i")
+            arr.frombytes(st[key])
+            setattr(self, key, arr)
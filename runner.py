@@ -1,10 +1,61 @@
 import argparse
+import functools
+import multiprocessing
 import os
 import time
 from datetime import datetime
+from typing import Optional
 from utils import ensure_dir
-from env import run_game
-from llm import LLMWrapper, MockLLM
+from env import run_game, summary_path, checkpoint_path, load_checkpoint
+from log_io import LOG_FORMATS, log_path
+from llm import build_llm, close_llm, llm_counters
+from sweep import build_jobs, write_manifest, run_sweep, run_halving, rank_jobs
+from hooks import build_hooks, PhaseTimer
+from model_daemon import daemon_info, default_socket_path
+
+
+def report_llm_stats(stats: dict) -> None:
+    if 'gen_cache_hits' in stats:
+        n = stats['gen_cache_hits'] + stats['gen_cache_misses']
+        rate = stats['gen_cache_hits'] / n if n else 0.0
+        print(f"gen_cache hits={stats['gen_cache_hits']} misses={stats['gen_cache_misses']} hit_rate={rate:.3f} tokenize_hits={stats['gen_cache_tok_hits']} tokenize_misses={stats['gen_cache_tok_misses']}")
+    # Each line only once its cache has been consulted; with the RAM cache off and no batching it stays at 0
+    if stats.get('prefix_cache_hits') or stats.get('prefix_cache_misses'):
+        print(f"prefix_cache hits={stats['prefix_cache_hits']} misses={stats['prefix_cache_misses']} saved_prefill_tokens={stats['prefix_cache_saved_prefill_tokens']}")
+    if stats.get('prefix_cache_context_hits') or stats.get('prefix_cache_context_misses'):
+        print(f"context_reuse hits={stats['prefix_cache_context_hits']} misses={stats['prefix_cache_context_misses']} saved_prefill_tokens={stats['prefix_cache_context_saved_tokens']}")
+    if 'server_requests' in stats:
+        print(f"server requests={stats['server_requests']} retries={stats['server_retries']} connections={stats['server_connections']}")
+
+
+def batching_note(args, seq_max: Optional[int]) -> Optional[str]:
+    # A local llama.cpp model decodes per-round batches one prompt at a time unless it runs parallel sequences
+    if seq_max is None or args.no_batch or seq_max > 1:
+        return None
+    note = "batching=off: llama.cpp decodes each round's prompts one at a time (n_seq_max=1); --n-seq-max N decodes them in parallel"
+    if args.ablation and args.sweep_multiplex:
+        note += "; --sweep-multiplex merges the jobs' prompts but they are still decoded one at a time"
+    return note
+
+
+def run_numpy_engine(args) -> None:
+    from vec_env import simulate, ConfusionResponse
+    cfg = {
+        'population': args.population_size,
+        'rounds': args.rounds,
+        'seeds': args.seeds,
+        'condition': args.condition,
+        'n_lexicon': args.n_lexicon,
+        'memory_k': args.memory_k,
+        'base_seed': args.base_seed,
+        'lose_shift_alpha': args.lose_shift_alpha,
+    }
+    ts = datetime.now().strftime('%Y%m%d_%H%M%S')
+    out_path = os.path.join('data', f"logs_numpy_{args.condition}_N{args.population_size}_R{args.rounds}_S{args.seeds}_{ts}.jsonl")
+    t0 = time.time()
+    simulate(cfg, ConfusionResponse.noisy(args.n_lexicon, args.p_correct, args.p_undecodable), out_path=out_path)
+    print(out_path)
+    print(f"elapsed_sec={time.time() - t0:.2f}")
 
 
 def main():
@@ -25,6 +76,31 @@ def main():
     p.add_argument('--lose-shift-alpha', type=float, default=0.75)
     p.add_argument('--quiet', action='store_true')
     p.add_argument('--mock', action='store_true')
+    p.add_argument('--surrogate', type=str, help='Use a SurrogateLLM fitted from these logs (file/dir) or a saved .json table')
+    p.add_argument('--no-batch', action='store_true', help='Generate proposals one at a time instead of per-round batches (a local model only decodes batches in parallel with --n-seq-max > 1)')
+    p.add_argument('--no-io-thread', action='store_true', help='Serialize and write log records (and wandb metrics) on the generation thread')
+    p.add_argument('--constrained', action='store_true', help='schema: grammar-constrained decoding of @say {name: Ck} | rationale')
+    p.add_argument('--stop-newline', action='store_true', help='Stop generation at the first newline')
+    p.add_argument('--n-seq-max', type=int, default=1, help='Parallel sequences per llama.cpp batch decode; >1 samples with its own chain, which is not token-identical to sequential generate()')
+    p.add_argument('--prefix-cache-mb', type=int, default=0, help='RAM budget for cached prompt-prefix states (opt-in; costs a state save per generation)')
+    p.add_argument('--server', type=str, help='Generate through a llama.cpp server (OpenAI-compatible), e.g. http://127.0.0.1:8080')
+    p.add_argument('--server-concurrency', type=int, default=8, help='Max requests in flight to --server; match its --parallel slots')
+    p.add_argument('--server-timeout', type=float, default=120.0, help='Seconds per --server request before it is retried')
+    p.add_argument('--server-retries', type=int, default=2)
+    p.add_argument('--daemon', type=str, nargs='?', const=default_socket_path(), help='Use the model held by model_daemon.py at this socket when it is up (default socket if no path is given)')
+    p.add_argument('--gen-cache', type=str, help='SQLite file caching generations across runs (opt-in)')
+    p.add_argument('--gen-cache-mb', type=int, default=2048)
+    p.add_argument('--workers', type=int, default=1, help='Run seeds in N processes, each with its own mmap-shared model')
+    p.add_argument('--early-stop-threshold', type=float, help='End a seed once population agreement stays >= this for --early-stop-window rounds')
+    p.add_argument('--early-stop-window', type=int, default=20)
+    p.add_argument('--checkpoint-every', type=int, default=0, help='Checkpoint the simulation state every N rounds (jsonl logs; 0 disables)')
+    p.add_argument('--resume', type=str, help='Continue an interrupted run from LOG.ckpt (config is taken from the checkpoint)')
+    p.add_argument('--log-format', choices=LOG_FORMATS, default='jsonl', help="'jsonl.gz'/'jsonl.zst' compress and intern raw texts (zstd needs pyarrow); 'parquet' writes pair/aggregate tables with one row group per round (needs pyarrow)")
+    p.add_argument('--log-text-frac', type=float, default=1.0, help='Keep raw i_txt/j_txt for only this sampled fraction of pair records')
+    p.add_argument('--profile-phases', action='store_true', help='Time each round phase (pairing, generate, parse, write, update, log) into phase_*_ms aggregate fields')
+    p.add_argument('--profile-rounds', type=str, help='Comma-separated rounds to capture with cProfile, e.g. 0,50')
+    p.add_argument('--profile-memory', action='store_true', help='With --profile-rounds, also record tracemalloc allocation sites')
+    p.add_argument('--profile-dir', type=str, default=os.path.join('data', 'profile'))
     p.add_argument('--wandb', action='store_true')
     p.add_argument('--wandb-project', type=str, default='sign-naming-game')
     p.add_argument('--wandb-offline', action='store_true')
@@ -32,17 +108,52 @@ def main():
     p.add_argument('--ablation-populations', type=str, help='Comma-separated list, e.g., 12,24')
     p.add_argument('--ablation-memory', type=str, help='Comma-separated list, e.g., 5,10')
     p.add_argument('--ablation-alpha', type=str, help='Comma-separated list, e.g., 0.5,0.75,0.9')
+    p.add_argument('--sweep-jobs', type=int, default=1, help='Ablation jobs to run concurrently on the shared model')
+    p.add_argument('--halving', action='store_true', help='Ablation by successive halving: all configs run --halving-min-rounds rounds, only the best 1/eta per condition continue')
+    p.add_argument('--halving-min-rounds', type=int, default=50)
+    p.add_argument('--halving-eta', type=float, default=2.0, help='Budget growth and pruning factor between rungs')
+    p.add_argument('--sweep-multiplex', action='store_true', help='With --sweep-jobs > 1, merge the concurrent jobs\' prompts into shared decode batches')
+    p.add_argument('--engine', choices=['llm', 'numpy'], default='llm', help="'numpy' runs the vectorized population engine (aggregates only)")
+    p.add_argument('--p-correct', type=float, default=1.0, help='numpy engine: P(decoded name == proposed name)')
+    p.add_argument('--p-undecodable', type=float, default=0.0, help='numpy engine: P(output has no decodable name)')
     args = p.parse_args()
+    if args.engine == 'numpy' and args.ablation:
+        p.error('--engine numpy runs single configs only; it cannot be combined with --ablation')
+    if args.resume:
+        ckpt = load_checkpoint(checkpoint_path(args.resume))
+        if ckpt is None:
+            raise SystemExit(f'No checkpoint found for {args.resume}')
+        args.condition = ckpt['cfg']['condition']
     if not args.ablation and not args.condition:
         raise SystemExit('Missing --condition (required unless --ablation is provided)')
     ensure_dir('data')
     ensure_dir('figs')
-    if args.mock:
-        llm = MockLLM()
-    else:
-        if not args.model_path:
-            raise SystemExit('Missing --model-path')
-        llm = LLMWrapper(model_path=args.model_path)
+    if args.engine == 'numpy':
+        run_numpy_engine(args)
+        return
+    daemon = None
+    # Parallel sequences of the llama.cpp model doing the decoding; None for other backends
+    seq_max = None if args.mock or args.surrogate or args.server else args.n_seq_max
+    if args.daemon and not args.mock and not args.surrogate and not args.server:
+        info = daemon_info(args.daemon)
+        if info is None:
+            print(f'No model daemon at {args.daemon}; loading the model in-process')
+        elif args.model_path and os.path.realpath(args.model_path) != info['model_path']:
+            raise SystemExit(f"Model daemon at {args.daemon} serves {info['model_path']}, not {args.model_path}")
+        else:
+            daemon = args.daemon
+            args.model_path = args.model_path or info['model_path']
+            seq_max = None if info['mock'] else info['n_seq_max']
+    if not args.mock and not args.surrogate and not args.server and not args.model_path:
+        raise SystemExit('Missing --model-path')
+    # Worker processes split the cores; the parent only loads the model when it runs seeds itself
+    n_threads = max(1, multiprocessing.cpu_count() // args.workers) if args.workers > 1 else None
+    llm_factory = functools.partial(build_llm, args.mock, args.model_path, n_threads, args.n_seq_max, args.prefix_cache_mb << 20, args.gen_cache, args.gen_cache_mb, args.surrogate, args.server, args.server_concurrency, args.server_timeout, args.server_retries, daemon)
+    llm = llm_factory() if args.workers <= 1 else None
+    stats = {}
+    note = batching_note(args, seq_max)
+    if note:
+        print(note)
 
     ts = datetime.now().strftime('%Y%m%d_%H%M%S')
 
@@ -52,97 +163,71 @@ def main():
         mem_list = [int(x) for x in (args.ablation_memory.split(',') if args.ablation_memory else ['5','10'])]
         alpha_list = [float(x) for x in (args.ablation_alpha.split(',') if args.ablation_alpha else ['0.5','0.75','0.9'])]
         conditions = ['nl_sw', 'schema']
-        rounds = 300
-        seeds = 3
-        total_runs = 0
-        # Count runs for reporting
-        total_runs += len(pop_list) * len(alpha_list)  # nl (no memory)
-        total_runs += len(pop_list) * len(mem_list) * len(alpha_list)  # nl_sw
-        total_runs += len(pop_list) * len(mem_list) * len(alpha_list)  # schema
-        print(f"Ablation mode: total runs={total_runs}")
-        for cond in conditions:
-            for N in pop_list:
-                if cond == 'nl':
-                    for alpha in alpha_list:
-                        cfg = {
-                            'population': N,
-                            'rounds': rounds,
-                            'seeds': seeds,
-                            'condition': cond,
-                            'n_lexicon': args.n_lexicon,
-                            'memory_k': args.memory_k,  # unused in 'nl'
-                            'payload_limit': args.payload_limit,
-                            'max_new_tokens': args.max_new_tokens,
-                            'temperature': args.temperature,
-                            'top_p': args.top_p,
-                            'repeat_penalty': args.repeat_penalty,
-                            'base_seed': args.base_seed,
-                            'lose_shift_alpha': alpha,
-                            'quiet': args.quiet,
-                        }
-                        out_name = f"logs_ablate_{cond}_N{N}_R{rounds}_S{seeds}_alpha{alpha}_{ts}.jsonl"
-                        out_path = os.path.join('data', out_name)
-                        run = None
-                        if args.wandb:
-                            try:
-                                if args.wandb_offline:
-                                    os.environ['WANDB_MODE'] = 'offline'
-                                import wandb
-                                run_name = f"abl_{cond}_N{N}_R{rounds}_S{seeds}_alpha{alpha}_{ts}"
-                                run = wandb.init(project=args.wandb_project, name=run_name, config=cfg, reinit=True)
-                            except Exception:
-                                run = None
-                        t0 = time.time()
-                        path = run_game(cfg, llm, out_path, wandb_run=run)
-                        dt = time.time() - t0
-                        print(path)
-                        print(f"elapsed_sec={dt:.2f}")
-                        if run is not None:
-                            try:
-                                run.finish()
-                            except Exception:
-                                pass
-                else:
-                    for K in mem_list:
-                        for alpha in alpha_list:
-                            cfg = {
-                                'population': N,
-                                'rounds': rounds,
-                                'seeds': seeds,
-                                'condition': cond,
-                                'n_lexicon': args.n_lexicon,
-                                'memory_k': K,
-                                'payload_limit': args.payload_limit,
-                                'max_new_tokens': args.max_new_tokens,
-                                'temperature': args.temperature,
-                                'top_p': args.top_p,
-                                'repeat_penalty': args.repeat_penalty,
-                                'base_seed': args.base_seed,
-                                'lose_shift_alpha': alpha,
-                                'quiet': args.quiet,
-                            }
-                            out_name = f"logs_ablate_{cond}_N{N}_R{rounds}_S{seeds}_K{K}_alpha{alpha}_{ts}.jsonl"
-                            out_path = os.path.join('data', out_name)
-                            run = None
-                            if args.wandb:
-                                try:
-                                    if args.wandb_offline:
-                                        os.environ['WANDB_MODE'] = 'offline'
-                                    import wandb
-                                    run_name = f"abl_{cond}_N{N}_R{rounds}_S{seeds}_K{K}_alpha{alpha}_{ts}"
-                                    run = wandb.init(project=args.wandb_project, name=run_name, config=cfg, reinit=True)
-                                except Exception:
-                                    run = None
-                            t0 = time.time()
-                            path = run_game(cfg, llm, out_path, wandb_run=run)
-                            dt = time.time() - t0
-                            print(path)
-                            print(f"elapsed_sec={dt:.2f}")
-                            if run is not None:
-                                try:
-                                    run.finish()
-                                except Exception:
-                                    pass
+        base_cfg = {
+            'rounds': 300,
+            'seeds': 3,
+            'n_lexicon': args.n_lexicon,
+            'memory_k': args.memory_k,
+            'payload_limit': args.payload_limit,
+            'max_new_tokens': args.max_new_tokens,
+            'temperature': args.temperature,
+            'top_p': args.top_p,
+            'repeat_penalty': args.repeat_penalty,
+            'base_seed': args.base_seed,
+            'quiet': args.quiet,
+            'batch_generate': not args.no_batch,
+            'io_thread': not args.no_io_thread,
+            'constrained': args.constrained,
+            'stop_newline': args.stop_newline,
+            'workers': args.workers,
+            'log_format': args.log_format,
+            'checkpoint_every': args.checkpoint_every,
+        }
+        if args.log_text_frac < 1.0:
+            base_cfg['log_text_frac'] = args.log_text_frac
+        if args.early_stop_threshold is not None:
+            base_cfg.update(early_stop_threshold=args.early_stop_threshold, early_stop_window=args.early_stop_window)
+        # Job ids are config hashes, so rerunning the same grid skips finished jobs
+        jobs = build_jobs(base_cfg, conditions, pop_list, mem_list, alpha_list, out_dir='data')
+        manifest = write_manifest(jobs, out_dir='data')
+        print(f"Ablation mode: total runs={len(jobs)} manifest={manifest}")
+
+        def wandb_init(job):
+            if not args.wandb:
+                return None
+            try:
+                if args.wandb_offline:
+                    os.environ['WANDB_MODE'] = 'offline'
+                import wandb
+                return wandb.init(project=args.wandb_project, name=f"abl_{job['tag']}_{job['id']}", config=job['cfg'], reinit=True)
+            except Exception:
+                return None
+
+        sched = {}
+        if args.halving:
+            report = run_halving(jobs, llm, min_rounds=args.halving_min_rounds, eta=args.halving_eta, n_jobs=args.sweep_jobs, llm_factory=llm_factory, stats=stats, wandb_init=wandb_init, multiplex=args.sweep_multiplex, scheduler_stats=sched, out_dir='data')
+            for e in report['jobs']:
+                if e['status'] == 'pruned':
+                    sc = e['scores'][-1]
+                    print(f"pruned {e['tag']} at round {e['pruned_at']}: reached_target={sc['reached_target']:.2f} recent_agreement={sc['recent_agreement']:.3f}")
+            print(f"halving budgets={report['budgets']} seed_rounds={report['seed_rounds_run']}/{report['seed_rounds_full']} report={report['path']}")
+            failed = [e for e in report['jobs'] if e['status'] == 'failed']
+        else:
+            results = run_sweep(jobs, llm, n_jobs=args.sweep_jobs, llm_factory=llm_factory, stats=stats, wandb_init=wandb_init, multiplex=args.sweep_multiplex, scheduler_stats=sched)
+            failed = [r for r in results if r['status'] != 'done']
+        if sched:
+            print(f"multiplex batches={sched['batches']} mean_batch={sched['mean_batch']:.1f} merged_batches={sched['merged_batches']} busy={sched['busy_frac']:.0%}")
+        if failed:
+            print(f"failed_jobs={len(failed)}")
+        for k, job in enumerate(rank_jobs(jobs)[:5]):
+            sm = job['summary']
+            print(f"rank {k + 1}: {job['tag']} rounds_to_target_mean={sm['rounds_to_target_mean']} reached_target={sm['reached_target']:.2f} final_entropy_mean={sm['final_entropy_mean']:.3f}")
+        if llm is not None:
+            stats.update(llm_counters(llm))
+            close_llm(llm)
+        report_llm_stats(stats)
+        if note:
+            print(note)
         return
 
     # Single-run mode
@@ -161,9 +246,25 @@ def main():
         'base_seed': args.base_seed,
         'lose_shift_alpha': args.lose_shift_alpha,
         'quiet': args.quiet,
+        'batch_generate': not args.no_batch,
+        'io_thread': not args.no_io_thread,
+        'constrained': args.constrained,
+        'stop_newline': args.stop_newline,
+        'workers': args.workers,
+        'log_format': args.log_format,
+        'checkpoint_every': args.checkpoint_every,
     }
-    out_name = f"logs_{args.condition}_N{args.population_size}_R{args.rounds}_S{args.seeds}_{ts}.jsonl"
-    out_path = os.path.join('data', out_name)
+    # Only present when enabled, so configs (and sweep job ids) of full-length runs are unchanged
+    if args.log_text_frac < 1.0:
+        cfg['log_text_frac'] = args.log_text_frac
+    if args.early_stop_threshold is not None:
+        cfg.update(early_stop_threshold=args.early_stop_threshold, early_stop_window=args.early_stop_window)
+    out_name = f"logs_{args.condition}_N{args.population_size}_R{args.rounds}_S{args.seeds}_{ts}"
+    out_path = log_path(os.path.join('data', out_name), args.log_format)
+    if args.resume:
+        # Runtime-only settings come from this invocation, everything else from the checkpoint
+        cfg = dict(ckpt['cfg'], quiet=args.quiet, workers=args.workers, batch_generate=not args.no_batch, io_thread=not args.no_io_thread, checkpoint_every=args.checkpoint_every or ckpt['cfg'].get('checkpoint_every', 0))
+        out_path = args.resume
     run = None
     if args.wandb:
         try:
@@ -174,16 +275,31 @@ def main():
             run = wandb.init(project=args.wandb_project, name=run_name, config=cfg, reinit=True)
         except Exception:
             run = None
+    profile_rounds = [int(x) for x in args.profile_rounds.split(',')] if args.profile_rounds else None
+    hooks = build_hooks(args.profile_phases, profile_rounds, args.profile_dir, args.profile_memory)
     t0 = time.time()
-    path = run_game(cfg, llm, out_path, wandb_run=run)
+    path = run_game(cfg, llm, out_path, wandb_run=run, llm_factory=llm_factory, stats=stats, resume=bool(args.resume), hooks=hooks)
     dt = time.time() - t0
     print(path)
     print(f"elapsed_sec={dt:.2f}")
+    print(f"summary={summary_path(path)}")
+    for h in hooks:
+        # Pool workers time their own copies; the per-round fields are in the log either way
+        if isinstance(h, PhaseTimer) and h.rounds:
+            print('phases ' + ' '.join(f"{k}={v['ms']:.0f}ms({v['frac']:.0%})" for k, v in h.report().items() if v['frac'] is not None))
+    if profile_rounds:
+        print(f"profiles={args.profile_dir}")
     if run is not None:
         try:
             run.finish()
         except Exception:
             pass
+    if llm is not None:
+        stats.update(llm_counters(llm))
+        close_llm(llm)
+    report_llm_stats(stats)
+    if note:
+        print(note)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,206 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Dict, List, Optional
+
+
+class _Request:
+    # One generate_batch call of a client; its prompts may be spread over several decode batches
+    __slots__ = ("client", "prompts", "seeds", "key", "next", "results", "left", "future")
+
+    def __init__(self, client, prompts: List[str], seeds: List[int], key: tuple):
+        self.client = client
+        self.prompts = prompts
+        self.seeds = seeds
+        self.key = key
+        self.next = 0
+        self.results = [None] * len(prompts)
+        self.left = len(prompts)
+        self.future = Future()
+
+
+class GenerationScheduler:
+    # Shares one backend between concurrent run_game instances: clients submit their round's prompts,
+    # and a scheduler thread merges whatever is pending across clients into shared generate_batch calls.
+    # Only requests with identical decoding options (tokens, sampling, stop, grammar) share a batch.
+    # Fair queuing: batches are filled round-robin, one prompt per waiting client per turn, and the
+    # client leading the rotation (whose decoding options the batch uses) advances every batch.
+    # Every prompt keeps its own seed, so a run's outputs do not depend on which runs it was batched with
+    # (for llama.cpp, up to the floating-point effects batch composition already has within a run).
+    # max_batch (default 256 prompts) is the merge width, not the decode width: LLMWrapper splits a batch
+    # into groups of n_seq_max parallel sequences, so merging wider than that still fills every group.
+    # linger_ms holds a batch that is not full for requests of clients still busy with their round
+    def __init__(self, llm, max_batch: Optional[int] = None, linger_ms: float = 0.0):
+        self.llm = llm
+        self.max_batch = max(1, int(max_batch or 256))
+        self.linger = max(0.0, float(linger_ms)) / 1000.0
+        self.clients = []
+        self.queues = {}
+        self._rr = 0
+        self._cond = threading.Condition()
+        self._llm_lock = threading.Lock()
+        self._closed = False
+        self._thread = None
+        self.batches = 0
+        self.prompts = 0
+        self.merged = 0
+        self.busy = 0.0
+        self.started = time.perf_counter()
+
+    def client(self, name: Optional[str] = None) -> "SchedulerClient":
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("GenerationScheduler is closed")
+            c = SchedulerClient(self, name if name is not None else f"client{len(self.clients)}")
+            self.clients.append(c)
+            self.queues[c] = deque()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="GenerationScheduler", daemon=True)
+                self._thread.start()
+        return c
+
+    def _release(self, c: "SchedulerClient") -> None:
+        with self._cond:
+            if c in self.queues:
+                for req in self.queues.pop(c):
+                    req.future.set_exception(RuntimeError(f"Scheduler client {c.name} closed with requests pending"))
+                self.clients.remove(c)
+                self._cond.notify_all()
+
+    def submit(self, c: "SchedulerClient", prompts: List[str], max_new_tokens: int, temperature: float, top_p: float, repeat_penalty: float, seeds: List[int], stop: Optional[List[str]] = None, grammar: Optional[str] = None) -> Future:
+        key = (int(max_new_tokens), float(temperature), float(top_p), float(repeat_penalty), tuple(stop) if stop else None, grammar)
+        req = _Request(c, list(prompts), list(seeds), key)
+        if not req.prompts:
+            req.future.set_result([])
+            return req.future
+        with self._cond:
+            if c not in self.queues:
+                raise RuntimeError(f"Scheduler client {c.name} is closed")
+            self.queues[c].append(req)
+            self._cond.notify_all()
+        return req.future
+
+    def tokenize_count(self, text: str) -> int:
+        with self._llm_lock:
+            return self.llm.tokenize_count(text)
+
+    def _pending(self) -> int:
+        return sum(len(r.prompts) - r.next for q in self.queues.values() for r in q)
+
+    def _take(self) -> tuple:
+        # Round-robin fill of one batch: (key, [(request, prompt index)])
+        order = self.clients[self._rr % len(self.clients):] + self.clients[:self._rr % len(self.clients)]
+        self._rr += 1
+        key = next(self.queues[c][0].key for c in order if self.queues[c])
+        items = []
+        while len(items) < self.max_batch:
+            took = False
+            for c in order:
+                q = self.queues[c]
+                # A client's requests are served in order, so only its head request is eligible
+                if not q or q[0].key != key:
+                    continue
+                req = q[0]
+                items.append((req, req.next))
+                req.next += 1
+                if req.next == len(req.prompts):
+                    q.popleft()
+                took = True
+                if len(items) == self.max_batch:
+                    break
+            if not took:
+                break
+        return key, items
+
+    def _loop(self) -> None:
+        while True:
+            with self._cond:
+                while not self._closed and not any(self.queues.values()):
+                    self._cond.wait()
+                if self._closed and not any(self.queues.values()):
+                    return
+                if self.linger > 0:
+                    deadline = time.perf_counter() + self.linger
+                    while self._pending() < self.max_batch and not all(self.queues.values()) and not self._closed:
+                        left = deadline - time.perf_counter()
+                        if left <= 0:
+                            break
+                        self._cond.wait(left)
+                key, items = self._take()
+            max_new_tokens, temperature, top_p, repeat_penalty, stop, grammar = key
+            # Decoding constraints are only passed when set, as run_game does
+            kw = {}
+            if grammar is not None:
+                kw["grammar"] = grammar
+            if stop:
+                kw["stop"] = list(stop)
+            t0 = time.perf_counter()
+            try:
+                with self._llm_lock:
+                    out = self.llm.generate_batch([r.prompts[k] for r, k in items], max_new_tokens, temperature, top_p, repeat_penalty,
+                                                  seeds=[r.seeds[k] for r, k in items], **kw)
+            except BaseException as e:
+                # Every request in the failed batch fails as a whole, including prompts not yet scheduled
+                failed = {id(r): r for r, _ in items}
+                with self._cond:
+                    for r in failed.values():
+                        q = self.queues.get(r.client)
+                        if q and q[0] is r:
+                            q.popleft()
+                for r in failed.values():
+                    if not r.future.done():
+                        r.future.set_exception(e)
+                continue
+            finally:
+                self.busy += time.perf_counter() - t0
+            self.batches += 1
+            self.prompts += len(items)
+            if len({id(r.client) for r, _ in items}) > 1:
+                self.merged += 1
+            for (r, k), g in zip(items, out):
+                if r.future.done():
+                    continue
+                r.results[k] = g
+                r.left -= 1
+                if r.left == 0:
+                    r.future.set_result(r.results)
+
+    def stats(self) -> Dict:
+        wall = time.perf_counter() - self.started
+        return {"batches": self.batches, "prompts": self.prompts, "mean_batch": self.prompts / self.batches if self.batches else 0.0,
+                "merged_batches": self.merged, "busy_frac": self.busy / wall if wall > 0 else 0.0}
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+
+
+class SchedulerClient:
+    # A run's handle on a GenerationScheduler, used as its llm: generate/generate_batch block until the
+    # scheduler has decoded all of the call's prompts; agenerate_batch awaits them from a coroutine
+    def __init__(self, scheduler: GenerationScheduler, name: str):
+        self.scheduler = scheduler
+        self.name = name
+
+    def __getattr__(self, name):
+        return getattr(self.scheduler.llm, name)
+
+    def tokenize_count(self, text: str) -> int:
+        return self.scheduler.tokenize_count(text)
+
+    def generate(self, prompt: str, max_new_tokens: int, temperature: float, top_p: float, repeat_penalty: float, seed: int, **kw) -> str:
+        return self.generate_batch([prompt], max_new_tokens, temperature, top_p, repeat_penalty, seeds=[seed], **kw)[0]
+
+    def generate_batch(self, prompts: List[str], max_new_tokens: int, temperature: float, top_p: float, repeat_penalty: float, seeds: List[int], **kw) -> List[str]:
+        return self.scheduler.submit(self, prompts, max_new_tokens, temperature, top_p, repeat_penalty, seeds, **kw).result()
+
+    async def agenerate_batch(self, prompts: List[str], max_new_tokens: int, temperature: float, top_p: float, repeat_penalty: float, seeds: List[int], **kw) -> List[str]:
+        return await asyncio.wrap_future(self.scheduler.submit(self, prompts, max_new_tokens, temperature, top_p, repeat_penalty, seeds, **kw))
+
+    def close(self) -> None:
+        self.scheduler._release(self)
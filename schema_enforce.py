@@ -22,3 +22,33 @@ def extract_nl_name(text: str, valid: set) -> Optional[str]:
         return None
     token = matches[0].upper()
     return token if token in valid else None
+
+
+def schema_grammar(lexicon: list) -> str:
+    # GBNF for '@say {name: Ck} | rationale' restricted to the lexicon, single line
+    names = " | ".join('"%s"' % x.upper() for x in lexicon)
+    return "\n".join([
+        'root ::= "@say {name: " name "} | " rationale',
+        f"name ::= {names}",
+        "rationale ::= [^\\n]*",
+    ])
+
+
+def grammar_names(grammar: str) -> list:
+    # Names allowed by a schema_grammar string
+    for line in grammar.splitlines():
+        if line.startswith("name ::="):
+            return re.findall(r'"(C\d+)"', line)
+    return []
+
+
+def apply_stop(text: str, stop) -> str:
+    # Truncate at the earliest stop sequence, as llama.cpp does
+    if not stop:
+        return text
+    cut = len(text)
+    for s in stop:
+        k = text.find(s)
+        if k != -1:
+            cut = min(cut, k)
+    return text[:cut]
@@ -0,0 +1,388 @@
+import argparse
+import asyncio
+import json
+import math
+import ssl
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from llm import Generation
+
+RETRY_STATUS = (408, 429, 500, 502, 503, 504)
+
+
+class HTTPError(RuntimeError):
+    def __init__(self, status: int, body: str):
+        super().__init__(f"HTTP {status}: {body[:200]}")
+        self.status = status
+
+
+class _ConnectionPool:
+    # HTTP/1.1 keep-alive connections to one server, reused across requests; at most `limit` requests
+    # are in flight. Bound to the event loop that first uses it
+    def __init__(self, url: str, limit: int):
+        u = urlsplit(url)
+        self.host = u.hostname or "127.0.0.1"
+        self.port = u.port or (443 if u.scheme == "https" else 80)
+        self.ssl = ssl.create_default_context() if u.scheme == "https" else None
+        self.prefix = u.path.rstrip("/")
+        self.limit = max(1, int(limit))
+        self._sem = None
+        self._idle = []
+        self.opened = 0
+
+    async def _open(self) -> tuple:
+        self.opened += 1
+        return await asyncio.open_connection(self.host, self.port, ssl=self.ssl)
+
+    async def _roundtrip(self, conn: tuple, method: str, path: str, payload: bytes) -> Tuple[int, Dict, bytes]:
+        reader, writer = conn
+        head = (f"{method} {self.prefix}{path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\n"
+                f"Content-Type: application/json\r\nContent-Length: {len(payload)}\r\nConnection: keep-alive\r\n\r\n")
+        writer.write(head.encode("latin-1") + payload)
+        await writer.drain()
+        line = await reader.readline()
+        if not line:
+            raise ConnectionResetError("Server closed the connection")
+        status = int(line.split()[1])
+        headers = {}
+        while True:
+            h = await reader.readline()
+            if h in (b"\r\n", b"\n", b""):
+                break
+            k, _, v = h.decode("latin-1").partition(":")
+            headers[k.strip().lower()] = v.strip()
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            parts = []
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                        pass
+                    break
+                parts.append(await reader.readexactly(size))
+                await reader.readline()
+            body = b"".join(parts)
+        elif "content-length" in headers:
+            body = await reader.readexactly(int(headers["content-length"]))
+        else:
+            body = await reader.read()
+            headers["connection"] = "close"
+        return status, headers, body
+
+    async def request(self, method: str, path: str, body: Optional[Dict], timeout: float) -> Tuple[int, bytes]:
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.limit)
+        payload = json.dumps(body).encode("utf-8") if body is not None else b""
+        async with self._sem:
+            # An idle connection may have been closed by the server; that case retries once on a fresh one
+            reused = bool(self._idle)
+            conn = self._idle.pop() if reused else await self._open()
+            try:
+                status, headers, data = await asyncio.wait_for(self._roundtrip(conn, method, path, payload), timeout)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                conn[1].close()
+                if not reused:
+                    raise
+                conn = await self._open()
+                try:
+                    status, headers, data = await asyncio.wait_for(self._roundtrip(conn, method, path, payload), timeout)
+                except BaseException:
+                    conn[1].close()
+                    raise
+            except BaseException:
+                conn[1].close()
+                raise
+            if headers.get("connection", "").lower() == "close":
+                conn[1].close()
+            else:
+                self._idle.append(conn)
+        return status, data
+
+    def close(self) -> None:
+        for _, writer in self._idle:
+            writer.close()
+        self._idle.clear()
+
+
+class AsyncServerLLM:
+    # Client for a llama.cpp server (or any OpenAI-compatible /v1/completions endpoint) with the
+    # generate/generate_batch/tokenize_count interface of LLMWrapper. Requests run on a private event
+    # loop thread; generate_batch sends all prompts at once, bounded by `concurrency` (match the
+    # server's --parallel slots). Failed requests (connection errors, timeouts, 408/429/5xx) are
+    # retried with exponential backoff
+    thread_safe = True
+
+    def __init__(self, url: str, concurrency: int = 8, timeout: float = 120.0, retries: int = 2, backoff: float = 0.5, model: Optional[str] = None):
+        self.url = url.rstrip("/")
+        self.concurrency = max(1, int(concurrency))
+        self.timeout = float(timeout)
+        self.retries = max(0, int(retries))
+        self.backoff = float(backoff)
+        self.model = model
+        self.pool = _ConnectionPool(self.url, self.concurrency)
+        self.requests = 0
+        self.retried = 0
+        self._tokenize = True
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _run(self, coro):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, name="AsyncServerLLM", daemon=True)
+                self._thread.start()
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    async def _post(self, path: str, body: Dict) -> Dict:
+        last = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self.retried += 1
+                await asyncio.sleep(self.backoff * 2 ** (attempt - 1))
+            self.requests += 1
+            try:
+                status, data = await self.pool.request("POST", path, body, self.timeout)
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+                last = e
+                continue
+            if status == 200:
+                return json.loads(data)
+            last = HTTPError(status, data.decode("utf-8", errors="replace"))
+            if status not in RETRY_STATUS:
+                raise last
+        raise RuntimeError(f"Request to {self.url}{path} failed after {self.retries + 1} attempts: {last!r}")
+
+    async def agenerate(self, prompt: str, max_new_tokens: int, temperature: float, top_p: float, repeat_penalty: float, seed: int, stop: Optional[List[str]] = None, grammar: Optional[str] = None) -> Generation:
+        body = {"prompt": prompt, "max_tokens": int(max_new_tokens), "temperature": float(temperature), "top_p": float(top_p),
+                "repeat_penalty": float(repeat_penalty), "seed": int(seed) & 0xFFFFFFFF, "cache_prompt": True}
+        if self.model is not None:
+            body["model"] = self.model
+        if stop:
+            body["stop"] = list(stop)
+        if grammar is not None:
+            body["grammar"] = grammar
+        t0 = time.perf_counter()
+        out = await self._post("/v1/completions", body)
+        wall = (time.perf_counter() - t0) * 1000.0
+        usage = out.get("usage") or {}
+        timings = out.get("timings") or {}
+        # Without server timings the whole request is attributed to decode, as in LLMWrapper
+        p_ms, d_ms = (timings["prompt_ms"], timings["predicted_ms"]) if "predicted_ms" in timings else (None, wall)
+        return Generation(out["choices"][0]["text"].strip(), usage.get("prompt_tokens"), usage.get("completion_tokens"), p_ms, d_ms)
+
+    async def agenerate_batch(self, prompts: List[str], max_new_tokens: int, temperature: float, top_p: float, repeat_penalty: float, seeds: List[int], **kw) -> List[Generation]:
+        return list(await asyncio.gather(*[self.agenerate(p, max_new_tokens, temperature, top_p, repeat_penalty, seed=s, **kw) for p, s in zip(prompts, seeds)]))
+
+    async def atokenize_count(self, text: str) -> int:
+        # llama.cpp's /tokenize; servers without it fall back to the MockLLM whitespace estimate
+        if self._tokenize:
+            try:
+                return len((await self._post("/tokenize", {"content": text}))["tokens"])
+            except HTTPError as e:
+                if e.status != 404:
+                    raise
+                self._tokenize = False
+        return int(math.ceil(len(text.strip().split()) * 1.5))
+
+    def generate(self, prompt: str, max_new_tokens: int, temperature: float, top_p: float, repeat_penalty: float, seed: int, stop: Optional[List[str]] = None, grammar: Optional[str] = None) -> str:
+        return self._run(self.agenerate(prompt, max_new_tokens, temperature, top_p, repeat_penalty, seed, stop=stop, grammar=grammar))
+
+    def generate_batch(self, prompts: List[str], max_new_tokens: int, temperature: float, top_p: float, repeat_penalty: float, seeds: List[int], **kw) -> List[str]:
+        return self._run(self.agenerate_batch(prompts, max_new_tokens, temperature, top_p, repeat_penalty, seeds, **kw))
+
+    def tokenize_count(self, text: str) -> int:
+        return self._run(self.atokenize_count(text))
+
+    def server_stats(self) -> dict:
+        return {"requests": self.requests, "retries": self.retried, "connections": self.pool.opened}
+
+    def close(self) -> None:
+        if self._loop is not None:
+            async def _close():
+                self.pool.close()
+            self._run(_close())
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
+            self._loop = None
+
+
+class StubServer:
+    # Minimal llama.cpp-style server for exercising AsyncServerLLM without a model: /v1/completions
+    # answers with a name derived from the seed, /tokenize counts whitespace tokens. Faults on demand:
+    # the first `fail_first` completions get `fail_status`, every response can be delayed by `delay`
+    # seconds, tokenize=False answers /tokenize with 404, and drop_idle closes each keep-alive
+    # connection after its response without announcing it
+    def __init__(self, port: int = 0, fail_first: int = 0, fail_status: int = 503, delay: float = 0.0, tokenize: bool = True, drop_idle: bool = False):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        stub = self
+        self.fail_left = int(fail_first)
+        self.fail_status = int(fail_status)
+        self.delay = float(delay)
+        self.tokenize = tokenize
+        self.drop_idle = drop_idle
+        self.hits = {}
+        self.lock = threading.Lock()
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *a):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                status, out = stub.answer(self.path, body)
+                data = json.dumps(out).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+                if stub.drop_idle:
+                    self.close_connection = True
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", int(port)), Handler)
+        self.server.daemon_threads = True
+        # Clients that time out hang up before the delayed response is written
+        self.server.handle_error = lambda *a: None
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self._thread = None
+
+    def answer(self, path: str, body: Dict) -> Tuple[int, Dict]:
+        with self.lock:
+            self.hits[path] = self.hits.get(path, 0) + 1
+            fail = path == "/v1/completions" and self.fail_left > 0
+            if fail:
+                self.fail_left -= 1
+        if self.delay:
+            time.sleep(self.delay)
+        if path == "/tokenize":
+            if not self.tokenize:
+                return 404, {"error": "not found"}
+            return 200, {"tokens": list(range(len(body["content"].split())))}
+        if path != "/v1/completions":
+            return 404, {"error": "not found"}
+        if fail:
+            return self.fail_status, {"error": "busy"}
+        text = " @say {name: C%d} | stub" % (int(body["seed"]) % 12 + 1)
+        return 200, {"choices": [{"text": text}], "usage": {"prompt_tokens": len(body["prompt"].split()), "completion_tokens": 5},
+                     "timings": {"prompt_ms": 1.0, "predicted_ms": 2.0}}
+
+    def start(self) -> "StubServer":
+        self._thread = threading.Thread(target=self.server.serve_forever, name="StubServer", daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def self_test() -> List[str]:
+    # Runs AsyncServerLLM against StubServer fault cases; returns the failures
+    failures = []
+
+    def case(name, server_kw, client_kw, fn):
+        stub = StubServer(**server_kw).start()
+        llm = AsyncServerLLM(stub.url, **dict(dict(timeout=5.0, backoff=0.01), **client_kw))
+        try:
+            fn(stub, llm)
+            print(f"{name}: ok")
+        except Exception as e:
+            failures.append(name)
+            print(f"{name}: FAILED {e!r}")
+        finally:
+            llm.close()
+            stub.close()
+
+    def check(cond, msg):
+        if not cond:
+            raise AssertionError(msg)
+
+    def batch(stub, llm):
+        out = llm.generate_batch([f"prompt {k}" for k in range(20)], 32, 0.7, 0.9, 1.1, seeds=list(range(20)))
+        check([str(g) for g in out] == ["@say {name: C%d} | stub" % (k % 12 + 1) for k in range(20)], "results out of order")
+        check(out[0].completion_tokens == 5 and out[0].decode_ms == 2.0, "usage/timings not carried over")
+        check(llm.server_stats()["connections"] <= llm.concurrency, "more connections than the concurrency limit")
+
+    def retry_503(stub, llm):
+        check(str(llm.generate("p", 32, 0.7, 0.9, 1.1, seed=3)) == "@say {name: C4} | stub", "wrong text after retries")
+        check(llm.retried == 2 and llm.requests == 3, f"retried={llm.retried} requests={llm.requests}")
+
+    def retries_exhausted(stub, llm):
+        try:
+            llm.generate("p", 32, 0.7, 0.9, 1.1, seed=3)
+        except RuntimeError as e:
+            check("after 2 attempts" in str(e), str(e))
+            return
+        raise AssertionError("no error after the retries ran out")
+
+    def no_retry_400(stub, llm):
+        try:
+            llm.generate("p", 32, 0.7, 0.9, 1.1, seed=3)
+        except HTTPError as e:
+            check(e.status == 400 and llm.requests == 1, f"status={e.status} requests={llm.requests}")
+            return
+        raise AssertionError("400 was not raised")
+
+    def timeout(stub, llm):
+        try:
+            llm.generate("p", 32, 0.7, 0.9, 1.1, seed=3)
+        except RuntimeError as e:
+            check("TimeoutError" in str(e) and llm.requests == 2, f"{e} requests={llm.requests}")
+            return
+        raise AssertionError("timeout was not raised")
+
+    def tokenize(stub, llm):
+        check(llm.tokenize_count("a b c d") == 4, "wrong /tokenize count")
+
+    def tokenize_fallback(stub, llm):
+        check(llm.tokenize_count("a b c d") == 6, "wrong fallback estimate")
+        llm.tokenize_count("a b")
+        check(stub.hits.get("/tokenize") == 1, "/tokenize was asked again after a 404")
+
+    def reconnect(stub, llm):
+        for k in range(5):
+            llm.generate("p", 32, 0.7, 0.9, 1.1, seed=k)
+        check(llm.retried == 0 and llm.server_stats()["connections"] >= 5, f"retried={llm.retried} stats={llm.server_stats()}")
+
+    case("batch", {}, dict(concurrency=4), batch)
+    case("retry_503", dict(fail_first=2), dict(retries=2), retry_503)
+    case("retries_exhausted", dict(fail_first=5), dict(retries=1), retries_exhausted)
+    case("no_retry_400", dict(fail_first=5, fail_status=400), dict(retries=3), no_retry_400)
+    case("timeout", dict(delay=0.5), dict(timeout=0.1, retries=1), timeout)
+    case("tokenize", {}, {}, tokenize)
+    case("tokenize_fallback", dict(tokenize=False), {}, tokenize_fallback)
+    case("reconnect_dropped_idle", dict(drop_idle=True), {}, reconnect)
+    return failures
+
+
+def main():
+    p = argparse.ArgumentParser(description="AsyncServerLLM checks against a local stub server")
+    p.add_argument('--self-test', action='store_true', help='Run the client against the stub\'s fault cases (503 retries, timeouts, /tokenize fallback, dropped connections)')
+    p.add_argument('--serve-stub', type=int, metavar='PORT', help='Serve the stub on PORT, e.g. for runner.py --server http://127.0.0.1:PORT')
+    args = p.parse_args()
+    if args.serve_stub is not None:
+        stub = StubServer(args.serve_stub)
+        print(f"stub server at {stub.url}", flush=True)
+        try:
+            stub.server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        return
+    if not args.self_test:
+        p.error('Nothing to do: pass --self-test or --serve-stub PORT')
+    failures = self_test()
+    if failures:
+        raise SystemExit(f"{len(failures)} case(s) failed: {', '.join(failures)}")
+    print("all cases passed")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+import json
+import math
+import random
+import re
+from collections import Counter
+from typing import Dict, List, Optional
+import pandas as pd
+from agents import REMIND
+from schema_enforce import apply_stop, grammar_names
+from metrics import load_logs, is_agg
+
+PROPOSED_PAT = re.compile(r"Your current proposed name is (C\d+)\.")
+# Emitted texts are one of these bodies followed by one 'ok' per sampled completion token
+SURROGATE_TEXT = re.compile(r"^(?:@say \{name: C\d+\} \||I choose C\d+|No clear choice)((?: ok)*)$")
+
+# Outcome kinds: 'ok' = compliant/decoded name, 'salvaged' = schema name recovered from free text,
+# 'none' = undecodable. 'same' in the tables below means "decoded name == proposed name".
+
+
+def prompt_family(condition: str, mode: str = "free") -> str:
+    # nl and nl_sw send identical prompts, so the model's response statistics are shared;
+    # grammar-constrained schema outputs are a different distribution and get their own table
+    if str(condition).lower() != "schema":
+        return "nl"
+    return "schema_grammar" if "grammar" in str(mode) else "schema"
+
+
+def _outcomes(df: pd.DataFrame) -> pd.DataFrame:
+    rows = []
+    for side in ("i", "j"):
+        cols = {f"{side}_name": "name", f"{side}_tokens": "tokens", "condition": "condition"}
+        if f"{side}_compliant" in df.columns:
+            cols[f"{side}_compliant"] = "compliant"
+        if f"{side}_proposed" in df.columns:
+            cols[f"{side}_proposed"] = "proposed"
+        rows.append(df[list(cols)].rename(columns=cols))
+    out = pd.concat(rows, ignore_index=True)
+    for c in ("compliant", "proposed"):
+        if c not in out.columns:
+            out[c] = None
+    modes = pd.concat([df["decode_mode"]] * 2, ignore_index=True) if "decode_mode" in df.columns else pd.Series("free", index=out.index)
+    out["family"] = [prompt_family(c, m) for c, m in zip(out["condition"], modes.fillna("free"))]
+    return out
+
+
+def fit_tables(df: pd.DataFrame, min_count: int = 20) -> Dict:
+    pdf = df[~is_agg(df)]
+    if pdf.empty:
+        raise ValueError("No pair records to fit a surrogate from")
+    obs = _outcomes(pdf)
+    tables = {}
+    for fam, g in obs.groupby("family"):
+        named = g["name"].notna()
+        kind = pd.Series("none", index=g.index)
+        kind[named] = "ok"
+        if fam.startswith("schema"):
+            kind[named & (g["compliant"] != True)] = "salvaged"
+        has_prop = g["proposed"].notna()
+        same = named & has_prop & (g["name"] == g["proposed"])
+        # Pooled outcome distribution: (kind, 'same' | name | None) -> probability
+        def dist(sub_kind, sub_same, sub_name):
+            c = Counter()
+            for k, s, n in zip(sub_kind, sub_same, sub_name):
+                c[(k, "same" if s else (n if k != "none" else None))] += 1
+            tot = sum(c.values())
+            return [[k, t, v / tot] for (k, t), v in sorted(c.items(), key=lambda x: str(x[0]))]
+        by_proposed = {}
+        if has_prop.any():
+            for prop, gp in g[has_prop].groupby("proposed"):
+                if len(gp) >= min_count:
+                    by_proposed[prop] = dist(kind[gp.index], same[gp.index], gp["name"])
+        tables[fam] = {
+            "pooled": dist(kind, same, g["name"]),
+            "by_proposed": by_proposed,
+            "has_proposed": bool(has_prop.any()),
+            "tokens": {k: [int(x) for x in g.loc[kind == k, "tokens"].dropna()] for k in ("ok", "salvaged", "none")},
+            "n": int(len(g)),
+            "compliance_rate": float((g["compliant"] == True).mean()) if fam.startswith("schema") else 1.0,
+            "undecodable_rate": float((kind == "none").mean()),
+        }
+    return tables
+
+
+class SurrogateLLM:
+    # Replays fitted per-family response statistics through the normal generate/tokenize_count
+    # interface: it emits short texts that parse_schema/extract_nl_name decode to the sampled outcome
+    def __init__(self, tables: Dict):
+        self.tables = tables
+
+    @classmethod
+    def fit(cls, path: str, min_count: int = 20) -> "SurrogateLLM":
+        cols = ["aggregate", "condition", "decode_mode"] + [f"{s}_{c}" for s in "ij" for c in ("name", "tokens", "compliant", "proposed")]
+        return cls(fit_tables(load_logs(path, columns=cols), min_count=min_count))
+
+    @classmethod
+    def load(cls, path: str) -> "SurrogateLLM":
+        # Accepts a saved table (.json) or a log file/directory to fit from
+        if path.endswith(".json"):
+            with open(path, "r", encoding="utf-8") as f:
+                return cls(json.load(f))
+        return cls.fit(path)
+
+    def save(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.tables, f, indent=1)
+
+    def _table(self, fam: str) -> Dict:
+        # Another family's statistics would silently stand in for a condition the logs never ran
+        if fam not in self.tables:
+            raise ValueError(f"Surrogate has no {fam!r} statistics (fitted: {', '.join(sorted(self.tables))}); fit it from logs that include that condition")
+        return self.tables[fam]
+
+    def _sample(self, fam: str, proposed: str, rng: random.Random) -> tuple:
+        t = self._table(fam)
+        dist = t["by_proposed"].get(proposed, t["pooled"])
+        u = rng.random()
+        acc = 0.0
+        kind, target = dist[-1][0], dist[-1][1]
+        for k, tg, p in dist:
+            acc += p
+            if u < acc:
+                kind, target = k, tg
+                break
+        name = proposed if target == "same" else target
+        toks = t["tokens"].get(kind) or [0]
+        return kind, name, rng.choice(toks)
+
+    def _text(self, body: str, tokens: int) -> str:
+        return body + " ok" * tokens
+
+    def tokenize_count(self, text: str) -> int:
+        # Surrogate texts carry their sampled token count as filler; anything else is estimated like MockLLM
+        m = SURROGATE_TEXT.match(text)
+        if m:
+            return len(m.group(1)) // 3
+        return int(math.ceil(len(text.strip().split()) * 1.5))
+
+    def generate(self, prompt: str, max_new_tokens: int, temperature: float, top_p: float, repeat_penalty: float, seed: int, stop: Optional[List[str]] = None, grammar: Optional[str] = None) -> str:
+        if prompt.endswith("\n" + REMIND):
+            # The outcome was fixed on the first attempt; decode_retry salvages any name from that text
+            return "Sorry."
+        fam = "schema_grammar" if grammar is not None else "schema" if "@say" in prompt else "nl"
+        m = PROPOSED_PAT.search(prompt)
+        proposed = m.group(1) if m else "C1"
+        kind, name, tokens = self._sample(fam, proposed, random.Random(int(seed)))
+        if grammar is not None:
+            # Constrained decoding always yields a compliant lexicon name; undecodable draws keep the proposal
+            allowed = grammar_names(grammar)
+            name = name if name in allowed else (proposed if proposed in allowed else allowed[0])
+            return apply_stop(self._text(f"@say {{name: {name}}} |", tokens), stop)
+        if kind == "ok" and fam == "schema":
+            return apply_stop(self._text(f"@say {{name: {name}}} |", tokens), stop)
+        if kind in ("ok", "salvaged") and name:
+            return apply_stop(self._text(f"I choose {name}", tokens), stop)
+        return apply_stop(self._text("No clear choice", tokens), stop)
+
+    def generate_batch(self, prompts: List[str], max_new_tokens: int, temperature: float, top_p: float, repeat_penalty: float, seeds: List[int], stop: Optional[List[str]] = None, grammar: Optional[str] = None) -> List[str]:
+        return [self.generate(p, max_new_tokens, temperature, top_p, repeat_penalty, seed=s, stop=stop, grammar=grammar) for p, s in zip(prompts, seeds)]
@@ -0,0 +1,310 @@
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+from utils import ensure_dir
+from env import run_game, summary_path, checkpoint_path
+from log_io import log_path, remove_log
+from scheduler import GenerationScheduler
+
+# Settings that do not change a run's log contents
+HASH_EXCLUDE = ("quiet", "workers", "batch_generate", "log_format", "target", "checkpoint_every", "io_thread", "round_budget")
+
+
+def config_hash(cfg: Dict) -> str:
+    key = {k: v for k, v in cfg.items() if k not in HASH_EXCLUDE}
+    return hashlib.sha1(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+
+
+def build_jobs(base_cfg: Dict, conditions: List[str], pop_list: List[int], mem_list: List[int], alpha_list: List[float], out_dir: str = "data") -> List[Dict]:
+    jobs = []
+    for cond in conditions:
+        for N in pop_list:
+            # 'nl' has no memory axis
+            for K in ([base_cfg["memory_k"]] if cond == "nl" else mem_list):
+                for alpha in alpha_list:
+                    cfg = dict(base_cfg, population=N, condition=cond, memory_k=K, lose_shift_alpha=alpha)
+                    h = config_hash(cfg)
+                    tag = f"{cond}_N{N}_R{cfg['rounds']}_S{cfg['seeds']}" + ("" if cond == "nl" else f"_K{K}") + f"_alpha{alpha}"
+                    stem = os.path.join(out_dir, f"logs_ablate_{tag}_{h}")
+                    jobs.append({"id": h, "tag": tag, "cfg": cfg, "path": log_path(stem, cfg.get("log_format", "jsonl"))})
+    return jobs
+
+
+def write_manifest(jobs: List[Dict], out_dir: str = "data") -> str:
+    ensure_dir(out_dir)
+    grid = hashlib.sha1(",".join(j["id"] for j in jobs).encode("utf-8")).hexdigest()[:12]
+    path = os.path.join(out_dir, f"sweep_{grid}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump([{k: j[k] for k in ("id", "tag", "path", "cfg")} for j in jobs], f, indent=1)
+    return path
+
+
+def _status_path(job: Dict) -> str:
+    return job["path"] + ".status.json"
+
+
+def job_status(job: Dict) -> Optional[Dict]:
+    try:
+        with open(_status_path(job), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def is_complete(job: Dict) -> bool:
+    # Logs are renamed into place only after run_game returns, so existence means complete
+    st = job_status(job)
+    return os.path.exists(job["path"]) and st is not None and st.get("status") == "done"
+
+
+def _write_status(job: Dict, **fields) -> None:
+    st = {"id": job["id"], "tag": job["tag"], "path": job["path"]}
+    st.update(fields)
+    tmp = _status_path(job) + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(st, f)
+    os.replace(tmp, _status_path(job))
+
+
+class SerializedLLM:
+    # One loaded model shared by concurrent jobs; a llama.cpp context is not thread-safe
+    def __init__(self, llm):
+        self.llm = llm
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.llm, name)
+
+    def tokenize_count(self, text: str) -> int:
+        with self._lock:
+            return self.llm.tokenize_count(text)
+
+    def generate(self, prompt: str, max_new_tokens: int, temperature: float, top_p: float, repeat_penalty: float, seed: int, **kw) -> str:
+        with self._lock:
+            return self.llm.generate(prompt, max_new_tokens, temperature, top_p, repeat_penalty, seed=seed, **kw)
+
+    def generate_batch(self, prompts: List[str], max_new_tokens: int, temperature: float, top_p: float, repeat_penalty: float, seeds: List[int], **kw) -> List[str]:
+        with self._lock:
+            return self.llm.generate_batch(prompts, max_new_tokens, temperature, top_p, repeat_penalty, seeds=seeds, **kw)
+
+
+def run_job(job: Dict, llm, llm_factory=None, stats: Optional[Dict] = None, wandb_init: Optional[Callable] = None, budget: Optional[int] = None) -> Dict:
+    # budget: run (or continue) the job only up to that round; it stays 'paused' until a budget covers its rounds
+    t0 = time.time()
+    _write_status(job, status="running", started=t0)
+    tmp = job["path"] + ".tmp"
+    run = wandb_init(job) if wandb_init is not None else None
+    try:
+        # A job interrupted mid-run (or paused at a smaller budget) continues from its last checkpoint
+        resume = os.path.exists(checkpoint_path(tmp))
+        cfg = dict(job["cfg"], round_budget=int(budget)) if budget is not None else job["cfg"]
+        run_game(cfg, llm, tmp, wandb_run=run, llm_factory=llm_factory, stats=stats, resume=resume)
+        if not os.path.exists(tmp):
+            st = {"status": "paused", "budget": int(budget), "started": t0, "finished": time.time(), "elapsed_sec": time.time() - t0}
+            _write_status(job, **st)
+            return dict(job, **st)
+        # A columnar log is a directory, which os.replace cannot move onto a non-empty one
+        if os.path.isdir(job["path"]):
+            remove_log(job["path"])
+        os.replace(tmp, job["path"])
+        os.replace(summary_path(tmp), summary_path(job["path"]))
+    except Exception as e:
+        st = {"status": "failed", "started": t0, "finished": time.time(), "elapsed_sec": time.time() - t0, "error": repr(e)}
+        _write_status(job, **st)
+        return dict(job, **st)
+    finally:
+        if run is not None:
+            try:
+                run.finish()
+            except Exception:
+                pass
+    st = {"status": "done", "started": t0, "finished": time.time(), "elapsed_sec": time.time() - t0}
+    _write_status(job, **st)
+    return dict(job, **st)
+
+
+def job_summary(job: Dict) -> Optional[Dict]:
+    # The final summary, else the interim one of a paused job
+    for path in (summary_path(job["path"]), summary_path(job["path"] + ".tmp")):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            continue
+    return None
+
+
+def rank_jobs(jobs: List[Dict], target: Optional[float] = None) -> List[Dict]:
+    # Completed jobs ordered by mean rounds-to-target (jobs that never reach it last, by final agreement),
+    # straight from the run summaries; a different target is re-evaluated on the stored curves
+    ranked = []
+    for job in jobs:
+        sm = job_summary(job) if is_complete(job) else None
+        if sm is None:
+            continue
+        if target is not None and float(target) != sm["target"]:
+            rtt = [next((r for r, a in enumerate(x["agreement"]) if a >= target), None) for x in sm["seeds"]]
+            hit = [x for x in rtt if x is not None]
+            sm = dict(sm, target=float(target), rounds_to_target_mean=sum(hit) / len(hit) if hit else None, reached_target=len(hit) / max(1, len(rtt)))
+        ranked.append(dict(job, summary={k: v for k, v in sm.items() if k != "seeds"}))
+    def key(j):
+        s = j["summary"]
+        return (-s["reached_target"], s["rounds_to_target_mean"] if s["rounds_to_target_mean"] is not None else float("inf"), -(s["final_agreement_mean"] or 0.0))
+    return sorted(ranked, key=key)
+
+
+def run_sweep(jobs: List[Dict], llm, n_jobs: int = 1, llm_factory=None, stats: Optional[Dict] = None, wandb_init: Optional[Callable] = None, quiet: bool = False, multiplex: bool = False, scheduler_stats: Optional[Dict] = None, budget: Optional[int] = None) -> List[Dict]:
+    # multiplex: concurrent jobs submit to one GenerationScheduler, which merges their prompts into shared
+    # decode batches, instead of taking turns on the model; scheduler_stats receives its counters.
+    # budget: run each job only up to that round (see run_job)
+    pending = [j for j in jobs if not is_complete(j)]
+    if not quiet:
+        print(f"Sweep: {len(jobs)} jobs, {len(jobs) - len(pending)} already complete, {len(pending)} to run")
+    results = []
+    lock = threading.Lock()
+    # Backends that queue requests themselves (a server client) are shared without the lock
+    scheduler = None
+    if multiplex and n_jobs > 1 and llm is not None:
+        scheduler = GenerationScheduler(llm)
+        shared = None
+    else:
+        shared = SerializedLLM(llm) if (n_jobs > 1 and llm is not None and not getattr(llm, "thread_safe", False)) else llm
+
+    def _one(job):
+        job_llm = scheduler.client(job["tag"]) if scheduler is not None else shared
+        try:
+            res = run_job(job, job_llm, llm_factory=llm_factory, stats=stats, wandb_init=wandb_init, budget=budget)
+        finally:
+            if scheduler is not None:
+                job_llm.close()
+        with lock:
+            results.append(res)
+            if not quiet:
+                if res["status"] == "paused":
+                    print(f"paused {res['tag']} at round {res['budget']}")
+                else:
+                    print(res["path"] if res["status"] == "done" else f"FAILED {res['tag']}: {res.get('error')}")
+                print(f"elapsed_sec={res['elapsed_sec']:.2f}")
+        return res
+
+    if n_jobs <= 1:
+        for job in pending:
+            _one(job)
+    else:
+        try:
+            with ThreadPoolExecutor(max_workers=n_jobs) as ex:
+                list(ex.map(_one, pending))
+        finally:
+            if scheduler is not None:
+                scheduler.close()
+                if scheduler_stats is not None:
+                    scheduler_stats.update(scheduler.stats())
+    return results
+
+
+def halving_budgets(rounds: int, min_rounds: int, eta: float) -> List[int]:
+    # Round budgets of the rungs: min_rounds, growing by eta, ending at the full run
+    budgets = []
+    b = max(1, int(min_rounds))
+    while b < rounds:
+        budgets.append(b)
+        b = max(b + 1, int(math.ceil(b * eta)))
+    return budgets + [int(rounds)]
+
+
+def interim_score(summary: Dict, budget: int, window: int = 10) -> Dict:
+    # A job's standing after its first `budget` rounds, from the per-seed agreement curves of its
+    # (interim or final) summary: share of seeds at the target, their mean rounds-to-target, and the
+    # mean agreement over the last `window` rounds
+    target = summary["target"]
+    rtt, recent = [], []
+    for x in summary["seeds"]:
+        a = x["agreement"][:budget]
+        if not a:
+            continue
+        rtt.append(next((r for r, v in enumerate(a) if v >= target), None))
+        recent.append(sum(a[-window:]) / len(a[-window:]))
+    hit = [r for r in rtt if r is not None]
+    return {
+        "budget": int(budget),
+        "reached_target": len(hit) / max(1, len(rtt)),
+        "rounds_to_target_mean": sum(hit) / len(hit) if hit else None,
+        "recent_agreement": sum(recent) / len(recent) if recent else 0.0,
+    }
+
+
+def _score_key(sc: Dict) -> tuple:
+    # Same order as rank_jobs, with recent agreement in place of final agreement
+    return (-sc["reached_target"], sc["rounds_to_target_mean"] if sc["rounds_to_target_mean"] is not None else float("inf"), -sc["recent_agreement"])
+
+
+def run_halving(jobs: List[Dict], llm, min_rounds: int = 50, eta: float = 2.0, group_by: Optional[str] = "condition", n_jobs: int = 1, llm_factory=None, stats: Optional[Dict] = None, wandb_init: Optional[Callable] = None, quiet: bool = False, multiplex: bool = False, scheduler_stats: Optional[Dict] = None, out_dir: str = "data") -> Dict:
+    # Successive halving: every job first runs min_rounds rounds; after each rung only the best 1/eta of
+    # each group (cfg[group_by], so conditions are not pruned against each other) by interim_score go on
+    # to an eta times larger budget, until the survivors have run all rounds. Promoted jobs continue from
+    # their checkpoints, and their final logs equal those of an uninterrupted run; pruned jobs stay paused
+    # and can be continued by a later sweep. The report goes to <out_dir>/halving_<grid>.json
+    if eta <= 1:
+        raise ValueError("eta must be > 1")
+    rounds = max(int(j["cfg"]["rounds"]) for j in jobs)
+    budgets = halving_budgets(rounds, min_rounds, eta)
+    entries = {j["id"]: {"id": j["id"], "tag": j["tag"], "path": j["path"], "status": "running", "pruned_at": None, "scores": []} for j in jobs}
+    alive = list(jobs)
+    for k, b in enumerate(budgets):
+        if not alive:
+            break
+        if not quiet:
+            print(f"Halving rung {k}: {len(alive)} jobs to round {b}")
+        # wandb runs are only opened where logs are written, i.e. for the full budget
+        results = run_sweep(alive, llm, n_jobs=n_jobs, llm_factory=llm_factory, stats=stats, wandb_init=wandb_init if b >= rounds else None,
+                            quiet=quiet, multiplex=multiplex, scheduler_stats=scheduler_stats, budget=b)
+        failed = {r["id"]: r.get("error") for r in results if r["status"] == "failed"}
+        groups = {}
+        for job in alive:
+            e = entries[job["id"]]
+            sm = job_summary(job) if job["id"] not in failed else None
+            if sm is None:
+                e.update(status="failed", error=failed.get(job["id"]))
+                continue
+            sc = interim_score(sm, b)
+            e["scores"].append(sc)
+            groups.setdefault(job["cfg"].get(group_by) if group_by else None, []).append((job, sc))
+        if b >= rounds:
+            for members in groups.values():
+                for job, _ in members:
+                    entries[job["id"]]["status"] = "complete" if is_complete(job) else "failed"
+            break
+        keep = set()
+        for members in groups.values():
+            members.sort(key=lambda x: _score_key(x[1]))
+            n_keep = max(1, int(math.ceil(len(members) / eta)))
+            keep.update(job["id"] for job, _ in members[:n_keep])
+            for job, _ in members[n_keep:]:
+                # A job whose seeds all stopped early is already complete
+                if is_complete(job):
+                    entries[job["id"]]["status"] = "complete"
+                    continue
+                entries[job["id"]].update(status="pruned", pruned_at=b)
+                _write_status(job, status="pruned", budget=b)
+        alive = [j for j in alive if j["id"] in keep]
+    # Seed-rounds actually run against running every job in full
+    run_rounds = full_rounds = 0
+    for job in jobs:
+        e = entries[job["id"]]
+        R, S = int(job["cfg"]["rounds"]), int(job["cfg"]["seeds"])
+        e["rounds_run"] = min(R, e["scores"][-1]["budget"]) if e["scores"] else 0
+        run_rounds += e["rounds_run"] * S
+        full_rounds += R * S
+    report = {"budgets": budgets, "eta": float(eta), "min_rounds": int(min_rounds), "group_by": group_by,
+              "seed_rounds_run": run_rounds, "seed_rounds_full": full_rounds, "jobs": [entries[j["id"]] for j in jobs]}
+    ensure_dir(out_dir)
+    grid = hashlib.sha1(",".join(j["id"] for j in jobs).encode("utf-8")).hexdigest()[:12]
+    report["path"] = os.path.join(out_dir, f"halving_{grid}.json")
+    with open(report["path"], "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=1)
+    return report
@@ -1,12 +1,15 @@
 import os
 import random
 import string
-import numpy as np
+import sys
 
 
 def set_seeds(seed: int) -> None:
     random.seed(seed)
-    np.random.seed(seed)
+    # numpy's global generator only matters to code that has imported numpy; the LLM game never
+    # draws from it, so this does not import numpy just to seed it
+    if "numpy" in sys.modules:
+        sys.modules["numpy"].random.seed(seed)
 
 
 def ensure_dir(path: str) -> None:
@@ -14,6 +17,7 @@ def ensure_dir(path: str) -> None:
 
 
 def gen_nonce_codes(n: int, seed: int) -> list:
+    import numpy as np
     rng = np.random.RandomState(seed)
     consonants = list("bcdfghjklmnpqrstvwxyz")
     vowels = list("aeiou")
@@ -24,17 +28,3 @@ def gen_nonce_codes(n: int, seed: int) -> list:
         c2 = rng.choice(consonants)
         out.add((c1 + v + c2).upper())
     return list(out)
-
-
-class Memory:
-    def __init__(self, k: int):
-        self.k = int(k)
-        self.buf = []
-
-    def add(self, item):
-        self.buf.append(item)
-        if len(self.buf) > self.k:
-            self.buf = self.buf[-self.k :]
-
-    def list(self) -> list:
-        return list(self.buf)
@@ -0,0 +1,183 @@
+import json
+from typing import Dict, Optional
+import numpy as np
+from utils import ensure_dir
+
+
+class ConfusionResponse:
+    # Vectorized stand-in for Agent.propose: row z of probs gives P(decoded name | proposed name z),
+    # with the last column for undecodable outputs; tokens are drawn from an empirical sample
+    def __init__(self, probs: np.ndarray, token_sample: Optional[np.ndarray] = None):
+        probs = np.asarray(probs, dtype=float)
+        self.probs = probs / probs.sum(axis=1, keepdims=True)
+        self.n_lex, self.n_out = self.probs.shape
+        # Walker alias tables: one uniform column draw plus one coin per sample, no per-row CDF scan
+        self.accept = np.ones(self.probs.shape)
+        self.alias = np.tile(np.arange(self.n_out), (self.n_lex, 1))
+        for z in range(self.n_lex):
+            q = self.probs[z] * self.n_out
+            small = [j for j in range(self.n_out) if q[j] < 1.0]
+            large = [j for j in range(self.n_out) if q[j] >= 1.0]
+            while small and large:
+                s, l = small.pop(), large.pop()
+                self.accept[z, s] = q[s]
+                self.alias[z, s] = l
+                q[l] -= 1.0 - q[s]
+                (small if q[l] < 1.0 else large).append(l)
+        self.accept = self.accept.ravel()
+        self.alias = self.alias.ravel()
+        self.token_sample = None if token_sample is None or len(token_sample) == 0 else np.asarray(token_sample, dtype=np.int64)
+
+    @classmethod
+    def noisy(cls, n_lex: int, p_correct: float = 1.0, p_undecodable: float = 0.0, token_sample: Optional[np.ndarray] = None) -> "ConfusionResponse":
+        probs = np.zeros((n_lex, n_lex + 1))
+        p_other = (1.0 - p_correct - p_undecodable) / max(1, n_lex - 1)
+        probs[:, :n_lex] = p_other
+        probs[np.arange(n_lex), np.arange(n_lex)] = p_correct
+        probs[:, n_lex] = p_undecodable
+        return cls(probs, token_sample)
+
+    def draw(self, z: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+        # Output column per proposing agent, n_lex for undecodable. One uniform per sample: its integer
+        # part picks the alias column, its fraction is the coin
+        u = rng.random(len(z)) * self.n_out
+        j = u.astype(np.int64)
+        flat = z * self.n_out + j
+        return np.where(u - j < self.accept[flat], j, self.alias[flat])
+
+    def decode(self, z: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+        # Decoded index or -1 per proposing agent
+        decoded = self.draw(z, rng)
+        return np.where(decoded < self.n_lex, decoded, -1)
+
+    def token_total(self, n: int, rng: np.random.Generator) -> int:
+        # Tokens of n proposals: how often each sampled count is drawn, not n separate draws
+        if self.token_sample is None:
+            return 0
+        m = len(self.token_sample)
+        return int(rng.multinomial(n, np.full(m, 1.0 / m)) @ self.token_sample)
+
+    def respond(self, z: np.ndarray, rng: np.random.Generator):
+        # Returns (decoded index or -1, tokens) per proposing agent
+        decoded = self.decode(z, rng)
+        if self.token_sample is None:
+            tokens = np.zeros(len(z), dtype=np.int64)
+        else:
+            tokens = self.token_sample[rng.integers(0, len(self.token_sample), len(z))]
+        return decoded, tokens
+
+
+def simulate_seed(cfg: Dict, s: int, response: ConfusionResponse) -> Dict[str, np.ndarray]:
+    N = int(cfg["population"])
+    R = int(cfg["rounds"])
+    L = int(cfg["n_lexicon"])
+    # memory_k <= 0 keeps an unbounded memory (as PopulationState does): counts only, nothing is evicted
+    K = max(0, int(cfg["memory_k"]))
+    alpha = float(cfg.get("lose_shift_alpha", 0.75))
+    base_seed = int(cfg["base_seed"])
+    seed_int = int(base_seed) ^ (s * 2654435761) ^ (N * 97531) ^ (R * 131071)
+    rng = np.random.default_rng(seed_int & 0xFFFFFFFF)
+
+    z = rng.integers(0, L, N)
+    # Partner-only memory as ring buffers plus running per-name counts and the current modal name,
+    # kept up to date incrementally (lowest index wins ties, as in env.run_game)
+    W = L + 1
+    mem = np.full(N * K, L, dtype=np.int64)
+    ptr = np.zeros(N, dtype=np.int64)
+    counts = np.zeros(N * W, dtype=np.int32)
+    modal = np.full(N, -1, dtype=np.int64)
+    n_pairs = N // 2
+    agree = np.zeros(R)
+    success_n = np.zeros(R, dtype=np.int64)
+    tokens_n = np.zeros(R, dtype=np.int64)
+    final_counts = np.zeros(L, dtype=np.int64)
+    # Name L stands for nothing heard (undecodable, or sat out): empty ring slots hold it and its count
+    # column soaks up evictions from them and updates by agents that heard nothing, so no update is masked
+    heard = np.empty(N, dtype=np.int64)
+    won = np.empty(N, dtype=bool)
+    row = np.arange(N, dtype=np.int64) * W
+    ring = np.arange(N, dtype=np.int64) * K
+    for r in range(R):
+        order = rng.permutation(N)
+        perm = order[: 2 * n_pairs]
+        dec = response.draw(z[perm], rng)
+        tokens_n[r] = response.token_total(len(perm), rng)
+        da, db = dec[0::2], dec[1::2]
+        names = np.bincount(dec, minlength=W)[:L]
+        agree[r] = names.max() / N
+        success = (da < L) & (da == db)
+        success_n[r] = success.sum()
+        if r == R - 1:
+            final_counts = names
+
+        # Each agent appears at most once per round: scatter partner results into agent order so the
+        # updates below are whole-array passes without collisions
+        heard.fill(L)
+        heard[perm] = dec.reshape(-1, 2)[:, ::-1].ravel()
+        won.fill(False)
+        won[perm] = np.repeat(success, 2)
+        h = heard < L
+        cell = row + heard
+        if K:
+            slot = ring + ptr
+            held = mem[slot]
+            old = np.where(h, held, L)
+            counts[row + old] -= 1
+            mem[slot] = np.where(h, heard, held)
+            ptr += h
+            ptr -= K * (ptr == K)
+        # Cells are distinct across agents, so a gather and a store stand in for an indexed increment
+        c_new = counts[cell] + 1
+        counts[cell] = c_new
+        c_cur = counts[row + np.maximum(modal, 0)]
+        up = h & ((modal < 0) | (c_new > c_cur) | ((c_new == c_cur) & (heard < modal)))
+        if K:
+            # Evicting the modal name can demote it, unless it still holds most of the full ring; only
+            # the other rows need a full argmax
+            redo = (old == modal) & (old != heard) & (2 * c_cur <= K)
+            up &= ~redo
+            ri = np.flatnonzero(redo)
+            if len(ri):
+                modal[ri] = counts.reshape(N, W)[ri, :L].argmax(axis=1)
+        modal = np.where(up, heard, modal)
+
+        # Players adopt their modal name, winners keep theirs, and losers who heard one shift to it
+        # with probability alpha (win-stay / lose-shift)
+        lost = ~won
+        adopt = lost & (modal >= 0)
+        if N > len(perm):
+            # With an odd population the last agent in order sat this round out
+            adopt[order[-1]] = False
+        z = np.where(adopt, modal, z)
+        z = np.where(lost & h & (rng.random(N) < alpha), heard, z)
+    return {"population_agreement": agree, "pair_success": success_n, "round_tokens": tokens_n, "final_name_counts": final_counts}
+
+
+def simulate(cfg: Dict, response: Optional[ConfusionResponse] = None, out_path: Optional[str] = None) -> Dict[str, np.ndarray]:
+    # Aggregate-only counterpart of env.run_game; returns (seeds x rounds) curves
+    L = int(cfg["n_lexicon"])
+    if response is None:
+        response = ConfusionResponse.noisy(L)
+    seeds = int(cfg["seeds"])
+    runs = [simulate_seed(cfg, s, response) for s in range(seeds)]
+    out = {k: np.stack([x[k] for x in runs]) for k in runs[0]}
+    if out_path:
+        ensure_dir("data")
+        condition = str(cfg["condition"]).lower()
+        n_pairs = int(cfg["population"]) // 2
+        with open(out_path, "w", encoding="utf-8") as f:
+            for s in range(seeds):
+                for r in range(int(cfg["rounds"])):
+                    agg = {
+                        "seed": s,
+                        "round": r,
+                        "aggregate": True,
+                        "pairs": n_pairs,
+                        "round_tokens": int(out["round_tokens"][s, r]),
+                        "pair_success": int(out["pair_success"][s, r]),
+                        "population_agreement": float(out["population_agreement"][s, r]),
+                        "condition": condition,
+                        "engine": "numpy",
+                    }
+                    f.write(json.dumps(agg, ensure_ascii=False) + "\n")
+    return out